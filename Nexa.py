@@ -2,48 +2,156 @@
 # Final combined single-file Flask app — includes requested features and cinematic "nexa" splash.
 # Usage:
 #   pip install flask requests werkzeug
-#   python Nexa_Final_Combined.py
+#   python Nexa.py                      (development server; --debug for the reloader, --open for a browser tab)
+#   flask --app Nexa init-db            (create/upgrade the schema once)
+#   gunicorn -c gunicorn.conf.py        (production, see README)
 #   Open http://127.0.0.1:5000
 
 import os
 import re
+import sys
+import json
+import runpy
+import secrets
 import sqlite3
-import webbrowser
+import itertools
+import click
 from datetime import datetime, timedelta
 from flask import (
-    Flask, request, jsonify, session, redirect, url_for,
-    send_from_directory, make_response, render_template_string
+    Flask, Blueprint, Response, request, jsonify, session, redirect, url_for,
+    send_from_directory, make_response, render_template_string, g,
+    has_request_context
 )
-from werkzeug.security import generate_password_hash, check_password_hash
-import requests
+from werkzeug.utils import secure_filename
+import nexa_llm
+import nexa_auth
+import nexa_profile
+import nexa_usage
+import nexa_events
+import nexa_summary
+import nexa_jobs
+import nexa_maintenance
+import nexa_shards
+import nexa_consolidate
+import nexa_store
+from nexa_store import ndjson as nexa_ndjson
 
 # ---------------------------
 # Configuration
 # ---------------------------
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
-app.permanent_session_lifetime = timedelta(days=30)
-
-DB_FILE = "nexa_final.db"
-UPLOAD_FOLDER = "uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-# API key placeholders (kept blank if you don't want to call external APIs)
-OPENROUTER_API_KEY = "OPENROUTER_API_KEY"   # <- add your openrouter / openai key here for LLM integration
-GNEWS_API_KEY = "GNEWS_API_KEY"        # <- optional GNews key
+# Defaults are overridden by the JSON or .py file named in NEXA_CONFIG, then by
+# NEXA_<KEY> environment variables (API keys also read their plain names).
+DEFAULTS = {
+    "DB_FILE": "nexa_final.db",
+    "UPLOAD_FOLDER": "uploads",
+    "SECRET_KEY": None,                                 # None -> generated once and kept in SECRET_FILE
+    "SECRET_FILE": os.path.join("instance", "secret_key"),
+    "SESSION_DAYS": 30,
+    # API key placeholders (kept blank if you don't want to call external APIs)
+    "OPENROUTER_API_KEY": "OPENROUTER_API_KEY",         # <- add your openrouter / openai key here for LLM integration
+    "GNEWS_API_KEY": "GNEWS_API_KEY",                   # <- optional GNews key
+    "MODELS": "gpt-4o-mini",                            # ordered model/endpoint chain, primary first (see nexa_llm.py)
+    "ADMIN_USERS": "",                                  # usernames allowed to see /metrics
+    "SHARDS": 0,                                        # >1: per-user shard files, DB_FILE is the directory (see nexa_shards.py)
+    # password hashing (see nexa_auth.py); changing the method rehashes each user at their next login
+    "PASSWORD_METHOD": "scrypt",                        # werkzeug method, e.g. "scrypt:65536:8:1" or "pbkdf2:sha256:600000"
+    "HASH_WORKERS": 2,                                  # hashing processes per server process
+    "HASH_MAX_PENDING": 4,                              # hashes in flight per server process before sign-ins get 429
+    "LOGIN_LIMIT_IP": "100/60",                         # login/register attempts per client IP per N seconds (classrooms share one IP)
+    "LOGIN_LIMIT_USER": "5/300",                        # failed logins per username per N seconds
+    # request profiling (see nexa_profile.py): admins add ?profile=1 or an X-Nexa-Profile header
+    "PROFILE_DIR": "profiles",
+    "PROFILE_SAMPLE": 0,                                # also profile 1 in N requests (0 = only on request)
+    "PROFILE_TOKEN": "",                                # X-Nexa-Profile value that works without an admin session
+    "QUOTA_DAILY_TOKENS": 0,                            # LLM tokens per user per UTC day, 0 = unlimited (see nexa_usage.py)
+    "EVENT_STREAMS": 0,                                 # open /events streams per process (0 = half of NEXA_THREADS); each holds a server thread
+}
 
-MODEL = "gpt-4o-mini"     # placeholder
+def load_config(overrides: dict = None) -> dict:
+    cfg = dict(DEFAULTS)
+    path = os.getenv("NEXA_CONFIG")
+    if path:
+        if path.endswith(".json"):
+            with open(path, encoding="utf-8") as f: cfg.update(json.load(f))
+        else:
+            cfg.update({k: v for k, v in runpy.run_path(path).items() if k.isupper()})
+    for key in DEFAULTS:
+        val = os.getenv(f"NEXA_{key}")
+        if val is None and key.endswith("_API_KEY"): val = os.getenv(key)
+        if val is not None: cfg[key] = val
+    cfg.update(overrides or {})
+    return cfg
+
+def configure(cfg: dict):
+    """Publish a config dict to the module-level settings used by the helpers below."""
+    global CONFIG, DB_FILE, ROUTER, UPLOAD_FOLDER, OPENROUTER_API_KEY, GNEWS_API_KEY, MODELS, LLM, ADMIN_USERS
+    global HASHER, IP_LIMIT, USER_LIMIT, PROFILER, METER, EVENTS
+    CONFIG = cfg
+    DB_FILE = cfg["DB_FILE"]
+    ROUTER = nexa_shards.Router(DB_FILE, int(cfg["SHARDS"] or 0))
+    UPLOAD_FOLDER = cfg["UPLOAD_FOLDER"]
+    OPENROUTER_API_KEY = cfg["OPENROUTER_API_KEY"]
+    GNEWS_API_KEY = cfg["GNEWS_API_KEY"]
+    MODELS = cfg["MODELS"]
+    LLM = nexa_llm.HedgedClient(nexa_llm.parse_chain(MODELS), OPENROUTER_API_KEY)
+    if "METER" in globals(): METER.flush()
+    METER = nexa_usage.Meter(DB_FILE, int(cfg["QUOTA_DAILY_TOKENS"] or 0))
+    LLM.on_usage = METER.record
+    users = cfg["ADMIN_USERS"]
+    ADMIN_USERS = set(users) if isinstance(users, (list, set, tuple)) else {u.strip() for u in users.split(",") if u.strip()}
+    if "HASHER" in globals(): HASHER.shutdown()
+    HASHER = nexa_auth.PasswordHasher(cfg["PASSWORD_METHOD"], int(cfg["HASH_WORKERS"]), int(cfg["HASH_MAX_PENDING"]))
+    IP_LIMIT = nexa_auth.RateLimiter(*nexa_auth.parse_limit(cfg["LOGIN_LIMIT_IP"]))
+    USER_LIMIT = nexa_auth.RateLimiter(*nexa_auth.parse_limit(cfg["LOGIN_LIMIT_USER"]))
+    if "EVENTS" not in globals(): EVENTS = nexa_events.Broker()     # kept across reconfigure: streams hold it
+    EVENTS.max_streams = int(cfg["EVENT_STREAMS"] or 0) or max(4, int(os.getenv("NEXA_THREADS", "32")) // 2)
+    PROFILER = nexa_profile.Profiler(cfg["PROFILE_DIR"], int(cfg["PROFILE_SAMPLE"] or 0))
+    if "JOBS" in globals(): JOBS.db_path = DB_FILE
+    return cfg
+
+def load_secret_key(cfg: dict):
+    """Configured key, else the one persisted in SECRET_FILE (created once, shared by all workers)."""
+    if cfg.get("SECRET_KEY"):
+        return cfg["SECRET_KEY"]
+    path = cfg["SECRET_FILE"]
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f: f.write(secrets.token_hex(32))
+        os.chmod(tmp, 0o600)
+        try: os.link(tmp, path)         # atomic create-if-absent: racing workers all keep the first key
+        except FileExistsError: pass
+        finally: os.unlink(tmp)
+    with open(path) as f:
+        return f.read().strip()
+
+configure(load_config())
+
+bp = Blueprint("nexa", __name__)
 
 # ---------------------------
 # Database utilities
 # ---------------------------
-def get_db_conn():
-    conn = sqlite3.connect(DB_FILE, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+# DB_FILE holds users and jobs; conversations live in ROUTER's shard files
+# (DB_FILE itself unless SHARDS > 1). Helpers route by user or conversation id.
+def get_db_conn(path: str = None):
+    conn = sqlite3.connect(path or DB_FILE, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
     conn.row_factory = sqlite3.Row
+    nexa_profile.trace(conn)
     return conn
 
+def conv_conn(conv_id: int):
+    return get_db_conn(ROUTER.conv_db(conv_id))
+
+def user_store(user: str) -> nexa_store.Store:
+    return nexa_store.get(ROUTER.user_db(user))
+
+def conv_store(conv_id: int) -> nexa_store.Store:
+    return nexa_store.get(ROUTER.conv_db(conv_id))
+
 def init_db():
     conn = get_db_conn()
+    nexa_maintenance.prepare(conn)      # must precede the first CREATE TABLE
     c = conn.cursor()
     c.execute("""
     CREATE TABLE IF NOT EXISTS users (
@@ -51,27 +159,26 @@ def init_db():
       username TEXT UNIQUE NOT NULL,
       password TEXT NOT NULL
     )""")
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS conversations (
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      user TEXT NOT NULL,
-      title TEXT,
-      created TEXT NOT NULL
-    )""")
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS messages (
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      conversation_id INTEGER,
-      sender TEXT,
-      role TEXT,
-      content TEXT,
-      image TEXT,
-      timestamp TEXT
-    )""")
-    conn.commit()
+    nexa_shards.ensure_directory(conn)
+    nexa_jobs.ensure_schema(conn)
+    nexa_usage.ensure_schema(conn)
+    if ROUTER.sharded:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.commit(); conn.close()
+        for i in range(ROUTER.count):
+            conn = get_db_conn(ROUTER.path(i))
+            nexa_maintenance.prepare(conn)
+            init_data_tables(conn, i)
+            conn.close()
+        return
+    init_data_tables(conn, 0)
     conn.close()
 
-init_db()
+def init_data_tables(conn, shard: int):
+    nexa_store.ensure_schema(conn)      # conversations/messages, shared with Nexa_Streamlit.py
+    nexa_shards.ensure_id_base(conn, shard)
+    conn.execute("PRAGMA journal_mode=WAL")     # readers don't block the writer across worker processes
+    conn.commit()
 
 # ---------------------------
 # Title extractor (lightweight)
@@ -99,12 +206,18 @@ def simple_main_motive(text: str, max_words: int = 5) -> str:
     return title.capitalize() if title else "New chat"
 
 # ---------------------------
-# Auth helpers
+# Auth helpers (hashing runs on HASHER's process pool and may raise nexa_auth.Busy)
 # ---------------------------
 def create_user(username: str, password: str):
+    pwhash = HASHER.hash(password)
     conn = get_db_conn(); c = conn.cursor()
-    c.execute("INSERT INTO users (username, password) VALUES (?, ?)",
-              (username, generate_password_hash(password)))
+    c.execute("INSERT INTO users (username, password, shard) VALUES (?, ?, ?)",
+              (username, pwhash, ROUTER.place(username) if ROUTER.sharded else None))
+    conn.commit(); conn.close()
+
+def set_password_hash(username: str, pwhash: str):
+    conn = get_db_conn()
+    conn.execute("UPDATE users SET password=? WHERE username=?", (pwhash, username))
     conn.commit(); conn.close()
 
 def verify_user(username: str, password: str) -> bool:
@@ -112,51 +225,89 @@ def verify_user(username: str, password: str) -> bool:
     c.execute("SELECT password FROM users WHERE username=?", (username,))
     row = c.fetchone(); conn.close()
     if not row: return False
-    return check_password_hash(row["password"], password)
+    if not HASHER.verify(row["password"], password): return False
+    if HASHER.needs_rehash(row["password"]):
+        # upgrade to the configured method in the background; this login doesn't wait
+        HASHER.rehash_later(password, lambda pwhash: set_password_hash(username, pwhash))
+    return True
+
+def too_many_attempts(retry_after: int, back: str):
+    return (f"<h3>Too many attempts, try again in {retry_after}s</h3><a href='{back}'>Back</a>",
+            429, {"Retry-After": str(retry_after)})
 
 # ---------------------------
-# Conversation helpers
+# Conversation helpers (nexa_store; every write bumps the ETag version counters)
 # ---------------------------
+def user_version(user: str) -> int:
+    return user_store(user).user_version(user)
+
+def conversation_version(conv_id: int):
+    return conv_store(conv_id).conversation_version(conv_id)
+
+def publish(user: str, event: str, data: dict):
+    # the tab that made the change recognizes its own echo by origin
+    if has_request_context(): data = dict(data, origin=request.headers.get("X-Nexa-Client"))
+    EVENTS.publish(user, event, data)
+
 def create_conversation(user: str) -> int:
-    conn = get_db_conn(); c = conn.cursor()
-    created = datetime.utcnow().isoformat()
-    c.execute("INSERT INTO conversations (user, title, created) VALUES (?, ?, ?)", (user, None, created))
-    conn.commit(); cid = c.lastrowid; conn.close()
-    return cid
+    conv_id = user_store(user).create_conversation(user)
+    publish(user, "conversation_created", {"id": conv_id, "title": None})
+    return conv_id
+
+def get_conversation(conv_id: int, user: str):
+    return conv_store(conv_id).get_conversation(conv_id, user)
 
 def list_conversations(user: str):
-    conn = get_db_conn(); c = conn.cursor()
-    c.execute("SELECT id, title, created FROM conversations WHERE user=? ORDER BY id DESC", (user,))
-    rows = c.fetchall(); conn.close()
-    return [dict(id=r["id"], title=(r["title"] if r["title"] else "New chat"), created=r["created"]) for r in rows]
+    return [dict(id=c.id, title=(c.title if c.title else "New chat"), created=c.created)
+            for c in user_store(user).list_conversations(user)]
 
 def rename_conversation_once(conv_id: int, title: str):
-    conn = get_db_conn(); c = conn.cursor()
-    c.execute("SELECT title FROM conversations WHERE id=?", (conv_id,))
-    row = c.fetchone()
-    if row and not row["title"]:
-        c.execute("UPDATE conversations SET title=? WHERE id=?", (title, conv_id))
-        conn.commit()
-    conn.close()
+    owner = conv_store(conv_id).rename_conversation(conv_id, title, only_if_untitled=True)
+    if owner: publish(owner, "title_changed", {"id": conv_id, "title": title})
+
+def rename_conversation(conv_id: int, user: str, title: str):
+    if conv_store(conv_id).rename_conversation(conv_id, title, user=user):
+        publish(user, "title_changed", {"id": conv_id, "title": title})
 
 def delete_conversation(conv_id: int):
-    conn = get_db_conn(); c = conn.cursor()
-    c.execute("DELETE FROM messages WHERE conversation_id=?", (conv_id,))
-    c.execute("DELETE FROM conversations WHERE id=?", (conv_id,))
-    conn.commit(); conn.close()
+    # chunked so a long conversation never holds the write lock for long
+    owner = conv_store(conv_id).delete_conversation(conv_id)
+    if owner: publish(owner, "conversation_deleted", {"id": conv_id})
 
-def save_message(conv_id: int, sender: str, role: str, content: str, image: str = None):
-    ts = datetime.utcnow().isoformat()
-    conn = get_db_conn(); c = conn.cursor()
-    c.execute("INSERT INTO messages (conversation_id, sender, role, content, image, timestamp) VALUES (?,?,?,?,?,?)",
-              (conv_id, sender, role, content, image, ts))
-    conn.commit(); conn.close()
+def save_message(conv_id: int, sender: str, role: str, content: str, image: str = None, user: str = None):
+    """user (the conversation's owner, when the caller knows it) gets a message_added event."""
+    conv_store(conv_id).save_message(conv_id, role, content, sender=sender, image=image)
+    if user:
+        publish(user, "message_added", {"conv_id": conv_id, "role": role, "content": content, "image": image})
 
-def load_messages(conv_id: int):
-    conn = get_db_conn(); c = conn.cursor()
-    c.execute("SELECT sender, role, content, image, timestamp FROM messages WHERE conversation_id=? ORDER BY id", (conv_id,))
-    rows = c.fetchall(); conn.close()
-    return [dict(sender=r["sender"], role=r["role"], content=r["content"], image=r["image"], timestamp=r["timestamp"]) for r in rows]
+def load_messages(conv_id: int, limit: int = None, before: int = None):
+    return [m.as_dict() for m in conv_store(conv_id).load_messages(conv_id, limit, before)]
+
+# ---------------------------
+# Background jobs (post-response work, persisted in the jobs table)
+# ---------------------------
+JOBS = nexa_jobs.JobQueue(DB_FILE)
+
+def defer(name: str, payload: dict, key: str = None, inline_if_full: bool = False):
+    try:
+        JOBS.enqueue(name, payload, key=key)
+    except nexa_jobs.QueueFull:
+        # backpressure: cheap, user-visible work still happens; the rest is dropped
+        if inline_if_full:
+            JOBS.run_now(name, payload)
+
+@JOBS.handler("rename_once")
+def rename_once_job(p):
+    rename_conversation_once(p["conv_id"], p["title"])
+
+# folding of long conversations into conversations.summary
+SUMMARIZER = nexa_summary.Summarizer(
+    conv_conn, lambda msgs: LLM.complete(msgs, timeout=60, tags={"mode": "summary"}),
+    submit=lambda cid: defer("summarize", {"conv_id": cid}, key=f"summarize:{cid}"))
+
+@JOBS.handler("summarize")
+def summarize_job(p):
+    SUMMARIZER.fold(p["conv_id"])
 
 # ---------------------------
 # News helper (optional)
@@ -165,6 +316,7 @@ def get_news(query: str, max_results: int = 4):
     if not GNEWS_API_KEY:
         return f"(No news API key) You searched: {query}"
     try:
+        import requests
         url = f"https://gnews.io/api/v4/search?q={requests.utils.requote_uri(query)}&token={GNEWS_API_KEY}&lang=en&max={max_results}"
         r = requests.get(url, timeout=8); r.raise_for_status()
         arts = r.json().get("articles", [])
@@ -177,7 +329,7 @@ def get_news(query: str, max_results: int = 4):
 # ---------------------------
 # Serve uploads
 # ---------------------------
-@app.route("/uploads/<path:filename>")
+@bp.route("/uploads/<path:filename>")
 def uploaded_file(filename):
     return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=False)
 
@@ -363,6 +515,7 @@ window.addEventListener('load', () => {
 function initApp(){
   fetch('/whoami').then(r=>r.json()).then(j=>{ if(j.user) document.getElementById('userLabel').textContent = j.user; });
   loadConversations();
+  connectEvents();
   loadPersona();
   loadVoiceFromServer();
   showRandomSuggestions();
@@ -427,11 +580,29 @@ function loadPersona(){ fetch('/get_persona').then(r=>r.json()).then(j=>{ person
 function setPersona(p){ persona = p; fetch('/set_persona', {method:'POST', body: new URLSearchParams({persona: p})}); }
 function togglePersona(){ const sel = document.getElementById('personaSelect'); const next = sel.value === 'Friendly' ? 'Neutral' : sel.value === 'Neutral' ? 'Cheerful' : sel.value === 'Cheerful' ? 'Professional' : 'Friendly'; sel.value = next; setPersona(next); }
 
+/* Conditional GET: resend the cached ETag, reuse the cached body on 304 */
+const etagCache = {};
+async function fetchJSONCached(url){
+  const hit = etagCache[url];
+  const res = await fetch(url, {cache: 'no-store', headers: hit ? {'If-None-Match': hit.etag} : {}});
+  if(res.status === 304 && hit) return hit.data;
+  const data = await res.json();
+  const etag = res.headers.get('ETag');
+  if(etag) etagCache[url] = {etag, data}; else delete etagCache[url];
+  return data;
+}
+
 /* Conversations list */
+let convItems = [];
 async function loadConversations(){
-  const res = await fetch('/conversations'); const list = await res.json();
+  convItems = (await fetchJSONCached('/conversations')).slice();
+  renderConversations();
+}
+/* list only re-fetched when the event stream is down */
+function refreshConversations(){ if(!eventsLive) loadConversations(); }
+function renderConversations(){
   const container = document.getElementById('convList'); container.innerHTML = '';
-  list.forEach(item=>{
+  convItems.forEach(item=>{
     const el = document.createElement('div'); el.className = 'conv-item';
     const left = document.createElement('div'); left.className = 'conv-title-text'; left.textContent = item.title || 'New chat';
     left.onclick = ()=> openConversation(item.id);
@@ -452,9 +623,9 @@ function showConvMenu(ev, convId){
   menu.style.position='fixed'; menu.style.left = ev.clientX + 'px'; menu.style.top = ev.clientY + 'px';
   menu.style.background = '#071018'; menu.style.border = '1px solid rgba(255,255,255,0.04)'; menu.style.padding = '8px'; menu.style.borderRadius = '6px'; menu.style.zIndex = 9999;
   const ren = document.createElement('div'); ren.style.padding='6px'; ren.style.cursor='pointer'; ren.innerText='Rename';
-  ren.onclick = ()=>{ const t=prompt('New title:'); if(t){ fetch('/rename_conversation', {method:'POST', body:new URLSearchParams({id:convId, title:t})}).then(()=>{ loadConversations(); menu.remove(); }); } else menu.remove(); };
+  ren.onclick = ()=>{ const t=prompt('New title:'); if(t){ fetch('/rename_conversation', {method:'POST', body:new URLSearchParams({id:convId, title:t})}).then(()=>{ refreshConversations(); menu.remove(); }); } else menu.remove(); };
   const del = document.createElement('div'); del.style.padding='6px'; del.style.cursor='pointer'; del.innerText='Delete';
-  del.onclick = ()=>{ if(confirm('Delete this conversation?')){ fetch('/delete_conversation', {method:'POST', body:new URLSearchParams({id:convId})}).then(()=>{ if(currentConv==convId){ currentConv=null; document.getElementById('messages').innerHTML=''; document.getElementById('convTitle').innerText='Welcome to Nexa'; allowSuggestionsAgain(); showRandomSuggestions(); } loadConversations(); menu.remove(); }); } else menu.remove(); };
+  del.onclick = ()=>{ if(confirm('Delete this conversation?')){ fetch('/delete_conversation', {method:'POST', body:new URLSearchParams({id:convId})}).then(()=>{ if(currentConv==convId){ currentConv=null; document.getElementById('messages').innerHTML=''; document.getElementById('convTitle').innerText='Welcome to Nexa'; allowSuggestionsAgain(); showRandomSuggestions(); } refreshConversations(); menu.remove(); }); } else menu.remove(); };
   menu.appendChild(ren); menu.appendChild(del); document.body.appendChild(menu);
   const rm = ()=>{ if(menu) menu.remove(); document.removeEventListener('click',rm); }; setTimeout(()=>document.addEventListener('click',rm), 10);
 }
@@ -464,38 +635,59 @@ async function openConversation(id){
   currentConv = id;
   const info = await fetch('/conversation_info?id='+id).then(r=>r.json());
   if(info && info.title) document.getElementById('convTitle').innerText = info.title;
-  const msgs = await fetch('/get_messages?conv='+id).then(r=>r.json());
+  const msgs = await fetchJSONCached(messagesUrl(id));
   const msgCont = document.getElementById('messages'); msgCont.innerHTML = '';
   msgs.forEach(m => {
     // user messages appear as bubbles; assistant messages appear as plain assistant-text (per your request)
     if(m.role === 'assistant') addAssistantToUI(m.content, m.image);
     else addMessageToUI(m.content, m.role === 'user' ? 'user' : 'bot', m.image);
   });
+  if(msgs.length === PAGE_SIZE) addEarlierLink(id, msgs[0].id);
   hideSuggestions();
 }
 
+/* Latest page first; older pages on demand */
+const PAGE_SIZE = 50;
+function messagesUrl(id){ return '/get_messages?conv='+id+'&limit='+PAGE_SIZE; }
+function addEarlierLink(id, before){
+  const msgCont = document.getElementById('messages');
+  const link = document.createElement('div'); link.className = 'assistant-text'; link.style.cursor = 'pointer'; link.style.color = '#0ff';
+  link.innerText = 'Load earlier messages';
+  link.onclick = async ()=>{
+    const older = await fetch('/get_messages?conv='+id+'&limit='+PAGE_SIZE+'&before='+before).then(r=>r.json());
+    if(currentConv != id) return;
+    const height = msgCont.scrollHeight, tmp = document.createElement('div');
+    older.forEach(m => { if(m.role === 'assistant') addAssistantToUI(m.content, m.image, tmp); else addMessageToUI(m.content, m.role === 'user' ? 'user' : 'bot', m.image, tmp); });
+    link.remove();
+    msgCont.prepend(...tmp.childNodes);
+    if(older.length === PAGE_SIZE) addEarlierLink(id, older[0].id);
+    msgCont.scrollTop = msgCont.scrollHeight - height;
+  };
+  msgCont.prepend(link);
+}
+
 /* Create / rename / delete conv */
 async function createNew(){
   const res = await fetch('/new_conversation', {method:'POST'}); const j = await res.json();
-  if(j.id){ currentConv = j.id; document.getElementById('convTitle').innerText = 'New chat'; document.getElementById('messages').innerHTML = ''; allowSuggestionsAgain(); showRandomSuggestions(); loadConversations(); }
+  if(j.id){ currentConv = j.id; document.getElementById('convTitle').innerText = 'New chat'; document.getElementById('messages').innerHTML = ''; allowSuggestionsAgain(); showRandomSuggestions(); refreshConversations(); }
 }
 async function renameCurrent(){
   if(!currentConv){ alert('Select a conversation first'); return; }
   const newTitle = prompt('Enter new title:'); if(!newTitle) return;
   await fetch('/rename_conversation', {method:'POST', body: new URLSearchParams({id: currentConv, title: newTitle})});
-  loadConversations(); document.getElementById('convTitle').innerText = newTitle;
+  refreshConversations(); document.getElementById('convTitle').innerText = newTitle;
 }
 async function deleteCurrent(){
   if(!currentConv){ alert('Select a conversation first'); return; }
   if(!confirm('Delete this conversation?')) return;
   await fetch('/delete_conversation', {method:'POST', body: new URLSearchParams({id: currentConv})});
   currentConv = null; document.getElementById('messages').innerHTML = ''; document.getElementById('convTitle').innerText = 'Welcome to Nexa';
-  allowSuggestionsAgain(); showRandomSuggestions(); loadConversations();
+  allowSuggestionsAgain(); showRandomSuggestions(); refreshConversations();
 }
 
 /* Add user bubble to UI */
-function addMessageToUI(text, sender, image=null){
-  const container = document.getElementById('messages');
+function addMessageToUI(text, sender, image=null, into=null){
+  const container = into || document.getElementById('messages');
   const row = document.createElement('div');
   row.className = 'msg-row ' + (sender === 'user' ? 'user' : 'bot');
   const bubble = document.createElement('div');
@@ -510,8 +702,8 @@ function addMessageToUI(text, sender, image=null){
 }
 
 /* Add assistant text (no bubble framing) */
-function addAssistantToUI(text, image=null){
-  const container = document.getElementById('messages');
+function addAssistantToUI(text, image=null, into=null){
+  const container = into || document.getElementById('messages');
   const el = document.createElement('div');
   el.className = 'assistant-text';
   el.innerText = text || '';
@@ -545,7 +737,7 @@ async function sendMessage(){
   if(file) fd.append('image', file);
 
   try{
-    const res = await fetch('/chat', {method:'POST', body: fd});
+    const res = await fetch('/chat', {method:'POST', body: fd, headers: {'X-Nexa-Client': clientId}});
     const j = await res.json();
     const t = document.getElementById('thinking'); if(t) t.remove();
 
@@ -564,13 +756,47 @@ async function sendMessage(){
       }
     }
     if(j.conv_id){ currentConv = j.conv_id; document.getElementById('convTitle').innerText = j.title || document.getElementById('convTitle').innerText; }
-    loadConversations();
+    refreshConversations();
   }catch(err){
     const t = document.getElementById('thinking'); if(t) t.remove();
     addAssistantToUI('Error: ' + String(err), null);
   }
 }
 
+/* Server push (/events): other tabs' and background changes patch the page in place */
+const clientId = Math.random().toString(36).slice(2);
+let eventsLive = false, eventsOpened = false;
+function connectEvents(){
+  if(!window.EventSource) return;
+  const es = new EventSource('/events');
+  es.onopen = ()=>{
+    // anything published while reconnecting is picked up by one conditional GET
+    if(eventsOpened){ loadConversations(); refreshCurrent(); }
+    eventsLive = eventsOpened = true;
+  };
+  es.onerror = ()=>{ eventsLive = false; if(es.readyState === EventSource.CLOSED) setTimeout(connectEvents, 30000); };
+  const on = (name, fn)=> es.addEventListener(name, e=> fn(JSON.parse(e.data)));
+  on('conversation_created', d=>{ if(!convItems.some(c=>c.id==d.id)){ convItems.unshift({id: d.id, title: d.title || 'New chat'}); renderConversations(); } });
+  on('title_changed', d=>{
+    const c = convItems.find(c=>c.id==d.id); if(c){ c.title = d.title; renderConversations(); }
+    if(currentConv==d.id) document.getElementById('convTitle').innerText = d.title;
+  });
+  on('conversation_deleted', d=>{
+    convItems = convItems.filter(c=>c.id!=d.id); renderConversations();
+    if(currentConv==d.id){ currentConv=null; document.getElementById('messages').innerHTML=''; document.getElementById('convTitle').innerText='Welcome to Nexa'; }
+  });
+  on('message_added', d=>{
+    if(d.origin === clientId || currentConv != d.conv_id) return;
+    if(d.role === 'assistant') addAssistantToUI(d.content, d.image); else addMessageToUI(d.content, 'user', d.image);
+  });
+  on('resync', ()=>{ loadConversations(); refreshCurrent(); });
+}
+async function refreshCurrent(){
+  if(!currentConv) return;
+  const url = messagesUrl(currentConv), before = etagCache[url] && etagCache[url].data;
+  if(await fetchJSONCached(url) !== before) openConversation(currentConv);
+}
+
 /* History & auth helpers */
 function openHistory(){ window.location.href = '/history'; }
 function logout(){ fetch('/logout').then(()=>window.location.href='/login'); }
@@ -587,27 +813,36 @@ function logout(){ fetch('/logout').then(()=>window.location.href='/login'); }
 # ---------------------------
 # Flask routes / API
 # ---------------------------
-@app.route("/whoami")
+@bp.route("/whoami")
 def whoami():
     return jsonify({"user": session.get("user")})
 
 # Auth: login/register/logout
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login_route():
     if request.method == "POST":
         username = request.form.get("username","").strip()
         password = request.form.get("password","").strip()
         remember = bool(request.form.get("remember"))
-        if verify_user(username, password):
+        # a username under attack is refused before any hashing is spent on it
+        wait = IP_LIMIT.hit(request.remote_addr or "-") or USER_LIMIT.retry_after(username)
+        if wait: return too_many_attempts(wait, "/login")
+        try:
+            ok = verify_user(username, password)
+        except nexa_auth.Busy:
+            return too_many_attempts(2, "/login")
+        if ok:
+            USER_LIMIT.reset(username)
             session["user"] = username
             session.permanent = True
             if "voice_enabled" not in session:
                 session["voice_enabled"] = True
-            resp = make_response(redirect(url_for("index")))
+            resp = make_response(redirect(url_for(".index")))
             if remember:
                 resp.set_cookie("nexa_user", username, max_age=60*60*24*30)
             return resp
         else:
+            USER_LIMIT.hit(username)
             return "<h3>Invalid credentials</h3><a href='/login'>Try again</a>"
     return """
     <html><head><meta name='viewport' content='width=device-width,initial-scale=1'>
@@ -616,17 +851,21 @@ def login_route():
     <div style='margin-top:10px;color:#9fb8c9'>Or <a href='/register' style='color:#0ff'>register</a></div></body></html>
     """
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register_route():
     if request.method == "POST":
         username = request.form.get("username","").strip()
         password = request.form.get("password","").strip()
         if not username or not password:
             return "<h3>Missing fields</h3><a href='/register'>Back</a>"
+        wait = IP_LIMIT.hit(request.remote_addr or "-")
+        if wait: return too_many_attempts(wait, "/register")
         try:
             create_user(username, password)
             session["user"] = username; session.permanent = True; session["voice_enabled"] = True
-            return redirect(url_for("index"))
+            return redirect(url_for(".index"))
+        except nexa_auth.Busy:
+            return too_many_attempts(2, "/register")
         except Exception as e:
             return f"<h3>Error: {e}</h3><a href='/register'>Back</a>"
     return """
@@ -635,13 +874,13 @@ def register_route():
     <div style='margin-top:10px;color:#9fb8c9'>Already registered? <a href='/login' style='color:#0ff'>Login</a></div></body></html>
     """
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout_route():
     session.pop("user", None); session.pop("voice_enabled", None)
-    resp = make_response(redirect(url_for("login_route"))); resp.set_cookie("nexa_user","",expires=0); return resp
+    resp = make_response(redirect(url_for(".login_route"))); resp.set_cookie("nexa_user","",expires=0); return resp
 
 # main UI
-@app.route("/")
+@bp.route("/")
 def index():
     if "user" not in session:
         cookie_user = request.cookies.get("nexa_user")
@@ -649,45 +888,61 @@ def index():
             session["user"] = cookie_user; session.permanent = True; 
             if "voice_enabled" not in session: session["voice_enabled"] = True
         else:
-            return redirect(url_for("login_route"))
+            return redirect(url_for(".login_route"))
     return render_template_string(INDEX_HTML)
 
 # conversation endpoints
-@app.route("/new_conversation", methods=["POST"])
+@bp.route("/new_conversation", methods=["POST"])
 def new_conversation_api():
     user = session.get("user")
     if not user: return jsonify({"error":"login required"}), 401
     conv_id = create_conversation(user)
     return jsonify({"id": conv_id})
 
-@app.route("/conversations")
+# per-user Server-Sent Events: the page patches its sidebar/messages from these
+@bp.route("/events")
+def events_api():
+    user = session.get("user")
+    if not user: return ("", 401)
+    try:
+        q = EVENTS.subscribe(user)
+    except nexa_events.TooManyStreams:
+        return ("", 503, {"Retry-After": "30"})        # the page falls back to re-fetching
+    resp = Response(EVENTS.stream(user, lambda: user_store(user).user_counters(user), q), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"; resp.headers["X-Accel-Buffering"] = "no"
+    resp.call_on_close(lambda: EVENTS.unsubscribe(user, q))     # also when the stream never started
+    return resp
+
+@bp.route("/conversations")
 def conversations_api():
     user = session.get("user")
     if not user: return jsonify([])
-    convs = list_conversations(user)
-    return jsonify(convs)
-
-@app.route("/conversation_info")
+    # answered from one indexed lookup when the client's copy is current
+    etag = f"c{user_version(user)}"
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    resp = jsonify(list_conversations(user))
+    resp.set_etag(etag, weak=True); resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@bp.route("/conversation_info")
 def conversation_info():
     user = session.get("user"); conv_id = request.args.get("id")
     if not user or not conv_id: return jsonify({"error":"missing"}), 400
-    conn = get_db_conn(); c = conn.cursor(); c.execute("SELECT id, title FROM conversations WHERE id=? AND user=?", (conv_id, user))
-    row = c.fetchone(); conn.close()
-    if not row: return jsonify({"error":"not found"}), 404
-    return jsonify({"id": row["id"], "title": row["title"]})
+    conv = get_conversation(int(conv_id), user)
+    if not conv: return jsonify({"error":"not found"}), 404
+    return jsonify({"id": conv.id, "title": conv.title})
 
-@app.route("/rename_conversation", methods=["POST"])
+@bp.route("/rename_conversation", methods=["POST"])
 def rename_conv_api():
     user = session.get("user")
     if not user: return ("", 401)
     conv_id = request.form.get("id"); title = request.form.get("title")
     if not conv_id or not title: return ("", 400)
-    conn = get_db_conn(); c = conn.cursor()
-    c.execute("UPDATE conversations SET title=? WHERE id=? AND user=?", (title, conv_id, user))
-    conn.commit(); conn.close()
+    rename_conversation(int(conv_id), user, title)
     return ("", 200)
 
-@app.route("/delete_conversation", methods=["POST"])
+@bp.route("/delete_conversation", methods=["POST"])
 def delete_conv_api():
     user = session.get("user")
     if not user: return ("", 401)
@@ -696,37 +951,50 @@ def delete_conv_api():
     delete_conversation(int(conv_id))
     return ("", 200)
 
-@app.route("/get_messages")
+@bp.route("/get_messages")
 def get_messages_api():
     user = session.get("user")
     if not user: return jsonify([])
     conv = request.args.get("conv")
     if not conv: return jsonify([])
-    msgs = load_messages(int(conv))
-    return jsonify(msgs)
+    # ?limit=N: the newest N (served from the tail cache); &before=<id> pages further back
+    limit = request.args.get("limit", type=int); before = request.args.get("before", type=int)
+    version = conversation_version(int(conv))
+    etag = f"m{conv}.{version}"
+    if version is not None and request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    resp = jsonify(load_messages(int(conv), limit, before))
+    if version is not None:
+        resp.set_etag(etag, weak=True); resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+def not_modified(etag: str):
+    resp = make_response("", 304)
+    resp.set_etag(etag, weak=True); resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 # persona endpoints
-@app.route("/set_persona", methods=["POST"])
+@bp.route("/set_persona", methods=["POST"])
 def set_persona_api():
     if "user" not in session: return ("",401)
     persona = request.form.get("persona","Friendly"); session["persona"] = persona; return ("",200)
 
-@app.route("/get_persona")
+@bp.route("/get_persona")
 def get_persona_api():
     return jsonify({"persona": session.get("persona","Friendly")})
 
 # voice preference endpoints
-@app.route("/set_voice", methods=["POST"])
+@bp.route("/set_voice", methods=["POST"])
 def set_voice_api():
     if "user" not in session: return ("",401)
     voice = request.form.get("voice","1"); session["voice_enabled"] = (voice == "1" or voice.lower()=="true"); return ("",200)
 
-@app.route("/get_voice")
+@bp.route("/get_voice")
 def get_voice_api():
     return jsonify({"voice": bool(session.get("voice_enabled", True))})
 
 # chat endpoint (handles persona logic locally if OPENROUTER_API_KEY is blank)
-@app.route("/chat", methods=["POST"])
+@bp.route("/chat", methods=["POST"])
 def chat_api():
     user = session.get("user")
     if not user: return jsonify({"error":"login required"}), 401
@@ -737,25 +1005,27 @@ def chat_api():
     if image_file and image_file.filename:
         ts = datetime.utcnow().strftime("%Y%m%d%H%M%S")
         safe_name = f"{user}_{ts}_{os.path.basename(image_file.filename)}"
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
         dest = os.path.join(UPLOAD_FOLDER, safe_name)
         image_file.save(dest)
-        image_url = url_for('uploaded_file', filename=safe_name)
+        image_url = url_for('.uploaded_file', filename=safe_name)
 
+    title = None
     if not conv_id:
         conv_id = create_conversation(user)
     else:
-        conn = get_db_conn(); c = conn.cursor()
-        c.execute("SELECT id FROM conversations WHERE id=? AND user=?", (conv_id, user))
-        if not c.fetchone(): conv_id = create_conversation(user)
-        conn.close()
+        conv = get_conversation(int(conv_id), user)
+        if conv: title = conv.title
+        else: conv_id = create_conversation(user)
+    conv_id = int(conv_id)
 
     # Save the user message
-    save_message(conv_id, user, "user", text, image_url)
+    save_message(conv_id, user, "user", text, image_url, user=user)
 
-    # Auto-generate title once
-    if text:
-        motive = simple_main_motive(text, max_words=5)
-        rename_conversation_once(int(conv_id), motive)
+    # Auto-generate title once (the response carries it; the write is deferred)
+    if text and not title:
+        title = simple_main_motive(text, max_words=5)
+        defer("rename_once", {"conv_id": conv_id, "title": title}, inline_if_full=True)
 
     # If starts with "news:" handle via news helper
     reply = ""
@@ -764,20 +1034,21 @@ def chat_api():
         reply = get_news(topic)
     else:
         # If API key is provided, attempt to call LLM via openrouter / openai compatible endpoint
-        if OPENROUTER_API_KEY:
+        if OPENROUTER_API_KEY and not METER.allow(user):
+            reply = "(Daily usage limit reached) Please try again tomorrow."
+        elif OPENROUTER_API_KEY:
             try:
-                headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
-                history = load_messages(int(conv_id))
+                # summary of older turns + the turns not yet folded into it
+                summary, recent = conv_store(conv_id).prompt_context(conv_id)
                 messages = [{"role":"system","content":f"You are Nexa, a helpful assistant. Persona: {session.get('persona','Friendly')}."}]
-                for m in history:
-                    role = "assistant" if m["role"] == "assistant" else "user"
-                    messages.append({"role": role, "content": m["content"]})
+                if summary:
+                    messages.append(nexa_summary.summary_message(summary))
+                for _, role, content in recent:
+                    role = "assistant" if role == "assistant" else "user"
+                    messages.append({"role": role, "content": content})
                 messages.append({"role":"user","content": text})
-                payload = {"model": MODEL, "messages": messages}
-                r = requests.post("https://openrouter.ai/api/v1/chat/completions", json=payload, headers=headers, timeout=18)
-                r.raise_for_status()
-                raw = r.json()
-                reply = raw["choices"][0]["message"]["content"]
+                SUMMARIZER.maybe_schedule(conv_id, len(recent))
+                reply = LLM.complete(messages, timeout=18, tags={"user": user, "mode": "chat"})
             except Exception as e:
                 reply = f"(LLM error) {e}"
         else:
@@ -798,46 +1069,198 @@ def chat_api():
             else:
                 reply = f"[{p}] I heard: {text or '(image)'}"
 
-    # Save assistant reply
-    save_message(conv_id, "assistant", "assistant", reply, None)
-
-    # Get conversation title
-    conn = get_db_conn(); c = conn.cursor(); c.execute("SELECT title FROM conversations WHERE id=?", (conv_id,))
-    row = c.fetchone(); conn.close()
-    t = row["title"] if row else None
-
-    return jsonify({"reply": reply, "image": image_url, "conv_id": conv_id, "title": t})
+    # Save assistant reply (kept inline: the next turn's prompt must see it)
+    save_message(conv_id, "assistant", "assistant", reply, None, user=user)
+
+    return jsonify({"reply": reply, "image": image_url, "conv_id": conv_id, "title": title})
+
+@bp.errorhandler(nexa_shards.UnknownShard)
+def unknown_shard(e):
+    return jsonify({"error": "not found"}), 404
+
+# admin metrics (LLM hedge/win-rate stats)
+@bp.route("/metrics")
+def metrics_api():
+    if session.get("user") not in ADMIN_USERS: return ("", 403)
+    return jsonify({"llm": LLM.stats(), "jobs": JOBS.stats(), "auth": HASHER.stats(), "usage": METER.stats(),
+                    "events": EVENTS.stats(),
+                    "tail_cache": nexa_store.TAILS.stats(), "group_commit": nexa_store.group_commit_stats()})
+
+# admin usage page: token/cost rollups written by nexa_usage
+@bp.route("/usage")
+def usage_page():
+    if session.get("user") not in ADMIN_USERS: return ("", 403)
+    since_day = (datetime.utcnow() - timedelta(days=14)).strftime("%Y-%m-%d")
+    since_hour = (datetime.utcnow() - timedelta(hours=24)).strftime("%Y-%m-%dT%H")
+    return nexa_usage.report_html(METER.rollup("usage_daily", since_day, by=("bucket", "user")),
+                                  METER.rollup("usage_hourly", since_hour, by=("bucket", "mode", "model")))
+
+# request profiling: one capture per flagged or sampled request, written to PROFILE_DIR
+@bp.before_app_request
+def start_profile():
+    flag = request.headers.get("X-Nexa-Profile") or request.args.get("profile")
+    if flag and ((CONFIG["PROFILE_TOKEN"] and flag == CONFIG["PROFILE_TOKEN"]) or session.get("user") in ADMIN_USERS):
+        g.profile = PROFILER.start(f"{request.method} {request.path}", "requested")
+    elif PROFILER.should_sample():
+        g.profile = PROFILER.start(f"{request.method} {request.path}", "sampled")
+
+@bp.teardown_app_request
+def stop_profile(exc):
+    capture = g.pop("profile", None)
+    if capture is not None: capture.stop()
+
+@bp.route("/profiles")
+def profiles_page():
+    if session.get("user") not in ADMIN_USERS: return ("", 403)
+    return nexa_profile.index_html(PROFILER.recent(), lambda name: url_for(".profile_file", name=name))
+
+@bp.route("/profiles/<name>")
+def profile_file(name):
+    if session.get("user") not in ADMIN_USERS: return ("", 403)
+    return send_from_directory(os.path.abspath(PROFILER.out_dir), name, as_attachment=name.endswith(".json"))
 
 # history page
-@app.route("/history")
+@bp.route("/history")
 def history_page():
-    if "user" not in session: return redirect(url_for("login_route"))
+    if "user" not in session: return redirect(url_for(".login_route"))
     user = session["user"]; convs = list_conversations(user)
     html_parts = ["<html><head><meta name='viewport' content='width=device-width,initial-scale=1'><title>History</title>",
                   "<style>body{background:#000;color:#fff;font-family:Inter;padding:20px} a{color:#0ff}</style></head><body>"]
-    html_parts.append("<h2>Conversation History</h2><a href='/'>Back to Chat</a><div style='margin-top:12px'>")
+    html_parts.append("<h2>Conversation History</h2><a href='/'>Back to Chat</a> · <a href='/export'>Export (NDJSON)</a><div style='margin-top:12px'>")
     for conv in convs:
         html_parts.append(f"<div style='padding:12px;border:1px solid rgba(255,255,255,0.03);margin-top:8px;border-radius:8px'><h3>{conv['title'] or 'New chat'}</h3><small style='color:#9fb8c9'>Created: {conv['created']}</small>")
-        conn = get_db_conn(); c = conn.cursor()
-        c.execute("SELECT role, content, image, timestamp FROM messages WHERE conversation_id=? ORDER BY id", (conv["id"],))
-        msgs = c.fetchall(); conn.close()
         html_parts.append("<div style='margin-top:8px'>")
-        for m in msgs:
+        for m in load_messages(conv["id"]):
             html_parts.append(f"<div><b>{m['role'].capitalize()}:</b> {m['content']}</div>")
             if m['image']:
                 html_parts.append(f"<div><img src='{m['image']}' style='max-width:220px;margin-top:6px;border-radius:6px'></div>")
             html_parts.append(f"<small style='color:#9fb8c9'>At: {m['timestamp']}</small><hr style='border-color:rgba(255,255,255,0.03)'>")
         html_parts.append("</div></div>")
+    archived = nexa_maintenance.list_archived(ROUTER.user_db(user), user)
+    if archived:
+        html_parts.append("<h2 style='margin-top:24px'>Archived</h2>")
+        for a in archived:
+            html_parts.append(f"<form method='POST' action='/restore_conversation' style='padding:12px;border:1px solid rgba(255,255,255,0.03);margin-top:8px;border-radius:8px'>"
+                              f"<b>{a['title']}</b> <small style='color:#9fb8c9'>{a['messages']} messages · archived {a['archived_at'][:10]}</small> "
+                              f"<input type='hidden' name='id' value='{a['id']}'><button>Restore</button></form>")
     html_parts.append("</div></body></html>")
     return "".join(html_parts)
 
+# streamed gzipped NDJSON of the user's conversations (see nexa_store/ndjson.py)
+@bp.route("/export")
+def export_api():
+    user = session.get("user")
+    if not user: return redirect(url_for(".login_route"))
+    records = nexa_ndjson.iter_records(ROUTER.user_db(user), user)
+    resp = Response(nexa_ndjson.gzip_ndjson(records), mimetype="application/gzip")
+    resp.headers["Content-Disposition"] = f'attachment; filename="nexa-{secure_filename(user) or "export"}.ndjson.gz"'
+    return resp
+
+# archived conversations (moved out by nexa_maintenance retention rules)
+@bp.route("/archived")
+def archived_api():
+    user = session.get("user")
+    if not user: return jsonify([])
+    return jsonify(nexa_maintenance.list_archived(ROUTER.user_db(user), user))
+
+@bp.route("/restore_conversation", methods=["POST"])
+def restore_conv_api():
+    user = session.get("user")
+    if not user: return ("", 401)
+    conv_id = request.form.get("id")
+    if not conv_id: return ("", 400)
+    if not nexa_maintenance.restore_conversation(ROUTER.user_db(user), int(conv_id), user): return ("", 404)
+    if request.accept_mimetypes.accept_html: return redirect(url_for(".history_page"))
+    return ("", 200)
+
 # ---------------------------
-# Run
+# App factory
 # ---------------------------
-if __name__ == "__main__":
-    print("🚀 Nexa UI running at http://127.0.0.1:5000")
-    try: webbrowser.open("http://127.0.0.1:5000")
-    except: pass
-    app.run(host="0.0.0.0", port=5000, debug=True)
-
+# Settings are process-wide (module globals published by configure(), which
+# the helpers, job threads and CLI commands read outside any request). So there
+# is one configuration per process: a second create_app() with other settings
+# raises rather than silently reconfiguring the app that already exists.
+APP_CONFIG = None           # the settings the process's app was built with
+
+def create_app(config: dict = None) -> Flask:
+    """Build the Flask app; `config` overrides are applied process-wide via configure().
+    The schema is not touched here; run `flask --app Nexa init-db` (or let
+    gunicorn.conf.py do it in the master) once per deployment."""
+    global APP_CONFIG
+    cfg = load_config(config) if config else CONFIG
+    if APP_CONFIG is not None and cfg != APP_CONFIG:
+        raise RuntimeError("Nexa settings are process-wide and an app was already created with other ones; "
+                           "use one configuration per process")
+    if cfg is not CONFIG: configure(cfg)
+    APP_CONFIG = cfg
+    app = Flask(__name__)
+    app.config["NEXA"] = cfg
+    app.secret_key = load_secret_key(cfg)
+    app.permanent_session_lifetime = timedelta(days=int(cfg["SESSION_DAYS"]))
+    app.register_blueprint(bp)
+
+    @app.cli.command("init-db")
+    def init_db_command():
+        """Create or upgrade the database schema."""
+        init_db()
+        print(f"Initialized {DB_FILE}")
+
+    @app.cli.command("maintenance")
+    def maintenance_command():
+        """Archive idle conversations, sweep orphans and reclaim free pages."""
+        for path in ROUTER.paths(): nexa_maintenance.run(path)
+
+    @app.cli.command("consolidate")
+    @click.argument("sources", nargs=-1, required=True)
+    @click.option("--retire", is_flag=True, help="Rename each fully merged source to <name>.merged.")
+    def consolidate_command(sources, retire):
+        """Merge legacy chat databases into DB_FILE (resumable; safe while serving)."""
+        if ROUTER.sharded:
+            raise click.ClickException("consolidate into the single-file database before `nexa_shards.py split`")
+        init_db()
+        for src in sources:
+            if nexa_consolidate.consolidate(DB_FILE, src) and retire:
+                os.replace(src, src + ".merged")
+
+    @app.cli.command("export")
+    @click.argument("path")
+    @click.option("--user", default=None, help="Only this user's conversations.")
+    def export_command(path, user):
+        """Write conversations and messages to PATH as gzipped NDJSON."""
+        paths = [ROUTER.user_db(user)] if user else ROUTER.paths()
+        records = itertools.chain.from_iterable(nexa_ndjson.iter_records(p, user) for p in paths)
+        with open(path, "wb") as f:
+            for chunk in nexa_ndjson.gzip_ndjson(records): f.write(chunk)
+        print(f"Exported to {path}")
+
+    @app.cli.command("import")
+    @click.argument("path")
+    @click.option("--user", default=None, help="Import everything as this user.")
+    def import_command(path, user):
+        """Load a gzipped NDJSON export as new conversations."""
+        convs, msgs = nexa_ndjson.import_records(nexa_ndjson.read_records(path), ROUTER.user_db, user)
+        print(f"Imported {convs} conversations, {msgs} messages")
+
+    return app
 
+# ---------------------------
+# Run (development server)
+# ---------------------------
+# One process by default. --debug (or NEXA_DEBUG=1) adds the debugger and the
+# reloader, which runs the app in a second, watched process; --open opens a tab.
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    init_db()
+    if args == ["init-db"]:
+        print(f"Initialized {DB_FILE}"); sys.exit(0)
+    debug = "--debug" in args or os.getenv("NEXA_DEBUG", "").lower() in ("1", "true", "yes")
+    app = create_app()
+    if not debug or os.getenv("WERKZEUG_RUN_MAIN"):     # the process that serves, not the reloader's watcher
+        JOBS.start()
+    if not os.getenv("WERKZEUG_RUN_MAIN"):     # the reloader's child would print and open again
+        print("🚀 Nexa UI running at http://127.0.0.1:5000")
+        if "--open" in args:
+            import webbrowser
+            try: webbrowser.open("http://127.0.0.1:5000")
+            except Exception: pass
+    app.run(host="0.0.0.0", port=5000, debug=debug)
@@ -2,19 +2,28 @@
 # NEXA – STUDY ONLY AI (FINAL WITH AUTO-SCROLL)
 # =========================
 
-import os, sys, io, sqlite3, requests, html
-from datetime import datetime, timezone
+import os, sys, sqlite3, html
+from datetime import datetime, timezone, timedelta
 import streamlit as st
 import streamlit.components.v1 as components
+import nexa_llm
+import nexa_summary
+import nexa_exam
+import nexa_maintenance
+import nexa_store
+import nexa_profile
+import nexa_usage
 
 # -------------------------
 # UTF-8 SAFE
 # -------------------------
+# reconfigured in place, and only once: wrapping sys.stdout.buffer in a new
+# TextIOWrapper on every script run piled up wrappers around one buffer
 try:
     os.environ.setdefault("PYTHONIOENCODING", "utf-8")
-    if hasattr(sys.stdout, "buffer"):
-        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", errors="replace")
-except:
+    if (getattr(sys.stdout, "encoding", None) or "").lower() != "utf-8" and hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(encoding="utf-8", errors="replace")
+except Exception:
     pass
 
 # -------------------------
@@ -22,37 +31,35 @@ except:
 # -------------------------
 st.set_page_config(page_title="NEXA Study AI", layout="wide")
 DB_PATH = "nexa_study.db"
+STORE = nexa_store.get(DB_PATH)     # conversations/messages, shared code with Nexa.py
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 
+# -------------------------
+# PROFILING (nexa_profile.py): ?profile=<NEXA_PROFILE_TOKEN>, or 1 in NEXA_PROFILE_SAMPLE runs
+# -------------------------
+PROFILER = nexa_profile.Profiler(os.getenv("NEXA_PROFILE_DIR", "profiles"), os.getenv("NEXA_PROFILE_SAMPLE", "0"))
+if "profile" in st.session_state:
+    st.session_state.pop("profile").stop()      # the previous run ended in st.rerun()
+if os.getenv("NEXA_PROFILE_TOKEN") and st.query_params.get("profile") == os.getenv("NEXA_PROFILE_TOKEN"):
+    st.session_state.profile = PROFILER.start("streamlit run", "requested")
+elif PROFILER.should_sample():
+    st.session_state.profile = PROFILER.start("streamlit run", "sampled")
+
 # -------------------------
 # DATABASE
 # -------------------------
 def get_conn():
     conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    nexa_profile.trace(conn)
     return conn
 
 def init_db():
     conn = get_conn()
+    nexa_maintenance.prepare(conn)      # must precede the first CREATE TABLE
     c = conn.cursor()
 
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS conversations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            created_at TEXT
-        )
-    """)
-
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            conversation_id INTEGER,
-            role TEXT,
-            content TEXT,
-            created_at TEXT
-        )
-    """)
+    nexa_store.ensure_schema(conn)      # also upgrades the old created_at columns
 
     c.execute("""
         CREATE TABLE IF NOT EXISTS scores (
@@ -66,88 +73,185 @@ def init_db():
         )
     """)
 
+    # score analytics: aggregates maintained by save_score, read by the progress view
+    if "student" not in {r[1] for r in c.execute("PRAGMA table_info(scores)")}:
+        c.execute("ALTER TABLE scores ADD COLUMN student TEXT NOT NULL DEFAULT 'guest'")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_scores_student ON scores(student, exam_type, created_at, percentage)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_scores_conv ON scores(conversation_id, student, exam_type)")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS score_totals (
+            student TEXT NOT NULL,
+            exam_type TEXT NOT NULL,
+            tests INTEGER NOT NULL,
+            mean_pct REAL NOT NULL,
+            best_pct REAL NOT NULL,
+            latest_pct REAL NOT NULL,
+            latest_at TEXT NOT NULL,
+            PRIMARY KEY (student, exam_type)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS score_daily (
+            student TEXT NOT NULL,
+            exam_type TEXT NOT NULL,
+            day TEXT NOT NULL,
+            tests INTEGER NOT NULL,
+            sum_pct REAL NOT NULL,
+            best_pct REAL NOT NULL,
+            PRIMARY KEY (student, exam_type, day)
+        ) WITHOUT ROWID
+    """)
+    if not c.execute("SELECT 1 FROM score_totals LIMIT 1").fetchone():
+        # one-time backfill for databases that predate the aggregates
+        refresh_score_aggregates(c, c.execute("SELECT DISTINCT student, exam_type FROM scores").fetchall())
+
+    nexa_exam.ensure_schema(conn)
+    nexa_usage.ensure_schema(conn)
     conn.commit()
     conn.close()
 
-init_db()
+def refresh_score_aggregates(c, keys):
+    """Rebuild score_totals/score_daily for (student, exam_type) pairs from the scores index."""
+    for student, exam in keys:
+        c.execute("DELETE FROM score_totals WHERE student=? AND exam_type=?", (student, exam))
+        c.execute("DELETE FROM score_daily WHERE student=? AND exam_type=?", (student, exam))
+        c.execute("""
+            INSERT INTO score_totals (student, exam_type, tests, mean_pct, best_pct, latest_pct, latest_at)
+            SELECT student, exam_type, COUNT(*), AVG(percentage), MAX(percentage),
+                   (SELECT percentage FROM scores l WHERE l.student=s.student AND l.exam_type=s.exam_type
+                    ORDER BY l.created_at DESC, l.id DESC LIMIT 1),
+                   MAX(created_at)
+            FROM scores s WHERE student=? AND exam_type=? GROUP BY student, exam_type
+        """, (student, exam))
+        c.execute("""
+            INSERT INTO score_daily (student, exam_type, day, tests, sum_pct, best_pct)
+            SELECT student, exam_type, substr(created_at, 1, 10), COUNT(*), SUM(percentage), MAX(percentage)
+            FROM scores WHERE student=? AND exam_type=? GROUP BY substr(created_at, 1, 10)
+        """, (student, exam))
+
+@st.cache_resource
+def db_ready():
+    init_db()       # once per server process rather than on every rerun
+    return True
+
+db_ready()
 
 def new_conversation(title):
-    conn = get_conn()
-    c = conn.cursor()
-    ts = datetime.now(timezone.utc).isoformat()
-    c.execute("INSERT INTO conversations (title, created_at) VALUES (?,?)", (title, ts))
-    conn.commit()
-    cid = c.lastrowid
-    conn.close()
+    cid = STORE.create_conversation(title=title)
+    # the sidebar keeps its loaded page; a new chat is simply put on top
+    if (st.session_state.get("sb_rows") is not None and not st.session_state.get("sb_query")
+            and not st.session_state.get("sb_trimmed")):
+        st.session_state.sb_rows.insert(0, STORE.get_conversation(cid))
     return cid
 
 def delete_conversation(cid):
     conn = get_conn()
     c = conn.cursor()
-    c.execute("DELETE FROM messages WHERE conversation_id=?", (cid,))
+    affected = c.execute("SELECT DISTINCT student, exam_type FROM scores WHERE conversation_id=?", (cid,)).fetchall()
     c.execute("DELETE FROM scores WHERE conversation_id=?", (cid,))
-    c.execute("DELETE FROM conversations WHERE id=?", (cid,))
+    refresh_score_aggregates(c, affected)
     conn.commit()
     conn.close()
+    # messages go in short chunks so a long session never holds the write lock for long
+    STORE.delete_conversation(cid, ("messages", "test_questions"))
 
 def save_message(cid, role, content):
-    conn = get_conn()
-    c = conn.cursor()
-    ts = datetime.now(timezone.utc).isoformat()
-    c.execute(
-        "INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?,?,?,?)",
-        (cid, role, content, ts)
-    )
-    conn.commit()
-    conn.close()
+    STORE.save_message(cid, role, content)
+
+def save_messages(cid, items):
+    STORE.save_messages(cid, [(None, role, content, None) for role, content in items])
 
-def save_score(cid, exam, total_q, correct_q):
+def save_score(cid, exam, total_q, correct_q, student="guest"):
     percentage = round((correct_q / total_q) * 100, 2)
+    ts = datetime.now(timezone.utc).isoformat()
     conn = get_conn()
     c = conn.cursor()
     c.execute("""
         INSERT INTO scores
-        (conversation_id, exam_type, total_questions, correct_answers, percentage, created_at)
-        VALUES (?,?,?,?,?,?)
-    """, (cid, exam, total_q, correct_q, percentage, datetime.now(timezone.utc).isoformat()))
+        (conversation_id, exam_type, total_questions, correct_answers, percentage, created_at, student)
+        VALUES (?,?,?,?,?,?,?)
+    """, (cid, exam, total_q, correct_q, percentage, ts, student))
+    # same transaction: running totals and the per-day bucket
+    c.execute("""
+        INSERT INTO score_totals (student, exam_type, tests, mean_pct, best_pct, latest_pct, latest_at)
+        VALUES (?,?,1,?,?,?,?)
+        ON CONFLICT(student, exam_type) DO UPDATE SET
+            tests = tests + 1,
+            mean_pct = mean_pct + (excluded.mean_pct - mean_pct) / (tests + 1),
+            best_pct = MAX(best_pct, excluded.best_pct),
+            latest_pct = excluded.latest_pct,
+            latest_at = excluded.latest_at
+    """, (student, exam, percentage, percentage, percentage, ts))
+    c.execute("""
+        INSERT INTO score_daily (student, exam_type, day, tests, sum_pct, best_pct)
+        VALUES (?,?,?,1,?,?)
+        ON CONFLICT(student, exam_type, day) DO UPDATE SET
+            tests = tests + 1,
+            sum_pct = sum_pct + excluded.sum_pct,
+            best_pct = MAX(best_pct, excluded.best_pct)
+    """, (student, exam, ts[:10], percentage, percentage))
     conn.commit()
     conn.close()
     return percentage
 
-def load_messages(cid):
+def load_progress(student, days=14):
+    """Per-exam totals and recent daily means, read only from the aggregate tables."""
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).date().isoformat()
     conn = get_conn()
     c = conn.cursor()
-    c.execute("SELECT role, content FROM messages WHERE conversation_id=? ORDER BY id", (cid,))
-    rows = c.fetchall()
+    totals = c.execute("""
+        SELECT exam_type, tests, mean_pct, best_pct, latest_pct, latest_at
+        FROM score_totals WHERE student=? ORDER BY exam_type
+    """, (student,)).fetchall()
+    daily = c.execute("""
+        SELECT day, exam_type, sum_pct / tests AS mean_pct
+        FROM score_daily WHERE student=? AND day>=? ORDER BY day
+    """, (student, since)).fetchall()
     conn.close()
-    return rows
+    return totals, daily
 
-def list_conversations():
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT id, title FROM conversations ORDER BY id DESC")
-    rows = c.fetchall()
-    conn.close()
-    return rows
+def load_messages(cid):
+    return STORE.load_messages(cid)
+
+def list_conversations(before=None, query=None, limit=None):
+    return STORE.list_conversations(limit=limit, before=before, prefix=query or None)
 
 # -------------------------
 # AI CALL
 # -------------------------
+@st.cache_resource
+def get_meter():
+    # token/cost metering and the NEXA_QUOTA_DAILY_TOKENS quota (nexa_usage.py)
+    return nexa_usage.Meter(DB_PATH)
+
+@st.cache_resource
+def get_llm():
+    # one client per server process so the hedge deadline/stats survive reruns
+    chain = nexa_llm.parse_chain(os.getenv("NEXA_MODELS", "openai/gpt-4o-mini"))
+    client = nexa_llm.HedgedClient(chain, OPENROUTER_API_KEY)
+    client.on_usage = get_meter().record
+    return client
+
 def call_ai(history):
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": "openai/gpt-4o-mini",
-        "messages": history,
-        "max_tokens": 700
-    }
-    r = requests.post(url, headers=headers, json=payload, timeout=60)
-    if r.status_code != 200:
+    student = st.session_state.student
+    if not get_meter().allow(student):
+        return "You have reached today's usage limit. Please come back tomorrow."
+    try:
+        return get_llm().complete(history, max_tokens=700, timeout=60,
+                                  tags={"user": student, "mode": "test" if st.session_state.test_mode else "study"})
+    except Exception:
         return "NEXA is temporarily unavailable."
-    return r.json()["choices"][0]["message"]["content"]
+
+@st.cache_resource
+def get_exam_engine():
+    # questions for test mode are generated ahead of time in the background
+    return nexa_exam.TestEngine(get_conn, lambda msgs: get_llm().complete(msgs, max_tokens=400, timeout=60,
+                                                                          tags={"mode": "exam"}))
+
+@st.cache_resource
+def get_summarizer():
+    return nexa_summary.Summarizer(lambda cid: get_conn(), lambda msgs: get_llm().complete(msgs, max_tokens=400, timeout=60,
+                                                                                             tags={"mode": "summary"}))
 
 # -------------------------
 # SESSION
@@ -164,6 +268,54 @@ if "correct_count" not in st.session_state:
     st.session_state.correct_count = 0
 if "max_questions" not in st.session_state:
     st.session_state.max_questions = 10
+if "student" not in st.session_state:
+    st.session_state.student = "guest"
+
+# sidebar history: keyset pages of SIDEBAR_PAGE rows, at most SIDEBAR_MAX rendered
+SIDEBAR_PAGE = 20
+SIDEBAR_MAX = 60
+
+def load_sidebar_page(reset=False):
+    rows = [] if reset else st.session_state.sb_rows
+    before = rows[-1].id if rows else None
+    page = list_conversations(before, st.session_state.sb_query.strip(), SIDEBAR_PAGE + 1)
+    rows = rows + page[:SIDEBAR_PAGE]
+    st.session_state.sb_more = len(page) > SIDEBAR_PAGE
+    st.session_state.sb_trimmed = not reset and (st.session_state.sb_trimmed or len(rows) > SIDEBAR_MAX)
+    st.session_state.sb_rows = rows[-SIDEBAR_MAX:]
+
+def forget_conversation(cid):
+    delete_conversation(cid)
+    st.session_state.sb_rows = [c for c in st.session_state.sb_rows if c.id != cid]
+
+def open_conversation(conv):
+    st.session_state.cid = conv.id
+    st.session_state.mode = conv.title
+
+def date_group(created):
+    day = (created or "")[:10]
+    today = datetime.utcnow().date()
+    if day == today.isoformat():
+        return "Today"
+    if day == (today - timedelta(days=1)).isoformat():
+        return "Yesterday"
+    if day >= (today - timedelta(days=7)).isoformat():
+        return "Previous 7 days"
+    try:
+        return datetime.strptime(day, "%Y-%m-%d").strftime("%B %Y")
+    except ValueError:
+        return "Older"
+
+if "sb_query" not in st.session_state:
+    st.session_state.sb_query = ""
+if st.session_state.get("sb_rows") is None:
+    st.session_state.sb_rows, st.session_state.sb_trimmed = [], False
+    load_sidebar_page(reset=True)
+
+def end_test():
+    if st.session_state.test_mode:
+        get_exam_engine().discard(st.session_state.cid)
+    st.session_state.test_mode = False
 
 # -------------------------
 # STYLES
@@ -202,11 +354,12 @@ form[data-testid="stForm"]{
 with st.sidebar:
     st.markdown("## 📘 NEXA")
     st.caption("Study-Only AI")
+    st.text_input("Student", key="student", placeholder="Your name")
 
     if st.button("➕ New Chat"):
+        end_test()
         st.session_state.cid = new_conversation("General Study")
         st.session_state.mode = "General Study"
-        st.session_state.test_mode = False
         st.session_state.question_count = 0
         st.session_state.correct_count = 0
         st.rerun()
@@ -214,32 +367,62 @@ with st.sidebar:
     with st.expander("📚 Exam Prep"):
         for title in ["MHT-CET", "10th Board", "12th Board", "Class 5–9"]:
             if st.button(title):
+                end_test()
                 st.session_state.cid = new_conversation(title)
                 st.session_state.mode = title
-                st.session_state.test_mode = False
                 st.session_state.question_count = 0
                 st.session_state.correct_count = 0
                 st.rerun()
 
     if st.button("📝 Test Mode"):
+        end_test()
         st.session_state.test_mode = True
         st.session_state.question_count = 0
         st.session_state.correct_count = 0
-        save_message(st.session_state.cid, "assistant", "Test mode ON. I will ask questions.")
+        engine = get_exam_engine()
+        engine.prefetch(st.session_state.cid, st.session_state.mode)
+        try:
+            q = engine.next_question(st.session_state.cid, st.session_state.mode)
+            first = q.render(1)
+        except Exception:
+            first = "NEXA is temporarily unavailable."
+        save_messages(st.session_state.cid, [("assistant", "Test mode ON. I will ask questions."),
+                                             ("assistant", first)])
         st.rerun()
 
+    with st.expander("📈 Progress"):
+        totals, daily = load_progress(st.session_state.student.strip() or "guest")
+        if not totals:
+            st.caption("No tests taken yet.")
+        for t in totals:
+            st.metric(t["exam_type"], f"{t['latest_pct']:.0f}%",
+                      delta=f"{t['latest_pct'] - t['mean_pct']:+.1f} vs avg")
+            st.caption(f"{t['tests']} tests · avg {t['mean_pct']:.1f}% · best {t['best_pct']:.0f}%")
+        if daily:
+            chart = {}
+            for d in daily:
+                chart.setdefault(d["exam_type"], {})[d["day"]] = d["mean_pct"]
+            st.line_chart(chart)
+
     st.markdown("### 🕘 History")
-    for c in list_conversations():
+    st.text_input("Search titles", key="sb_query", placeholder="Title starts with…",
+                  on_change=load_sidebar_page, kwargs={"reset": True})
+    if st.session_state.sb_trimmed:
+        st.button("⤒ Newest", on_click=load_sidebar_page, kwargs={"reset": True})
+    group = None
+    for c in st.session_state.sb_rows:
+        if date_group(c.created) != group:
+            group = date_group(c.created)
+            st.caption(group)
         col1, col2 = st.columns([4,1])
         with col1:
-            if st.button(c["title"], key=f"open_{c['id']}"):
-                st.session_state.cid = c["id"]
-                st.session_state.mode = c["title"]
-                st.rerun()
+            st.button(c.title or "Untitled", key=f"open_{c.id}", on_click=open_conversation, args=(c,))
         with col2:
-            if st.button("❌", key=f"del_{c['id']}"):
-                delete_conversation(c["id"])
-                st.rerun()
+            st.button("❌", key=f"del_{c.id}", on_click=forget_conversation, args=(c.id,))
+    if not st.session_state.sb_rows:
+        st.caption("No conversations found.")
+    if st.session_state.sb_more:
+        st.button("Show more", on_click=load_sidebar_page)
 
 # -------------------------
 # CHAT DISPLAY
@@ -289,41 +472,59 @@ if submitted and user_input.strip():
     save_message(st.session_state.cid, "user", user_input)
 
     if st.session_state.test_mode:
-        system_prompt = (
-            f"You are NEXA conducting a test for {st.session_state.mode}. "
-            "Ask one exam-level question. "
-            "After answer, say Correct or Incorrect with one-line reason only."
-        )
-    else:
-        system_prompt = (
-            f"You are NEXA, a strict STUDY AI for {st.session_state.mode}. "
-            "Answer academically using plain text only."
-        )
-
-    history = [{"role":"system","content":system_prompt}]
-    for m in load_messages(st.session_state.cid):
-        history.append({"role":m["role"],"content":m["content"]})
-
-    reply = call_ai(history)
-
-    if st.session_state.test_mode:
-        st.session_state.question_count += 1
-        if "correct" in reply.lower():
-            st.session_state.correct_count += 1
+        # graded locally against the stored answer key; the next question is already prefetched
+        engine = get_exam_engine()
+        q, correct = engine.grade(st.session_state.cid, user_input)
+        parts = []
+        if q is not None:
+            st.session_state.question_count += 1
+            if correct:
+                st.session_state.correct_count += 1
+                parts.append("Correct ✅" + (f" {q.explanation}" if q.explanation else ""))
+            else:
+                parts.append(f"Incorrect ❌ The answer is {q.answer}) {q.options[q.answer]}."
+                             + (f" {q.explanation}" if q.explanation else ""))
 
         if st.session_state.question_count >= st.session_state.max_questions:
             percentage = save_score(
                 st.session_state.cid,
                 st.session_state.mode,
                 st.session_state.max_questions,
-                st.session_state.correct_count
+                st.session_state.correct_count,
+                st.session_state.student.strip() or "guest"
             )
-            reply += f"\n\nTest completed.\nScore: {percentage}%"
-            st.session_state.test_mode = False
+            parts.append(f"Test completed.\nScore: {percentage}%")
+            end_test()
+        else:
+            try:
+                nq = engine.next_question(st.session_state.cid, st.session_state.mode)
+                parts.append(nq.render(st.session_state.question_count + 1))
+            except Exception:
+                parts.append("NEXA is temporarily unavailable.")
+        reply = "\n\n".join(parts)
+    else:
+        system_prompt = (
+            f"You are NEXA, a strict STUDY AI for {st.session_state.mode}. "
+            "Answer academically using plain text only."
+        )
+
+        # summary of older turns + the turns not yet folded into it
+        summary, recent = STORE.prompt_context(st.session_state.cid)
+        history = [{"role":"system","content":system_prompt}]
+        if summary:
+            history.append(nexa_summary.summary_message(summary))
+        for _, role, content in recent:
+            history.append({"role":role,"content":content})
+        get_summarizer().maybe_schedule(st.session_state.cid, len(recent))
+
+        reply = call_ai(history)
 
     save_message(st.session_state.cid, "assistant", reply)
     st.rerun()
 
+if "profile" in st.session_state:
+    st.session_state.pop("profile").stop()
+
 # =========================
 # END
 # =========================
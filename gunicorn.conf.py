@@ -0,0 +1,28 @@
+# gunicorn.conf.py
+# Production settings for Nexa.py:  gunicorn -c gunicorn.conf.py
+# Every worker shares the secret in instance/secret_key (or NEXA_SECRET_KEY),
+# so sessions stay valid whichever worker serves a request.
+import os
+import multiprocessing
+
+wsgi_app = "wsgi:app"
+bind = os.getenv("NEXA_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("NEXA_WORKERS", multiprocessing.cpu_count()))
+# requests mostly wait on the LLM (and /events streams hold a thread each, half
+# of them by default, see NEXA_EVENT_STREAMS), so each worker serves many at once
+worker_class = "gthread"
+threads = int(os.getenv("NEXA_THREADS", "32"))
+timeout = 90
+
+
+def on_starting(server):
+    # schema init and secret creation run once in the master, before any worker forks
+    import Nexa
+    Nexa.init_db()
+    Nexa.load_secret_key(Nexa.CONFIG)
+
+
+def post_fork(server, worker):
+    # each worker runs its own job threads (also covers preload_app, where wsgi.py ran in the master)
+    import Nexa
+    Nexa.JOBS.start()
@@ -0,0 +1,182 @@
+# nexa_auth.py
+# Password hashing off the request threads, plus login throttling, for Nexa.py.
+# scrypt/pbkdf2 are CPU-bound and hold the GIL, so hashes run on a small
+# process pool. At most `max_pending` hashes per server process are in flight;
+# past that a sign-in is refused at once with Busy, instead of parking every
+# request thread on the pool and starving /chat.
+#
+# Throttling is a per-process sliding window: attempts per client IP and
+# failed logins per username (a username over its limit is refused before any
+# hashing is done).
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import BrokenExecutor        # light: the process pool itself is imported on first use
+
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+
+class Busy(Exception):
+    """No hashing capacity left in this process; retry shortly."""
+
+
+def parse_limit(spec):
+    """'5/300' -> (5 attempts, 300 seconds)"""
+    count, _, window = str(spec).partition("/")
+    return int(count), float(window or 60)
+
+
+def method_prefix(method):
+    """The "method$" part werkzeug writes for `method`, with its defaults filled in
+    (mirrors werkzeug.security._hash_internal), without hashing anything."""
+    name, *args = method.split(":")
+    if name == "scrypt":
+        n, r, p = args if args else (2 ** 15, 8, 1)
+        return f"scrypt:{int(n)}:{int(r)}:{int(p)}"
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Invalid hash method {method!r}")
+
+
+class RateLimiter:
+    def __init__(self, limit, window):
+        self.limit, self.window = limit, window
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        q = self._hits.get(key)
+        if q is None:
+            return None
+        while q and q[0] <= now - self.window:
+            q.popleft()
+        if not q:
+            del self._hits[key]
+            return None
+        return q
+
+    def retry_after(self, key):
+        """Seconds until `key` may try again (0 = allowed)."""
+        now = time.monotonic()
+        with self._lock:
+            q = self._recent(key, now)
+            return 0 if q is None or len(q) < self.limit else int(q[0] + self.window - now) + 1
+
+    def hit(self, key):
+        """Record an attempt; returns retry_after() as it was before this attempt."""
+        now = time.monotonic()
+        with self._lock:
+            q = self._recent(key, now)
+            if q is not None and len(q) >= self.limit:
+                return int(q[0] + self.window - now) + 1
+            if len(self._hits) > 50000:         # bounded memory under a spray of keys
+                for k in list(self._hits):
+                    self._recent(k, now)
+            self._hits.setdefault(key, deque()).append(now)
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+
+class PasswordHasher:
+    """method is a werkzeug method string, e.g. 'scrypt', 'scrypt:65536:8:1' or 'pbkdf2:sha256:600000'.
+    wait: seconds a call may wait for one of the max_pending slots before it raises Busy."""
+
+    def __init__(self, method="scrypt", workers=2, max_pending=4, wait=0.02):
+        self.method = method
+        self.workers = max(1, int(workers))
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(max(1, int(max_pending)))
+        self._pool = None
+        self._lock = threading.Lock()
+        self._prefix = method_prefix(method)
+        self.counters = {"hashed": 0, "verified": 0, "rehashed": 0, "busy": 0, "pool_restarts": 0}
+
+    def _executor(self):
+        # created on first use, so pre-forking servers start one pool per worker;
+        # spawn keeps the children free of the parent's threads and locks
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    import multiprocessing          # deferred: a sizeable import that only the first hash needs
+                    from concurrent.futures import ProcessPoolExecutor
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _replace_pool(self, broken):
+        # a child died (OOM kill, segfault) and the executor refuses all further work
+        with self._lock:
+            if self._pool is broken:
+                self._pool = None
+                self.counters["pool_restarts"] += 1
+        if broken is not None:
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        # a slot is waited for at most `wait` (tens of ms): a saturated pool refuses the sign-in
+        # at once rather than parking the request thread that /chat needs
+        if not self._slots.acquire(timeout=self.wait):
+            self._bump("busy")
+            raise Busy("password hashing is at capacity")
+        try:
+            for attempt in range(2):
+                pool = self._executor()
+                try:
+                    return pool.submit(fn, *args).result()
+                except BrokenExecutor:
+                    self._replace_pool(pool)
+                    if attempt:
+                        raise
+        finally:
+            self._slots.release()
+
+    def _bump(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def hash(self, password):
+        self._bump("hashed")
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        self._bump("verified")
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True when pwhash was made with other parameters than the configured method."""
+        return pwhash.split("$", 1)[0] != self._prefix
+
+    def rehash_later(self, password, store):
+        """Hash with the current method in the background and pass it to store(new_hash).
+        Skipped when the pool is busy; the next login tries again."""
+        if not self._slots.acquire(blocking=False):
+            return False
+        pool = self._executor()
+        try:
+            fut = pool.submit(generate_password_hash, password, self.method)
+        except BrokenExecutor:
+            self._slots.release()
+            self._replace_pool(pool)
+            return False
+
+        def done(f):
+            self._slots.release()
+            if f.exception() is None:
+                store(f.result())
+                self._bump("rehashed")
+        fut.add_done_callback(done)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, method=self.method, workers=self.workers)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,115 @@
+# nexa_codec.py
+# Transparent compression of large message bodies for both apps' databases.
+# messages.codec says how messages.content is stored: NULL = plain TEXT,
+# 'zlib' / 'zstd' = compressed BLOB. Old rows (codec NULL) stay readable as is.
+#
+# Environment:
+#   NEXA_COMPRESS      off (default) | zlib | zstd — codec for new bodies; zstd
+#                      needs the optional `zstandard` package, else zlib is used.
+#                      Off by default, so existing databases keep their stored
+#                      format until an operator opts in
+#   NEXA_COMPRESS_MIN  bodies smaller than this many bytes stay plain (default 1024)
+#
+# Offline recompression of existing rows (uses the settings above; with
+# NEXA_COMPRESS=off it decompresses everything):
+#   python nexa_codec.py nexa_final.db nexa_study.db
+
+import os
+import sys
+import zlib
+import sqlite3
+
+try:
+    import zstandard
+except ImportError:         # optional dependency
+    zstandard = None
+
+CODEC = os.getenv("NEXA_COMPRESS", "off").lower()
+if CODEC == "zstd" and zstandard is None:
+    CODEC = "zlib"
+if CODEC not in ("zlib", "zstd"):
+    CODEC = None
+MIN_SIZE = int(os.getenv("NEXA_COMPRESS_MIN", "1024"))
+
+_zstd_c = zstandard.ZstdCompressor(level=3) if zstandard else None
+_zstd_d = zstandard.ZstdDecompressor() if zstandard else None
+
+
+def ensure_schema(conn):
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(messages)")}
+    if "codec" not in cols:
+        conn.execute("ALTER TABLE messages ADD COLUMN codec TEXT")
+
+
+def encode(text, codec=None, min_size=None):
+    """text -> (value to store in messages.content, codec or None)"""
+    codec = CODEC if codec is None else codec
+    min_size = MIN_SIZE if min_size is None else min_size
+    if text is None or not codec:
+        return text, None
+    raw = text.encode("utf-8")
+    if len(raw) < min_size:
+        return text, None
+    if codec == "zstd":
+        packed = _zstd_c.compress(raw)
+    else:
+        packed = zlib.compress(raw, 6)
+    if len(packed) >= len(raw):
+        return text, None           # incompressible; not worth the CPU on read
+    return sqlite3.Binary(packed), codec
+
+
+def decode(value, codec):
+    if not codec or value is None:
+        return value
+    if codec == "zlib":
+        return zlib.decompress(value).decode("utf-8")
+    if codec == "zstd":
+        if _zstd_d is None:
+            raise RuntimeError("message stored with zstd but the zstandard package is not installed")
+        return _zstd_d.decompress(value).decode("utf-8")
+    raise ValueError(f"unknown message codec {codec!r}")
+
+
+def _size(value):
+    if value is None:
+        return 0
+    return len(value.encode("utf-8")) if isinstance(value, str) else len(value)
+
+
+def recompress(db_path, batch=500, out=sys.stdout):
+    """Re-encode every message with the current settings, in short batched transactions."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    ensure_schema(conn)
+    conn.commit()
+    last, changed, seen, before, after = 0, 0, 0, 0, 0
+    while True:
+        rows = conn.execute("SELECT id, content, codec FROM messages WHERE id>? ORDER BY id LIMIT ?",
+                            (last, batch)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for mid, content, codec in rows:
+            text = decode(content, codec)
+            value, new_codec = encode(text)
+            before += _size(content)
+            after += _size(value)
+            if new_codec != codec or (codec is None and value != content):
+                updates.append((value, new_codec, mid))
+        if updates:
+            conn.executemany("UPDATE messages SET content=?, codec=? WHERE id=?", updates)
+        conn.commit()
+        seen += len(rows)
+        changed += len(updates)
+        last = rows[-1][0]
+        print(f"\r{db_path}: {seen} messages scanned, {changed} rewritten", end="", file=out)
+    print(f"\n{db_path}: content {before} -> {after} bytes", file=out)
+    conn.close()
+    return changed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python nexa_codec.py DB_FILE [DB_FILE ...]")
+    for path in sys.argv[1:]:
+        recompress(path)
@@ -0,0 +1,200 @@
+# nexa_consolidate.py
+# Merges legacy chat databases (nexa_chat.db, nexa_singlefile.db,
+# nexa_chat_ui.db, old nexa_final.db copies, ...) into the current Nexa.py
+# database. Each source is ATTACHed and copied with set-based INSERT ... SELECT
+# in chunks by source rowid; every chunk commits together with its progress
+# row in `consolidations`, so an interrupted run resumes where it stopped and
+# the live app only ever waits for one short transaction.
+#
+# Column names are introspected per source: created/created_at/timestamp,
+# sender/user, missing title or user columns all map onto the current schema.
+# Source conversation ids are shifted past a range reserved in the target's
+# sqlite_sequence, so they never collide with ids the live app hands out.
+# Messages whose conversation row is missing get a "Recovered chat".
+# Only werkzeug-format password hashes (method$salt$hash) are copied, and one
+# replaces a legacy hash already in the target: the first valid hash for a
+# username wins, whatever order the sources are merged in. Legacy digests
+# (e.g. nexa_chat.db's bare sha256) can never be verified and are skipped.
+# Databases without chat tables (e.g. pharmacy.db) are skipped.
+# Each chunk also bumps, in its own transaction, the version counters behind
+# the ETags and the tail cache: user_versions for owners of the conversations
+# it added, conversations.version for those it added messages to. A reader
+# that looks at a conversation mid-run therefore never keeps a partial copy.
+#
+#   python nexa_consolidate.py TARGET_DB SOURCE_DB [SOURCE_DB ...] [--retire]
+#   flask --app Nexa consolidate SOURCE_DB ... [--retire]
+# --retire renames each fully merged source to <name>.merged.
+
+import os
+import sys
+import time
+import sqlite3
+
+CHUNK_ROWS = int(os.getenv("NEXA_MAINTENANCE_CHUNK", "500")) * 10    # source rows per transaction
+CHUNK_PAUSE = 0.02
+
+
+def _columns(conn, table, schema="main"):
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _pick(cols, *names, default="NULL"):
+    return next((n for n in names if n in cols), default)
+
+
+def _iso(col):
+    # legacy rows used "YYYY-MM-DD HH:MM:SS"; the current schema stores ISO 8601
+    return "NULL" if col == "NULL" else f"REPLACE(CAST({col} AS TEXT), ' ', 'T')"
+
+
+def ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS consolidations (
+      source TEXT NOT NULL,
+      step TEXT NOT NULL,
+      id_offset INTEGER NOT NULL DEFAULT 0,
+      last_id INTEGER NOT NULL DEFAULT 0,
+      copied INTEGER NOT NULL DEFAULT 0,
+      done INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (source, step)
+    )""")
+
+
+_WERKZEUG_HASH = "'%$%$%'"          # LIKE pattern for method$salt$hash
+_BUMP_USERS = ("INSERT INTO user_versions (user, version) SELECT DISTINCT user, 1 FROM conversations "
+               "WHERE id > :lo + :offset AND id <= :hi + :offset ON CONFLICT(user) DO UPDATE SET version=version+1")
+_BUMP_CONVERSATIONS = ("UPDATE conversations SET version=version+1 WHERE id IN "
+                       "(SELECT DISTINCT conversation_id + :offset FROM src.messages WHERE id > :lo AND id <= :hi)")
+
+
+def plan(conn):
+    """[(step, sql, max_id_sql, bump_sql)] for the attached `src`, or None when it has no chat
+    tables. Each sql copies the source rows with :lo < id <= :hi, shifting conversation ids by
+    :offset; bump_sql (or None) bumps the version counters of what that chunk changed."""
+    conv = _columns(conn, "conversations", "src")
+    msgs = _columns(conn, "messages", "src")
+    users = _columns(conn, "users", "src")
+    if not msgs or "conversation_id" not in msgs or "content" not in msgs:
+        return None
+    steps = []
+    if "username" in users and "password" in users:
+        steps.append(("users",
+            f"INSERT INTO users (username, password) SELECT username, password FROM src.users "
+            f"WHERE username IS NOT NULL AND password LIKE {_WERKZEUG_HASH} AND id > :lo AND id <= :hi ORDER BY id "
+            f"ON CONFLICT(username) DO UPDATE SET password=excluded.password "
+            f"WHERE users.password IS NULL OR users.password NOT LIKE {_WERKZEUG_HASH}",
+            "SELECT MAX(id) FROM src.users", None))
+    if conv:
+        created = _iso(_pick(conv, "created", "created_at", "timestamp"))
+        steps.append(("conversations",
+            f"INSERT OR IGNORE INTO conversations (id, user, title, created) "
+            f"SELECT id + :offset, COALESCE({_pick(conv, 'user')}, 'guest'), {_pick(conv, 'title')}, "
+            f"COALESCE({created}, strftime('%Y-%m-%dT%H:%M:%S', 'now')) FROM src.conversations "
+            f"WHERE id > :lo AND id <= :hi ORDER BY id",
+            "SELECT MAX(id) FROM src.conversations", _BUMP_USERS))
+    sender = _pick(msgs, "sender", "user")
+    ts = _iso(_pick(msgs, "timestamp", "created_at", "created"))
+    have = "SELECT id FROM src.conversations" if conv else "SELECT NULL WHERE 0"
+    # conversations that only exist as message references
+    steps.append(("recovered",
+        f"INSERT OR IGNORE INTO conversations (id, user, title, created) "
+        f"SELECT conversation_id + :offset, COALESCE(MAX(CASE WHEN role='user' THEN {sender} END), 'guest'), "
+        f"'Recovered chat', COALESCE(MIN({ts}), strftime('%Y-%m-%dT%H:%M:%S', 'now')) FROM src.messages "
+        f"WHERE conversation_id > :lo AND conversation_id <= :hi AND conversation_id NOT IN ({have}) "
+        f"GROUP BY conversation_id",
+        "SELECT MAX(conversation_id) FROM src.messages", _BUMP_USERS))
+    steps.append(("messages",
+        f"INSERT INTO messages (conversation_id, sender, role, content, image, timestamp) "
+        f"SELECT conversation_id + :offset, {sender}, {_pick(msgs, 'role')}, content, {_pick(msgs, 'image')}, "
+        f"{ts} FROM src.messages WHERE id > :lo AND id <= :hi ORDER BY id",
+        "SELECT MAX(id) FROM src.messages", _BUMP_CONVERSATIONS))
+    return steps
+
+
+def _reserve_ids(conn, source):
+    """Offset for this source's conversation ids; reserves the range on first use."""
+    row = conn.execute("SELECT id_offset FROM consolidations WHERE source=? AND step='offset'", (source,)).fetchone()
+    if row:
+        return row[0]
+    top = max(conn.execute("SELECT COALESCE(MAX(id), 0) FROM src.conversations").fetchone()[0]
+              if _columns(conn, "conversations", "src") else 0,
+              conn.execute("SELECT COALESCE(MAX(conversation_id), 0) FROM src.messages").fetchone()[0])
+    offset = max(conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversations").fetchone()[0],
+                 conn.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name='conversations'").fetchone()[0])
+    # live inserts now allocate above offset + top
+    if conn.execute("SELECT 1 FROM sqlite_sequence WHERE name='conversations'").fetchone():
+        conn.execute("UPDATE sqlite_sequence SET seq=? WHERE name='conversations'", (offset + top,))
+    else:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('conversations', ?)", (offset + top,))
+    conn.execute("INSERT INTO consolidations (source, step, id_offset, done) VALUES (?, 'offset', ?, 1)", (source, offset))
+    return offset
+
+
+def consolidate(target, source, chunk=CHUNK_ROWS, pause=CHUNK_PAUSE, out=sys.stdout):
+    """Merge one legacy database into target. Returns True once it is fully merged."""
+    key = os.path.realpath(source)
+    if key == os.path.realpath(target):
+        print(f"{source}: is the target, skipped", file=out)
+        return False
+    if not os.path.exists(source):
+        print(f"{source}: not found, skipped", file=out)
+        return False
+    conn = sqlite3.connect(target, timeout=30, isolation_level=None)
+    try:
+        ensure_schema(conn)
+        conn.execute("ATTACH DATABASE ? AS src", (source,))
+        steps = plan(conn)
+        if steps is None:
+            print(f"{source}: no chat tables, skipped", file=out)
+            return False
+        conn.execute("BEGIN IMMEDIATE")
+        offset = _reserve_ids(conn, key)
+        conn.execute("COMMIT")
+        versioned = bool(_columns(conn, "user_versions"))
+        for step, sql, top_sql, bump_sql in steps:
+            conn.execute("INSERT OR IGNORE INTO consolidations (source, step, id_offset) VALUES (?, ?, ?)", (key, step, offset))
+            last, copied, done = conn.execute("SELECT last_id, copied, done FROM consolidations WHERE source=? AND step=?",
+                                              (key, step)).fetchone()
+            top = conn.execute(top_sql).fetchone()[0] or 0
+            while not done:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    params = {"offset": offset, "lo": last, "hi": last + chunk}
+                    n = conn.execute(sql, params).rowcount
+                    if bump_sql and versioned and n:
+                        conn.execute(bump_sql, params)
+                    last += chunk
+                    copied += max(n, 0)
+                    done = int(last >= top)
+                    conn.execute("UPDATE consolidations SET last_id=?, copied=?, done=? WHERE source=? AND step=?",
+                                 (last, copied, done, key, step))
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                print(f"\r{source}: {step} {min(last, top)}/{top} ({copied} copied)", end="", file=out)
+                time.sleep(pause)
+            print(f"\r{source}: {step} done, {copied} copied" + " " * 20, file=out)
+            if step == "users":
+                legacy = conn.execute(f"SELECT COUNT(*) FROM src.users WHERE password NOT LIKE {_WERKZEUG_HASH}").fetchone()[0]
+                if legacy:
+                    print(f"{source}: {legacy} legacy password hashes not copied", file=out)
+        return True
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != "--retire"]
+    if len(args) < 2:
+        sys.exit("usage: python nexa_consolidate.py TARGET_DB SOURCE_DB [SOURCE_DB ...] [--retire]")
+    target, sources = args[0], args[1:]
+    check = sqlite3.connect(target)
+    ready = _columns(check, "users") and _columns(check, "user_versions")
+    check.close()
+    if not ready:
+        sys.exit(f"{target} is not initialized; run `flask --app Nexa init-db` first")
+    for src in sources:
+        if consolidate(target, src) and "--retire" in sys.argv:
+            os.replace(src, src + ".merged")
+            print(f"{src}: retired to {src}.merged")
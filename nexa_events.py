@@ -0,0 +1,113 @@
+# nexa_events.py
+# In-process pub/sub behind Nexa.py's per-user Server-Sent Events stream
+# (/events). The conversation write helpers publish small events
+# (conversation_created, title_changed, conversation_deleted, message_added)
+# and every open tab of that user patches its sidebar/messages in place
+# instead of re-listing after each action.
+#
+# Subscribers only hear publishes from their own server process. Writes made
+# by another worker (or by maintenance/import tools) still bump the user's
+# counters in user_versions (list changes, message saves), so each stream
+# compares them on every heartbeat with the events it delivered and sends
+# `resync` when something was missed.
+#
+# A stream occupies one server thread, so streams per process are capped
+# (max_streams) and each closes after `lifetime` seconds; browsers reconnect
+# on their own.
+
+import json
+import time
+import queue
+import threading
+
+HEARTBEAT = 15.0        # seconds between keep-alive comments / version checks
+LIFETIME = 300.0        # seconds before a stream closes and the browser reconnects
+QUEUE_SIZE = 100        # events buffered per subscriber before it is told to resync
+LIST_EVENTS = {"conversation_created", "title_changed", "conversation_deleted"}    # each bumps user_versions.version
+MESSAGE_EVENTS = {"message_added"}                                                  # each bumps user_versions.messages
+COUNTED = (LIST_EVENTS, MESSAGE_EVENTS)     # events behind each counter that stream()'s counters() returns
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class Broker:
+    def __init__(self, max_streams=4, heartbeat=HEARTBEAT, lifetime=LIFETIME):
+        self.max_streams = max_streams
+        self.heartbeat = heartbeat
+        self.lifetime = lifetime
+        self._subs = {}             # user -> set of queues
+        self._lock = threading.Lock()
+        self.counters = {"published": 0, "delivered": 0, "overflows": 0, "refused": 0}
+
+    def subscribe(self, user):
+        q = queue.Queue(QUEUE_SIZE)
+        with self._lock:
+            if sum(len(s) for s in self._subs.values()) >= self.max_streams:
+                self.counters["refused"] += 1
+                raise TooManyStreams()
+            self._subs.setdefault(user, set()).add(q)
+        return q
+
+    def unsubscribe(self, user, q):
+        with self._lock:
+            subs = self._subs.get(user)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    del self._subs[user]
+
+    def publish(self, user, event, data):
+        with self._lock:
+            subs = list(self._subs.get(user, ()))
+            self.counters["published"] += 1
+        for q in subs:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                # a stalled tab: drop its backlog and have it re-fetch instead
+                with self._lock:
+                    self.counters["overflows"] += 1
+                while True:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+                q.put_nowait(("resync", {}))
+
+    def stream(self, user, counters=None, q=None):
+        """Yield SSE text for one subscriber. counters() -> the user's (list version,
+        message saves) from user_versions."""
+        q = q or self.subscribe(user)
+        try:
+            yield "retry: 3000\n\n"
+            seen = counters() if counters else ()
+            local = [0] * len(seen)             # bumps this stream has already delivered as events
+            end = time.monotonic() + self.lifetime
+            while time.monotonic() < end:
+                try:
+                    event, data = q.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    if counters is not None:
+                        now = counters()
+                        if any(n - s > l for n, s, l in zip(now, seen, local)):    # another process wrote
+                            yield sse("resync", {})
+                        seen, local = now, [0] * len(now)
+                    yield ": ping\n\n"
+                    continue
+                for i, names in enumerate(COUNTED[:len(local)]):
+                    local[i] += event in names
+                with self._lock:
+                    self.counters["delivered"] += 1
+                yield sse(event, data)
+        finally:
+            self.unsubscribe(user, q)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, streams=sum(len(s) for s in self._subs.values()), max_streams=self.max_streams)
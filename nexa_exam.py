@@ -0,0 +1,234 @@
+# nexa_exam.py
+# Pipelined test engine for the test mode of Nexa_Streamlit.py.
+# Multiple-choice questions are generated ahead of time on a background pool
+# and stored with their answer keys in `test_questions`. Answers are graded
+# locally against the stored key, so the next question is usually ready
+# before the student finishes the current one.
+#
+# Environment:
+#   NEXA_TEST_PREFETCH  questions kept ready (or generating) per test (default 3)
+
+import os
+import re
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("nexa.exam")
+
+PREFETCH = int(os.getenv("NEXA_TEST_PREFETCH", "3"))
+LETTERS = ("A", "B", "C", "D")
+
+QUESTION_PROMPT = (
+    "You write exam-level multiple-choice questions for {exam}. "
+    "Return only a JSON object, no prose: "
+    '{{"question": "...", "options": {{"A": "...", "B": "...", "C": "...", "D": "..."}}, '
+    '"answer": "A", "explanation": "one line"}}. '
+    "Exactly one option is correct. Do not repeat these questions: {avoid}"
+)
+
+GRADE_PROMPT = (
+    "Question: {question}\nOptions: {options}\nCorrect answer: {answer}\n"
+    "Student's answer: {given}\n"
+    'Return only JSON: {{"correct": true}} or {{"correct": false}}.'
+)
+
+
+def ensure_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS test_questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER,
+            exam_type TEXT,
+            question TEXT,
+            options TEXT,
+            answer TEXT,
+            explanation TEXT,
+            status TEXT NOT NULL DEFAULT 'ready',
+            given TEXT,
+            correct INTEGER,
+            created_at TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_test_questions_conv ON test_questions(conversation_id, status, id)")
+
+
+def _json_object(text):
+    m = re.search(r"\{.*\}", text or "", re.S)
+    if not m:
+        raise ValueError("no JSON object in reply")
+    return json.loads(m.group(0))
+
+
+class Question:
+    __slots__ = ("id", "question", "options", "answer", "explanation")
+
+    def __init__(self, id, question, options, answer, explanation):
+        self.id, self.question, self.options = id, question, options
+        self.answer, self.explanation = answer, explanation
+
+    def render(self, number):
+        opts = "\n".join(f"{k}) {self.options[k]}" for k in LETTERS)
+        return f"Q{number}. {self.question}\n{opts}\nReply with A, B, C or D."
+
+
+class TestEngine:
+    """connect() -> sqlite3 connection; complete(messages) -> LLM reply text."""
+
+    def __init__(self, connect, complete, prefetch=PREFETCH):
+        self.connect = connect
+        self.complete = complete
+        self.prefetch_size = max(1, prefetch)
+        self._pool = ThreadPoolExecutor(max_workers=self.prefetch_size, thread_name_prefix="nexa-exam")
+        self._inflight = {}         # conversation id -> [Future]
+        self._active = set()        # conversations with a running test
+        self._lock = threading.Lock()
+
+    # ---------------------------
+    # Generation (background)
+    # ---------------------------
+    def prefetch(self, cid, exam):
+        """Top the pool for this test up to prefetch_size ready + generating questions."""
+        conn = self.connect()
+        try:
+            ready = conn.execute("SELECT COUNT(*) FROM test_questions WHERE conversation_id=? AND status='ready'",
+                                 (cid,)).fetchone()[0]
+        finally:
+            conn.close()
+        with self._lock:
+            self._active.add(cid)
+            futs = [f for f in self._inflight.get(cid, []) if not f.done()]
+            for _ in range(self.prefetch_size - ready - len(futs)):
+                futs.append(self._pool.submit(self._generate, cid, exam))
+            self._inflight[cid] = futs
+
+    def _generate(self, cid, exam):
+        conn = self.connect()
+        try:
+            seen = [r[0] for r in conn.execute(
+                "SELECT question FROM test_questions WHERE conversation_id=? ORDER BY id DESC LIMIT 15", (cid,))]
+        finally:
+            conn.close()
+        reply = self.complete([{"role": "system", "content": QUESTION_PROMPT.format(
+            exam=exam, avoid=json.dumps(seen) if seen else "none")}])
+        data = _json_object(reply)
+        options = {k: str(data["options"][k]).strip() for k in LETTERS}
+        answer = str(data["answer"]).strip().upper()[:1]
+        if answer not in LETTERS or not str(data.get("question", "")).strip():
+            raise ValueError("malformed question")
+        if cid not in self._active:
+            return                          # test ended while this was generating
+        conn = self.connect()
+        try:
+            conn.execute(
+                "INSERT INTO test_questions (conversation_id, exam_type, question, options, answer, explanation, created_at) "
+                "VALUES (?,?,?,?,?,?,?)",
+                (cid, exam, data["question"].strip(), json.dumps(options), answer,
+                 str(data.get("explanation", "")).strip(), datetime.now(timezone.utc).isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ---------------------------
+    # Serving
+    # ---------------------------
+    def next_question(self, cid, exam, timeout=60):
+        """Claim the oldest ready question, waiting on generation only if the pool is dry."""
+        with self._lock:
+            self._active.add(cid)
+        q = self._claim(cid)
+        if q is None:
+            with self._lock:
+                futs = list(self._inflight.get(cid, []))
+            for f in futs:
+                try: f.result(timeout=timeout)
+                except Exception: log.exception("question generation failed")
+                q = self._claim(cid)
+                if q: break
+            if q is None:
+                self._generate(cid, exam)      # last resort, on the caller's thread
+                q = self._claim(cid)
+        self.prefetch(cid, exam)
+        return q
+
+    def _claim(self, cid):
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                "SELECT id, question, options, answer, explanation FROM test_questions "
+                "WHERE conversation_id=? AND status='ready' ORDER BY id LIMIT 1", (cid,)).fetchone()
+            if not row:
+                return None
+            cur = conn.execute("UPDATE test_questions SET status='asked' WHERE id=? AND status='ready'", (row[0],))
+            conn.commit()
+            if not cur.rowcount:
+                return None
+            return Question(row[0], row[1], json.loads(row[2]), row[3], row[4])
+        finally:
+            conn.close()
+
+    def current(self, cid):
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                "SELECT id, question, options, answer, explanation FROM test_questions "
+                "WHERE conversation_id=? AND status='asked' ORDER BY id DESC LIMIT 1", (cid,)).fetchone()
+        finally:
+            conn.close()
+        return Question(row[0], row[1], json.loads(row[2]), row[3], row[4]) if row else None
+
+    # ---------------------------
+    # Grading
+    # ---------------------------
+    def grade(self, cid, given):
+        """(question, correct) for the question currently asked, or (None, None)."""
+        q = self.current(cid)
+        if q is None:
+            return None, None
+        correct = self._grade_locally(q, given)
+        if correct is None:
+            # free-text answer that matches no option: ask the model for a structured verdict
+            try:
+                verdict = _json_object(self.complete([{"role": "user", "content": GRADE_PROMPT.format(
+                    question=q.question, options=json.dumps(q.options), answer=q.answer, given=given)}]))
+                correct = bool(verdict.get("correct"))
+            except Exception:
+                correct = False
+        conn = self.connect()
+        try:
+            conn.execute("UPDATE test_questions SET status='answered', given=?, correct=? WHERE id=?",
+                         (given, int(correct), q.id))
+            conn.commit()
+        finally:
+            conn.close()
+        return q, correct
+
+    @staticmethod
+    def _grade_locally(q, given):
+        text = given.strip()
+        m = re.fullmatch(r"(?:(?:option|answer)\s*:?\s*)?\(?([A-Da-d])\)?(?:[.):]\s*.*)?", text, re.S | re.I)
+        if m:
+            return m.group(1).upper() == q.answer
+        low = text.lower()
+        matches = [k for k, v in q.options.items() if v and v.lower() == low]
+        if not matches:
+            matches = [k for k, v in q.options.items() if v and len(low) > 2 and low in v.lower()]
+        if len(matches) == 1:
+            return matches[0] == q.answer
+        return None
+
+    def discard(self, cid):
+        """Drop unused prefetched questions when a test ends."""
+        with self._lock:
+            self._active.discard(cid)
+        conn = self.connect()
+        try:
+            conn.execute("DELETE FROM test_questions WHERE conversation_id=? AND status='ready'", (cid,))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            for f in self._inflight.pop(cid, []):
+                f.cancel()
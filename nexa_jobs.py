@@ -0,0 +1,234 @@
+# nexa_jobs.py
+# In-process background job queue persisted to a SQLite `jobs` table.
+# Request handlers enqueue post-response work (title rename, summaries, ...);
+# a small pool of worker threads claims jobs, runs the registered handler and
+# retries failures with exponential backoff. Queued jobs survive restarts, and
+# jobs left 'running' by a dead process are reclaimed by any worker once their
+# lease expires. Servers call start() once per process (wsgi.py, gunicorn's
+# post_fork, `python Nexa.py`) so a restart drains the backlog without waiting
+# for new work; enqueue() also starts the workers if nothing did.
+#
+# Environment:
+#   NEXA_JOB_WORKERS       worker threads per process (default 2)
+#   NEXA_JOB_MAX_PENDING   queued jobs before enqueue() refuses work (default 5000)
+#   NEXA_JOB_MAX_ATTEMPTS  attempts before a job is marked failed (default 5)
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+log = logging.getLogger("nexa.jobs")
+
+LEASE_SECONDS = 300     # a 'running' job older than this is assumed orphaned
+BACKOFF_BASE = 2.0      # seconds; doubled per attempt
+BACKOFF_MAX = 600.0
+
+
+class QueueFull(Exception):
+    pass
+
+
+def ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      name TEXT NOT NULL,
+      payload TEXT NOT NULL,
+      dedupe_key TEXT,
+      status TEXT NOT NULL DEFAULT 'queued',
+      attempts INTEGER NOT NULL DEFAULT 0,
+      run_at REAL NOT NULL,
+      locked_at REAL,
+      last_error TEXT,
+      created REAL NOT NULL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, run_at)")
+    # at most one queued/running job per dedupe key
+    conn.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(dedupe_key)
+                    WHERE dedupe_key IS NOT NULL AND status IN ('queued','running')""")
+
+
+class JobQueue:
+    def __init__(self, db_path, workers=None, max_pending=None, max_attempts=None, poll=1.0):
+        self.db_path = db_path
+        self.workers = workers or int(os.getenv("NEXA_JOB_WORKERS", "2"))
+        self.max_pending = max_pending or int(os.getenv("NEXA_JOB_MAX_PENDING", "5000"))
+        self.max_attempts = max_attempts or int(os.getenv("NEXA_JOB_MAX_ATTEMPTS", "5"))
+        self.poll = poll
+        self._handlers = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = None          # cached count of queued jobs, refreshed by workers
+        self.stats_counters = {"enqueued": 0, "done": 0, "retried": 0, "failed": 0, "rejected": 0}
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    # ---------------------------
+    # Producer side
+    # ---------------------------
+    def handler(self, name):
+        """@queue.handler("name") registers fn(payload: dict); it must be idempotent."""
+        def register(fn):
+            self._handlers[name] = fn
+            return fn
+        return register
+
+    def enqueue(self, name, payload=None, key=None, delay=0.0):
+        """Persist a job and wake a worker. Returns the job id, or None when a job
+        with the same dedupe key is already queued. Raises QueueFull under backpressure."""
+        if name not in self._handlers:
+            raise KeyError(f"no handler registered for job {name!r}")
+        self._ensure_started()
+        if self._pending is not None and self._pending >= self.max_pending:
+            self._bump("rejected")
+            raise QueueFull(f"{self._pending} jobs pending")
+        now = time.time()
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO jobs (name, payload, dedupe_key, run_at, created) VALUES (?,?,?,?,?)",
+                (name, json.dumps(payload or {}), key, now + delay, now))
+            conn.commit()
+            job_id = cur.lastrowid if cur.rowcount else None
+        finally:
+            conn.close()
+        if job_id:
+            self._bump("enqueued")
+            with self._lock:
+                self._pending = (self._pending or 0) + 1
+            self._wake.set()
+        return job_id
+
+    def run_now(self, name, payload=None):
+        """Run a job's handler synchronously, e.g. when enqueue() hit backpressure."""
+        self._handlers[name](payload or {})
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            by_status = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        finally:
+            conn.close()
+        with self._lock:
+            return dict(self.stats_counters, by_status=by_status, workers=len(self._threads))
+
+    def _bump(self, key):
+        with self._lock:
+            self.stats_counters[key] += 1
+
+    # ---------------------------
+    # Workers
+    # ---------------------------
+    def start(self):
+        """Start this process's workers (idempotent; call after forking)."""
+        self._ensure_started()
+
+    def _ensure_started(self):
+        # per process: a forked child gets its own workers, never the parent's (dead) threads
+        if self._threads and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            self._threads, self._pid = [], os.getpid()
+            conn = self._connect()
+            try:
+                ensure_schema(conn)
+                conn.commit()
+            finally:
+                conn.close()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"nexa-job-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout=5.0):
+        self._stop.set(); self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._stop.clear()
+
+    def _claim(self, conn):
+        now = time.time()
+        expired = now - LEASE_SECONDS
+        # cheap reads first so idle workers never take the write lock
+        orphaned = conn.execute("SELECT 1 FROM jobs WHERE status='running' AND locked_at<? LIMIT 1", (expired,)).fetchone()
+        if not orphaned and not conn.execute("SELECT 1 FROM jobs WHERE status='queued' AND run_at<=? LIMIT 1",
+                                             (now,)).fetchone():
+            with self._lock:
+                self._pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status='queued'").fetchone()[0]
+            return None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if orphaned:
+                # lease expired: the process running it died (or the job overran); run it again
+                conn.execute("UPDATE jobs SET status='queued', locked_at=NULL WHERE status='running' AND locked_at<?",
+                             (expired,))
+            row = conn.execute(
+                "SELECT id, name, payload, attempts FROM jobs WHERE status='queued' AND run_at<=? ORDER BY run_at, id LIMIT 1",
+                (now,)).fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET status='running', attempts=attempts+1, locked_at=? WHERE id=?", (now, row[0]))
+            pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status='queued'").fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self._pending = pending
+        return row
+
+    def _work(self):
+        conn = self._connect()
+        conn.isolation_level = None     # explicit BEGIN/COMMIT
+        while not self._stop.is_set():
+            try:
+                job = self._claim(conn)
+            except sqlite3.Error:
+                job = None          # busy (or briefly unusable); try again after the poll interval
+            if not job:
+                self._wake.wait(self.poll)
+                self._wake.clear()
+                continue
+            job_id, name, payload, attempts = job
+            try:
+                self._handlers[name](json.loads(payload))
+            except Exception as e:
+                self._fail(conn, job_id, attempts + 1, e)
+                continue
+            if self._write(conn, "DELETE FROM jobs WHERE id=?", (job_id,)):
+                self._bump("done")
+        conn.close()
+
+    def _write(self, conn, sql, params, tries=5):
+        """Record a job's outcome, retrying while the database is busy. If it still
+        fails the job stays 'running' and is re-run once its lease expires."""
+        for i in range(tries):
+            try:
+                conn.execute(sql, params)
+                return True
+            except sqlite3.OperationalError as e:
+                if i == tries - 1:
+                    log.error("could not record job outcome (%s); it will be retried after its lease", e)
+                    return False
+                time.sleep(min(BACKOFF_BASE ** i * 0.1, 2.0))
+
+    def _fail(self, conn, job_id, attempts, err):
+        if attempts >= self.max_attempts:
+            log.error("job %s failed permanently: %s", job_id, err)
+            if self._write(conn, "UPDATE jobs SET status='failed', locked_at=NULL, last_error=? WHERE id=?",
+                           (repr(err), job_id)):
+                self._bump("failed")
+        else:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE ** attempts)
+            if self._write(conn, "UPDATE jobs SET status='queued', locked_at=NULL, run_at=?, last_error=? WHERE id=?",
+                           (time.time() + delay, repr(err), job_id)):
+                self._bump("retried")
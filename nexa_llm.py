@@ -0,0 +1,317 @@
+# nexa_llm.py
+# Shared OpenRouter client for Nexa.py and Nexa_Streamlit.py.
+# Sends each chat completion down an ordered chain of models/endpoints and
+# hedges slow calls: if the primary has not streamed its first token within a
+# p95-derived deadline, a backup request is fired and whichever answers first
+# wins; the loser is cancelled. A loser cancelled before its first token adds
+# its wait so far as a (lower-bound) sample, so the deadline is not fitted to
+# the winners' fast tail alone.
+#
+# Environment:
+#   NEXA_MODELS             comma-separated chain, primary first. An entry may be
+#                           "model" or "model@https://endpoint/chat/completions"
+#   NEXA_HEDGE_QUANTILE     first-token latency quantile for the deadline (0.95)
+#   NEXA_HEDGE_DEFAULT_MS   deadline used until enough samples exist (1500)
+#   NEXA_HEDGE_MIN_MS       lower clamp for the deadline (250)
+#   NEXA_HEDGE_MAX_MS       upper clamp for the deadline (8000)
+#   NEXA_HEDGE_MAX_BACKUPS  extra requests that may be fired per call (1, 0 = off)
+#
+# Streams ask for the final usage block (stream_options.include_usage, plus
+# OpenRouter's usage accounting for its cost field). Set client.on_usage to
+# receive one record per call: the winner's tokens, latency and the caller's
+# tags (see nexa_usage.py). Hedges and fallbacks that the upstream accepted
+# cost tokens too, so each adds a record with its mode tagged ":hedge";
+# cancelled streams never see the usage block, so their tokens are estimated.
+
+import os
+import json
+import time
+import queue
+import threading
+from collections import deque
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+MIN_SAMPLES = 20        # samples needed before the quantile replaces the default deadline
+WINDOW = 500            # rolling window of first-token latencies
+
+
+class LLMError(Exception):
+    pass
+
+
+def parse_chain(spec, default_url=OPENROUTER_URL):
+    """'a, b@url' -> [('a', default_url), ('b', 'url')]"""
+    chain = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        model, _, url = item.partition("@")
+        chain.append((model.strip(), url.strip() or default_url))
+    return chain
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+# ---------------------------
+# One in-flight request
+# ---------------------------
+class _Attempt:
+    def __init__(self, index, model, url):
+        self.index = index
+        self.model = model
+        self.url = url
+        self.started = time.monotonic()
+        self.ttft = None            # seconds to first token
+        self.text = None
+        self.usage = None
+        self.chars = 0              # completion characters received so far
+        self.accepted = False       # upstream answered 200: the attempt costs tokens
+        self.error = None
+        self.cancelled = False
+        self.response = None
+
+    def cancel(self):
+        self.cancelled = True
+        r = self.response
+        if r is not None:
+            # closing waits for the stream thread's pending read, so never on the caller's thread
+            threading.Thread(target=_close, args=(r,), daemon=True).start()
+
+
+def _close(r):
+    try: r.close()
+    except Exception: pass
+
+
+def _stream(attempt, api_key, payload, timeout, events):
+    """Worker thread: streams one completion and reports 'first'/'done' on events."""
+    try:
+        import requests         # deferred: about a quarter of the apps' import time, needed only once a call is made
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        body = dict(payload, model=attempt.model, stream=True, stream_options={"include_usage": True})
+        if "openrouter.ai" in attempt.url:
+            body["usage"] = {"include": True}       # adds usage.cost
+        r = requests.post(attempt.url, headers=headers, json=body, stream=True, timeout=timeout)
+        attempt.response = r
+        if attempt.cancelled:
+            return
+        if r.status_code != 200:
+            raise LLMError(f"{attempt.model}: HTTP {r.status_code}")
+        attempt.accepted = True
+        parts = []
+        for line in r.iter_lines(decode_unicode=True):
+            if attempt.cancelled:
+                return
+            if not line or not line.startswith("data:"):
+                continue            # blank keep-alives and ": OPENROUTER PROCESSING" comments
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            if chunk.get("error"):
+                raise LLMError(f"{attempt.model}: {chunk['error'].get('message', chunk['error'])}")
+            if chunk.get("usage"):
+                attempt.usage = chunk["usage"]
+            for choice in chunk.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    if attempt.ttft is None:
+                        attempt.ttft = time.monotonic() - attempt.started
+                        events.put(("first", attempt))
+                    parts.append(delta)
+                    attempt.chars += len(delta)
+        attempt.text = "".join(parts)
+        if attempt.ttft is None:
+            attempt.ttft = time.monotonic() - attempt.started
+            events.put(("first", attempt))
+    except Exception as e:
+        if not attempt.cancelled:
+            attempt.error = e
+    finally:
+        if attempt.response is not None:
+            try: attempt.response.close()
+            except Exception: pass
+        events.put(("done", attempt))
+
+
+# ---------------------------
+# Hedged client
+# ---------------------------
+class HedgedClient:
+    def __init__(self, chain, api_key):
+        self.chain = list(chain)
+        if not self.chain:
+            raise ValueError("empty model chain")
+        self.api_key = api_key
+        self.on_usage = None        # fn(record dict), called once per complete()
+        self.quantile = _env_float("NEXA_HEDGE_QUANTILE", 0.95)
+        self.default_delay = _env_float("NEXA_HEDGE_DEFAULT_MS", 1500) / 1000
+        self.min_delay = _env_float("NEXA_HEDGE_MIN_MS", 250) / 1000
+        self.max_delay = _env_float("NEXA_HEDGE_MAX_MS", 8000) / 1000
+        self.max_backups = int(_env_float("NEXA_HEDGE_MAX_BACKUPS", 1))
+        self._lock = threading.Lock()
+        self._ttfts = deque(maxlen=WINDOW)
+        self._stats = {"calls": 0, "hedged": 0, "fallbacks": 0, "failures": 0,
+                       "primary_wins": 0, "backup_wins": 0, "fallback_wins": 0,
+                       "wins_by_model": {}}
+
+    # -- deadline --
+    def hedge_delay(self):
+        with self._lock:
+            samples = sorted(self._ttfts)
+        if len(samples) < MIN_SAMPLES:
+            return self.default_delay
+        k = min(len(samples) - 1, int(self.quantile * len(samples)))
+        return min(self.max_delay, max(self.min_delay, samples[k]))
+
+    def _sample_unanswered(self, attempts, floor=0.0):
+        # still waiting for a first token: the wait so far is a lower bound on its latency.
+        # Waits under `floor` (the winner's own sample) tell the window nothing, so are skipped
+        now = time.monotonic()
+        with self._lock:
+            for a in attempts:
+                waited = now - a.started
+                if a.ttft is None and a.error is None and waited >= floor:
+                    self._ttfts.append(waited)
+
+    def _record(self, **inc):
+        with self._lock:
+            for k, v in inc.items():
+                self._stats[k] += v
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats, wins_by_model=dict(self._stats["wins_by_model"]))
+            samples = len(self._ttfts)
+        calls = s["calls"] or 1
+        hedged = s["hedged"] or 1
+        s["hedge_rate"] = round(s["hedged"] / calls, 4)
+        s["backup_win_rate"] = round(s["backup_wins"] / hedged, 4)
+        s["hedge_delay_ms"] = round(self.hedge_delay() * 1000)
+        s["ttft_samples"] = samples
+        s["chain"] = [m for m, _ in self.chain]
+        return s
+
+    def _report(self, tags, attempt, started, ok, hedge_prompt=None):
+        """hedge_prompt: set for a losing attempt (the reported attempt's prompt tokens,
+        used when the loser was cancelled before its usage block arrived)."""
+        if self.on_usage is None:
+            return
+        usage = (attempt.usage if attempt is not None else None) or {}
+        prompt, completion = int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+        tags = dict(tags or {})
+        if hedge_prompt is not None:
+            tags["mode"] = f"{tags.get('mode') or '-'}:hedge"
+            if not usage:
+                prompt, completion = hedge_prompt, -(-attempt.chars // 4)     # ~4 characters per token
+        record = dict(tags, model=attempt.model if attempt is not None else self.chain[0][0],
+                      prompt_tokens=prompt, completion_tokens=completion,
+                      cost=usage.get("cost"), latency_ms=round((time.monotonic() - started) * 1000), ok=ok)
+        try:
+            self.on_usage(record)
+        except Exception:
+            pass                    # metering must never fail a reply
+
+    def _report_hedges(self, tags, attempts, reported):
+        prompt = int(((reported.usage if reported is not None else None) or {}).get("prompt_tokens") or 0)
+        for a in attempts:
+            if a is not reported and a.accepted:
+                self._report(tags, a, a.started, a.error is None, hedge_prompt=prompt)
+
+    # -- call --
+    def complete(self, messages, max_tokens=None, timeout=60, tags=None):
+        """Return the reply text; raises LLMError when every model in the chain fails.
+        tags (e.g. {"user": ..., "mode": ...}) are passed through to on_usage."""
+        payload = {"messages": messages}
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        events = queue.Queue()
+        attempts = []
+        next_index = 0
+        backups = 0
+        started = time.monotonic()
+        end = started + timeout
+        self._record(calls=1)
+
+        def launch():
+            nonlocal next_index
+            # a single-entry chain hedges by duplicating the same request
+            model, url = self.chain[min(next_index, len(self.chain) - 1)]
+            a = _Attempt(next_index, model, url)
+            next_index += 1
+            attempts.append(a)
+            threading.Thread(target=_stream, args=(a, self.api_key, payload, timeout, events),
+                             daemon=True).start()
+
+        def in_flight():
+            return [a for a in attempts if a.error is None and not a.cancelled and a.text is None]
+
+        launch()
+        hedge_at = time.monotonic() + self.hedge_delay()
+        winner = None
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= end:
+                    raise LLMError("timed out waiting for the model")
+                may_hedge = winner is None and backups < self.max_backups
+                if may_hedge and now >= hedge_at and in_flight():
+                    if backups == 0:
+                        self._record(hedged=1)
+                    backups += 1
+                    launch()
+                    hedge_at = now + self.hedge_delay()
+                    continue
+                wait = end - now
+                if may_hedge:
+                    wait = min(wait, hedge_at - now)
+                try:
+                    kind, a = events.get(timeout=max(0.0, wait))
+                except queue.Empty:
+                    continue
+                if kind == "first":
+                    if winner is None and a.error is None and not a.cancelled:
+                        winner = a
+                        with self._lock:
+                            self._ttfts.append(a.ttft)
+                        self._sample_unanswered([o for o in attempts if o is not a], a.ttft)
+                        for other in attempts:
+                            if other is not a:
+                                other.cancel()
+                    continue
+                if a is winner:
+                    if a.error is None:
+                        break
+                    winner = None           # died mid-stream; fall back below
+                if a.error is not None and not in_flight():
+                    # everything in flight failed: move down the chain without waiting
+                    if next_index >= len(self.chain):
+                        raise LLMError(str(a.error))
+                    self._record(fallbacks=1)
+                    launch()
+                    hedge_at = time.monotonic() + self.hedge_delay()
+        except LLMError:
+            self._record(failures=1)
+            self._sample_unanswered(attempts)
+            for a in attempts:
+                a.cancel()
+            self._report(tags, attempts[-1] if attempts else None, started, False)
+            self._report_hedges(tags, attempts, attempts[-1] if attempts else None)
+            raise
+
+        if winner.index == 0:
+            self._record(primary_wins=1)
+        else:
+            self._record(**({"backup_wins": 1} if backups else {"fallback_wins": 1}))
+        with self._lock:
+            wins = self._stats["wins_by_model"]
+            wins[winner.model] = wins.get(winner.model, 0) + 1
+        self._report(tags, winner, started, True)
+        self._report_hedges(tags, attempts, winner)
+        return winner.text
@@ -0,0 +1,310 @@
+# nexa_maintenance.py
+# Retention, archival and space reclamation for both apps' databases.
+#  * Conversations idle longer than their retention rule are moved into a
+#    compressed archive database (<db>_archive.db) and can be restored later.
+#  * Deletes run in small chunks with a commit and pause between them, so the
+#    write lock is never held long enough to stall live /chat traffic.
+#  * Freed pages are returned with auto_vacuum=INCREMENTAL + incremental_vacuum
+#    in small steps instead of a blocking full VACUUM.
+#
+# Retention rules live in the retention_rules table: user '*' is the global
+# default (NEXA_RETENTION_DAYS seeds it, 0 = keep forever); other rows override
+# it per user where the database has a conversations.user column.
+#
+#   python nexa_maintenance.py run DB                  archive idle conversations, sweep, vacuum
+#   python nexa_maintenance.py restore DB CONV_ID      bring an archived conversation back
+#   python nexa_maintenance.py rule DB USER DAYS       set a retention rule ('*' = everyone)
+#   python nexa_maintenance.py enable-incremental DB   one-off VACUUM to switch auto_vacuum mode
+
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+from datetime import datetime, timedelta
+
+import nexa_codec
+
+RETENTION_DAYS = int(os.getenv("NEXA_RETENTION_DAYS", "0"))
+CHUNK_ROWS = int(os.getenv("NEXA_MAINTENANCE_CHUNK", "500"))    # rows per delete transaction
+CHUNK_PAUSE = 0.02          # seconds between chunks; lets waiting writers in
+VACUUM_PAGES = 256          # pages released per incremental_vacuum step
+
+
+def prepare(conn):
+    """Call first in init_db: new databases are created with incremental auto-vacuum."""
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")     # no-op once tables exist
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS retention_rules (
+      user TEXT PRIMARY KEY,
+      idle_days INTEGER NOT NULL
+    )""")
+    if RETENTION_DAYS:
+        conn.execute("INSERT OR IGNORE INTO retention_rules (user, idle_days) VALUES ('*', ?)", (RETENTION_DAYS,))
+
+
+def archive_path(db_path):
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_archive{ext or '.db'}"
+
+
+def _columns(conn, table, schema="main"):
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _touch_user(conn, user):
+    # keeps Nexa.py's conditional-GET version counters in step with archive/restore
+    if user is not None and _columns(conn, "user_versions"):
+        conn.execute("INSERT INTO user_versions (user, version) VALUES (?, 1) "
+                     "ON CONFLICT(user) DO UPDATE SET version=version+1", (user,))
+
+
+def _time_column(cols, *names):
+    return next((n for n in names if n in cols), None)
+
+
+# ---------------------------
+# Chunked deletes
+# ---------------------------
+def delete_in_chunks(conn, table, where, params=(), chunk=None, pause=CHUNK_PAUSE):
+    """DELETE FROM table WHERE ... in short transactions of `chunk` rows."""
+    chunk = chunk or CHUNK_ROWS
+    total = 0
+    while True:
+        cur = conn.execute(
+            f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)",
+            (*params, chunk))
+        conn.commit()
+        total += cur.rowcount
+        if cur.rowcount < chunk:
+            return total
+        time.sleep(pause)
+
+
+def delete_conversation(conn, conv_id, child_tables=("messages",), user=None):
+    """Drop the conversation row first (it vanishes from the UI at once), then its children in chunks.
+    `user`'s list version is bumped in the same commit as the row delete, so no conditional GET
+    can match a list that still shows it. Children left behind by a crash are removed by sweep_orphans()."""
+    conn.execute("DELETE FROM conversations WHERE id=?", (conv_id,))
+    _touch_user(conn, user)
+    conn.commit()
+    for table in child_tables:
+        delete_in_chunks(conn, table, "conversation_id=?", (conv_id,))
+
+
+def sweep_orphans(conn, child_tables=("messages",)):
+    n = 0
+    for table in child_tables:
+        if _columns(conn, table):
+            n += delete_in_chunks(conn, table, "conversation_id NOT IN (SELECT id FROM conversations)")
+    return n
+
+
+# ---------------------------
+# Archive / restore
+# ---------------------------
+def _open_archive(conn, db_path):
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path(db_path),))
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archive.archived_conversations (
+      id INTEGER PRIMARY KEY,
+      user TEXT,
+      title TEXT,
+      last_activity TEXT,
+      archived_at TEXT NOT NULL,
+      message_count INTEGER NOT NULL,
+      conversation TEXT NOT NULL,
+      messages BLOB NOT NULL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archived_user ON archived_conversations(user, id)")
+    conn.commit()
+
+
+def idle_conversations(conn, now=None, limit=200):
+    """[(conv_id, last_activity)] idle longer than the applicable retention rule."""
+    rules = dict(conn.execute("SELECT user, idle_days FROM retention_rules").fetchall())
+    if not rules:
+        return []
+    now = now or datetime.utcnow()
+    conv_cols = _columns(conn, "conversations")
+    msg_time = _time_column(_columns(conn, "messages"), "timestamp", "created_at")
+    conv_time = _time_column(conv_cols, "created", "created_at")
+    has_user = "user" in conv_cols
+    found = []
+    for user, days in rules.items():
+        if user != "*" and not has_user:
+            continue
+        if not days:
+            continue
+        cutoff = (now - timedelta(days=days)).isoformat()
+        if user == "*":
+            scope, params = ("c.user NOT IN (SELECT user FROM retention_rules WHERE user!='*')", ()) if has_user else ("1", ())
+        else:
+            scope, params = "c.user=?", (user,)
+        rows = conn.execute(f"""
+            SELECT c.id, COALESCE((SELECT m.{msg_time} FROM messages m WHERE m.conversation_id=c.id
+                                   ORDER BY m.id DESC LIMIT 1), c.{conv_time}) AS last
+            FROM conversations c WHERE {scope} AND COALESCE(last, '') < ? LIMIT ?""",
+            (*params, cutoff, limit)).fetchall()
+        found.extend((r[0], r[1]) for r in rows)
+    return found[:limit]
+
+
+def archive_conversation(conn, conv_id, last_activity=None):
+    """Copy one conversation into archive.archived_conversations, then delete it in chunks."""
+    conn.row_factory = sqlite3.Row
+    conv = conn.execute("SELECT * FROM conversations WHERE id=?", (conv_id,)).fetchone()
+    if conv is None:
+        return False
+    msgs = []
+    for m in conn.execute("SELECT * FROM messages WHERE conversation_id=? ORDER BY id", (conv_id,)):
+        row = dict(m)
+        row["content"] = nexa_codec.decode(row["content"], row.pop("codec", None))
+        row.pop("id")
+        msgs.append(row)
+    conv = dict(conv)
+    blob = zlib.compress(json.dumps(msgs, ensure_ascii=False).encode("utf-8"), 9)
+    conn.execute("""INSERT OR REPLACE INTO archive.archived_conversations
+                    (id, user, title, last_activity, archived_at, message_count, conversation, messages)
+                    VALUES (?,?,?,?,?,?,?,?)""",
+                 (conv_id, conv.get("user"), conv.get("title"), last_activity, datetime.utcnow().isoformat(),
+                  len(msgs), json.dumps(conv, ensure_ascii=False), sqlite3.Binary(blob)))
+    conn.commit()       # archived copy is durable before anything is deleted
+    children = ["messages"] + [t for t in ("test_questions",) if _columns(conn, t)]
+    delete_conversation(conn, conv_id, children, conv.get("user"))
+    return True
+
+
+def restore_conversation(db_path, conv_id, user=None):
+    """Move an archived conversation back into the live database. Returns False if not archived
+    (or not owned by `user` when given)."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        _open_archive(conn, db_path)
+        row = conn.execute("SELECT conversation, messages FROM archive.archived_conversations WHERE id=?"
+                           + (" AND user=?" if user is not None else ""),
+                           (conv_id, user) if user is not None else (conv_id,)).fetchone()
+        if not row:
+            return False
+        conv = json.loads(row[0])
+        msgs = json.loads(zlib.decompress(row[1]).decode("utf-8"))
+        # the summary pointed at message ids that change on restore; it is rebuilt later
+        conv.pop("summary", None); conv.pop("summary_upto", None)
+        if "created_at" in conv:                # archived before the shared nexa_store schema
+            conv.setdefault("created", conv.pop("created_at"))
+            for m in msgs: m.setdefault("timestamp", m.pop("created_at", None))
+        if "version" in conv:
+            conv["version"] += 1    # message ids changed; invalidates cached ETags
+        conv_cols = [c for c in conv if c in set(_columns(conn, "conversations"))]
+        msg_cols = set(_columns(conn, "messages"))
+        conn.execute(f"INSERT OR REPLACE INTO conversations ({', '.join(conv_cols)}) VALUES ({', '.join('?' * len(conv_cols))})",
+                     [conv[c] for c in conv_cols])
+        rows = []
+        for m in msgs:
+            m["content"], m["codec"] = nexa_codec.encode(m["content"])
+            rows.append(m)
+        if rows:
+            cols = [c for c in rows[0] if c in msg_cols]
+            conn.executemany(f"INSERT INTO messages ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                             [[m.get(c) for c in cols] for m in rows])
+        conn.execute("DELETE FROM archive.archived_conversations WHERE id=?", (conv_id,))
+        _touch_user(conn, conv.get("user"))
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def list_archived(db_path, user=None, limit=100):
+    if not os.path.exists(archive_path(db_path)):
+        return []
+    conn = sqlite3.connect(archive_path(db_path), timeout=30)
+    try:
+        if not _columns(conn, "archived_conversations"):
+            return []
+        sql = "SELECT id, title, last_activity, archived_at, message_count FROM archived_conversations"
+        params = ()
+        if user is not None:
+            sql += " WHERE user=?"; params = (user,)
+        rows = conn.execute(sql + " ORDER BY id DESC LIMIT ?", (*params, limit)).fetchall()
+        return [dict(id=r[0], title=r[1] or "New chat", last_activity=r[2], archived_at=r[3], messages=r[4]) for r in rows]
+    finally:
+        conn.close()
+
+
+# ---------------------------
+# Space reclamation
+# ---------------------------
+def incremental_vacuum(conn, pages=VACUUM_PAGES, budget=5.0, pause=CHUNK_PAUSE):
+    """Release free pages in small steps until none are left or `budget` seconds pass."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    released, end = 0, time.monotonic() + budget
+    while time.monotonic() < end:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            break
+        conn.execute(f"PRAGMA incremental_vacuum({min(pages, free)})").fetchall()
+        conn.commit()
+        released += min(pages, free)
+        time.sleep(pause)
+    if released:
+        # in WAL mode the file only shrinks once the pages are checkpointed; PASSIVE never blocks writers
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    return released
+
+
+def enable_incremental(db_path):
+    """Switching an existing database to incremental auto-vacuum needs one full VACUUM (offline)."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    conn.close()
+    return mode == 2
+
+
+def run(db_path, out=sys.stdout, batch=200):
+    """One maintenance pass: archive idle conversations, sweep orphans, reclaim space."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        prepare(conn); conn.commit()
+        archived = 0
+        idle = idle_conversations(conn, limit=batch)
+        if idle:
+            _open_archive(conn, db_path)
+            for conv_id, last in idle:
+                archived += archive_conversation(conn, conv_id, last)
+                time.sleep(CHUNK_PAUSE)
+        conn.row_factory = None
+        children = ["messages"] + [t for t in ("test_questions",) if _columns(conn, t)]
+        swept = sweep_orphans(conn, children)
+        pages = incremental_vacuum(conn)
+        print(f"{db_path}: archived {archived} conversations, removed {swept} orphaned rows, "
+              f"released {pages} pages", file=out)
+        return archived
+    finally:
+        conn.close()
+
+
+def set_rule(db_path, user, days):
+    conn = sqlite3.connect(db_path, timeout=30)
+    prepare(conn)
+    conn.execute("INSERT OR REPLACE INTO retention_rules (user, idle_days) VALUES (?, ?)", (user, int(days)))
+    conn.commit(); conn.close()
+
+
+if __name__ == "__main__":
+    cmd, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 2 else (None, [])
+    if cmd == "run":
+        for path in args: run(path)
+    elif cmd == "restore" and len(args) == 2:
+        print("restored" if restore_conversation(args[0], int(args[1])) else "not in archive")
+    elif cmd == "rule" and len(args) == 3:
+        set_rule(*args)
+    elif cmd == "enable-incremental":
+        for path in args: print(path, "incremental" if enable_incremental(path) else "unchanged")
+    else:
+        sys.exit("usage: python nexa_maintenance.py run DB... | restore DB CONV_ID | rule DB USER DAYS"
+                 " | enable-incremental DB...")
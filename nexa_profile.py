@@ -0,0 +1,211 @@
+# nexa_profile.py
+# On-demand profiling of single requests (Nexa.py) or script runs
+# (Nexa_Streamlit.py). A capture samples the stack of the thread that started
+# it every `interval` seconds from a helper thread, and records every SQL
+# statement run on connections checked out by that thread (nexa_store's pool
+# and the apps' get_db_conn call trace()). On stop it writes, under out_dir:
+#   <id>.folded            collapsed stacks ("a;b;c count"): flamegraph.pl, speedscope, inferno
+#   <id>.speedscope.json   open at https://www.speedscope.app
+#   <id>.sql.txt           statements with their start offset, then counts per statement
+#   <id>.json              summary, read by index_html()
+# Nothing runs while no capture is active: no sampler thread, no trace
+# callbacks, and trace() is a check of one module global.
+
+import os
+import sys
+import json
+import time
+import random
+import secrets
+import threading
+from html import escape
+from collections import Counter
+from contextlib import contextmanager
+
+ACTIVE = 0                      # captures running in this process
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def trace(conn):
+    """Log conn's statements into the calling thread's capture, if there is one."""
+    if ACTIVE:
+        cap = getattr(_local, "capture", None)
+        if cap is not None and cap.meta is None:
+            conn.set_trace_callback(cap.sql)
+            return True
+    return False
+
+
+def untrace(conn):
+    conn.set_trace_callback(None)
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Capture:
+    def __init__(self, profiler, label, reason, interval, max_seconds):
+        self.profiler, self.label, self.reason = profiler, label, reason
+        self.interval, self.max_seconds = interval, max_seconds
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+        self.thread_id = threading.get_ident()
+        self.stacks = []            # (stack tuple root-first, weight seconds)
+        self.queries = []           # (offset seconds, sql)
+        self.meta = None
+        self._stop = threading.Event()
+        self._done = threading.Lock()
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        _local.capture = self
+        global ACTIVE
+        with _lock:
+            ACTIVE += 1
+        self._sampler = threading.Thread(target=self._sample, name=f"nexa-profile-{self.id}", daemon=True)
+        self._sampler.start()
+
+    def sql(self, statement):
+        self.queries.append((time.perf_counter() - self.started, statement))
+
+    def _sample(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                self.stacks.append((tuple(reversed(stack)), now - last))
+            last = now
+            if now - self.started > self.max_seconds:      # e.g. a Streamlit rerun that never reached stop()
+                threading.Thread(target=self.stop, daemon=True).start()
+                return
+
+    def stop(self):
+        """End the capture and write its files; returns the summary dict (idempotent)."""
+        with self._done:
+            if self.meta is not None:
+                return self.meta
+            self._stop.set()
+            if threading.current_thread() is not self._sampler:
+                self._sampler.join()
+            if getattr(_local, "capture", None) is self:
+                _local.capture = None
+            global ACTIVE
+            with _lock:
+                ACTIVE -= 1
+            self.meta = self.profiler._write(self)
+            return self.meta
+
+
+class Profiler:
+    def __init__(self, out_dir="profiles", sample_every=0, interval=0.005, keep=50, max_seconds=60):
+        self.out_dir = out_dir
+        self.sample_every = int(sample_every or 0)      # 0: only on request
+        self.interval = interval
+        self.keep = keep
+        self.max_seconds = max_seconds
+
+    def should_sample(self):
+        return self.sample_every > 0 and random.random() * self.sample_every < 1
+
+    def start(self, label, reason="requested"):
+        return Capture(self, label, reason, self.interval, self.max_seconds)
+
+    @contextmanager
+    def capture(self, label, reason="requested"):
+        cap = self.start(label, reason)
+        try:
+            yield cap
+        finally:
+            cap.stop()
+
+    # ---------------------------
+    # Output
+    # ---------------------------
+    def _write(self, cap):
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, cap.id)
+        duration = time.perf_counter() - cap.started
+
+        folded = Counter()
+        for stack, _ in cap.stacks:
+            folded[";".join(stack)] += 1
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            for stack, n in folded.most_common():
+                f.write(f"{stack} {n}\n")
+
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, weight in cap.stacks:
+            ids = []
+            for name in stack:
+                if name not in index:
+                    index[name] = len(frames)
+                    frames.append({"name": name})
+                ids.append(index[name])
+            samples.append(ids)
+            weights.append(round(weight * 1000, 3))
+        with open(base + ".speedscope.json", "w", encoding="utf-8") as f:
+            json.dump({"$schema": "https://www.speedscope.app/file-format-schema.json",
+                       "name": cap.label, "exporter": "nexa_profile",
+                       "shared": {"frames": frames},
+                       "profiles": [{"type": "sampled", "name": cap.label, "unit": "milliseconds",
+                                     "startValue": 0, "endValue": round(sum(weights), 3),
+                                     "samples": samples, "weights": weights}]}, f)
+
+        with open(base + ".sql.txt", "w", encoding="utf-8") as f:
+            for offset, statement in cap.queries:
+                f.write(f"{offset * 1000:9.2f} ms  {statement}\n")
+            f.write("\n# count  statement\n")
+            for statement, n in Counter(s for _, s in cap.queries).most_common():
+                f.write(f"{n:7d}  {statement}\n")
+
+        meta = {"id": cap.id, "label": cap.label, "reason": cap.reason,
+                "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(cap.started_at)),
+                "duration_ms": round(duration * 1000, 1), "samples": len(cap.stacks), "queries": len(cap.queries)}
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        self._prune()
+        return meta
+
+    def _prune(self):
+        old = sorted(n for n in os.listdir(self.out_dir) if n.endswith(".json") and not n.endswith(".speedscope.json"))
+        for name in old[:-self.keep]:
+            stem = name[:-len(".json")]
+            for ext in (".json", ".folded", ".speedscope.json", ".sql.txt"):
+                try:
+                    os.remove(os.path.join(self.out_dir, stem + ext))
+                except FileNotFoundError:
+                    pass
+
+    def recent(self):
+        """Summaries of the kept captures, newest first."""
+        if not os.path.isdir(self.out_dir):
+            return []
+        out = []
+        for name in sorted(os.listdir(self.out_dir), reverse=True):
+            if name.endswith(".json") and not name.endswith(".speedscope.json"):
+                try:
+                    with open(os.path.join(self.out_dir, name), encoding="utf-8") as f:
+                        out.append(json.load(f))
+                except (OSError, ValueError):
+                    continue            # being written or pruned
+        return out
+
+
+def index_html(captures, href):
+    """Small HTML table of captures; href(filename) -> link target."""
+    rows = "".join(
+        f"<tr><td>{c['started']}</td><td>{escape(c['label'])}</td><td>{c['reason']}</td>"
+        f"<td>{c['duration_ms']}</td><td>{c['samples']}</td><td>{c['queries']}</td>"
+        f"<td><a href='{href(c['id'] + '.folded')}'>folded</a> · "
+        f"<a href='{href(c['id'] + '.speedscope.json')}'>speedscope</a> · "
+        f"<a href='{href(c['id'] + '.sql.txt')}'>sql</a></td></tr>" for c in captures)
+    return ("<html><head><title>Profiles</title><style>body{background:#000;color:#fff;font-family:Inter;padding:20px}"
+            "a{color:#0ff}td,th{padding:4px 10px;text-align:left}</style></head><body><h2>Recent profiles</h2>"
+            "<table><tr><th>Started</th><th>Request</th><th>Why</th><th>ms</th><th>Samples</th><th>SQL</th><th></th></tr>"
+            f"{rows}</table><p>Open the speedscope files at https://www.speedscope.app</p></body></html>")
@@ -0,0 +1,242 @@
+# nexa_shards.py
+# Per-user sharding of Nexa.py's database. With SHARDS > 1 the configured
+# DB_FILE becomes a small directory database (users, jobs) and each user's
+# conversations, messages and version counters live in one of SHARDS files
+# (<root>_shard<i>.db), each with its own write lock. New users are placed by
+# consistent hashing of the username and the placement is recorded in
+# users.shard, so adding shards later never moves existing users.
+#
+# Conversation ids carry their shard: shard i allocates ids from i << ID_BITS,
+# so any helper that only has a conversation id can route without a lookup.
+#
+# Split an existing single-file database (run with the app stopped):
+#   python nexa_shards.py split nexa_final.db 4 [--drop]
+# --drop removes the moved rows from the source afterwards, leaving only the
+# directory tables behind.
+
+import os
+import sys
+import json
+import zlib
+import bisect
+import hashlib
+import sqlite3
+import threading
+
+import nexa_maintenance
+
+ID_BITS = 40                # ids per shard; JS numbers stay exact up to 2**53
+VNODES = 64                 # points per shard on the hash ring
+DATA_TABLES = ("conversations", "messages", "user_versions")
+
+
+class UnknownShard(LookupError):
+    pass
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes, vnodes=VNODES):
+        ring = sorted((_hash(f"{n}#{v}"), n) for n in nodes for v in range(vnodes))
+        self._keys = [h for h, _ in ring]
+        self._nodes = [n for _, n in ring]
+
+    def node(self, key):
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[i]
+
+
+def shard_path(db_file, index):
+    root, ext = os.path.splitext(db_file)
+    return f"{root}_shard{index}{ext or '.db'}"
+
+
+def id_base(index):
+    return index << ID_BITS
+
+
+class Router:
+    """Maps users and conversation ids to database files. shards <= 1 means the
+    single-file layout: every lookup returns db_file."""
+
+    def __init__(self, db_file, shards=0):
+        self.db_file = db_file
+        self.count = max(int(shards or 0), 1)
+        self.ring = HashRing(range(self.count)) if self.sharded else None
+        self._placed = {}           # username -> shard index (never changes once recorded)
+        self._lock = threading.Lock()
+
+    @property
+    def sharded(self):
+        return self.count > 1
+
+    def path(self, index):
+        if not 0 <= index < self.count:
+            raise UnknownShard(index)
+        return shard_path(self.db_file, index) if self.sharded else self.db_file
+
+    def paths(self):
+        """Every database holding conversations."""
+        return [self.path(i) for i in range(self.count)]
+
+    def place(self, user):
+        """Shard for a new user."""
+        return self.ring.node(user) if self.sharded else 0
+
+    def shard_of_user(self, user):
+        if not self.sharded:
+            return 0
+        index = self._placed.get(user)
+        if index is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            try:
+                row = conn.execute("SELECT shard FROM users WHERE username=?", (user,)).fetchone()
+            finally:
+                conn.close()
+            index = row[0] if row and row[0] is not None else self.place(user)
+            with self._lock:
+                self._placed[user] = index
+        return index
+
+    def user_db(self, user):
+        return self.path(self.shard_of_user(user))
+
+    def conv_db(self, conv_id):
+        return self.path(int(conv_id) >> ID_BITS)
+
+
+def ensure_directory(conn):
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(users)")}
+    if "shard" not in cols:
+        conn.execute("ALTER TABLE users ADD COLUMN shard INTEGER")
+
+
+def ensure_id_base(conn, index):
+    """Start this shard's conversation ids at its base (no-op for shard 0)."""
+    base = id_base(index)
+    if not base:
+        return
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='conversations'").fetchone()
+    if row is None:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('conversations', ?)", (base,))
+    elif row[0] < base:
+        conn.execute("UPDATE sqlite_sequence SET seq=? WHERE name='conversations'", (base,))
+
+
+# ---------------------------
+# Split tool
+# ---------------------------
+def _schema(conn, tables):
+    """CREATE statements for the given tables and their indexes, as stored in the source."""
+    return [r[0] for r in conn.execute(
+        f"SELECT sql FROM sqlite_master WHERE tbl_name IN ({','.join('?' * len(tables))}) "
+        "AND sql IS NOT NULL ORDER BY type='index'", tables)]
+
+
+def _remap_archive(src_db, router, placement, out):
+    src_archive = nexa_maintenance.archive_path(src_db)
+    if not os.path.exists(src_archive):
+        return
+    src = sqlite3.connect(src_archive, timeout=30)
+    cols = [r[1] for r in src.execute("PRAGMA table_info(archived_conversations)")]
+    by_shard = {}
+    for row in src.execute(f"SELECT {', '.join(cols)} FROM archived_conversations"):
+        rec = dict(zip(cols, row))
+        index = placement.get(rec["user"], router.place(rec["user"]))
+        new_id = rec["id"] + id_base(index)
+        conv = json.loads(rec["conversation"]); conv["id"] = new_id
+        msgs = json.loads(zlib.decompress(rec["messages"]).decode("utf-8"))
+        for m in msgs:
+            m["conversation_id"] = new_id
+        rec.update(id=new_id, conversation=json.dumps(conv, ensure_ascii=False),
+                   messages=sqlite3.Binary(zlib.compress(json.dumps(msgs, ensure_ascii=False).encode("utf-8"), 9)))
+        by_shard.setdefault(index, []).append([rec[c] for c in cols])
+    src.close()
+    for index, rows in sorted(by_shard.items()):
+        dest = sqlite3.connect(router.path(index), timeout=30)
+        nexa_maintenance._open_archive(dest, router.path(index))
+        dest.executemany(f"INSERT OR REPLACE INTO archive.archived_conversations ({', '.join(cols)}) "
+                         f"VALUES ({', '.join('?' * len(cols))})", rows)
+        dest.commit(); dest.close()
+        print(f"{nexa_maintenance.archive_path(router.path(index))}: {len(rows)} archived conversations", file=out)
+
+
+def split(db_file, shards, drop=False, out=sys.stdout):
+    """Copy a single-file database's per-user data into `shards` shard files and
+    record each user's placement in users.shard. db_file becomes the directory."""
+    router = Router(db_file, shards)
+    if not router.sharded:
+        raise ValueError("need at least 2 shards")
+    src = sqlite3.connect(db_file, timeout=30)
+    ensure_directory(src)
+    users = {r[0] for r in src.execute("SELECT username FROM users")}
+    users |= {r[0] for r in src.execute("SELECT DISTINCT user FROM conversations")}
+    placement = {u: router.place(u) for u in users}
+    src.executemany("UPDATE users SET shard=? WHERE username=?", [(i, u) for u, i in placement.items()])
+    src.commit()
+    schema = _schema(src, DATA_TABLES)
+    src.close()
+
+    for index in range(router.count):
+        path = router.path(index)
+        conn = sqlite3.connect(path, timeout=30)
+        nexa_maintenance.prepare(conn)
+        for sql in schema:
+            conn.execute(sql.replace("CREATE TABLE ", "CREATE TABLE IF NOT EXISTS ", 1)
+                            .replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1)
+                            .replace("CREATE UNIQUE INDEX ", "CREATE UNIQUE INDEX IF NOT EXISTS ", 1))
+        ensure_id_base(conn, index)
+        conn.execute("ATTACH DATABASE ? AS src", (db_file,))
+        conn.execute("CREATE TEMP TABLE moving (user TEXT PRIMARY KEY)")
+        conn.executemany("INSERT INTO moving VALUES (?)", [(u,) for u, i in placement.items() if i == index])
+        base = id_base(index)
+        conv_cols = [r[1] for r in conn.execute("PRAGMA src.table_info(conversations)")]
+        msg_cols = [r[1] for r in conn.execute("PRAGMA src.table_info(messages)")]
+        conv_sel = ", ".join("id + ?" if c == "id" else c for c in conv_cols)
+        msg_sel = ", ".join("conversation_id + ?" if c == "conversation_id" else c for c in msg_cols)
+        conn.execute(f"INSERT OR REPLACE INTO conversations ({', '.join(conv_cols)}) SELECT {conv_sel} "
+                     "FROM src.conversations WHERE user IN (SELECT user FROM moving)", (base,))
+        conn.execute(f"INSERT OR REPLACE INTO messages ({', '.join(msg_cols)}) SELECT {msg_sel} "
+                     "FROM src.messages WHERE conversation_id IN "
+                     "(SELECT id FROM src.conversations WHERE user IN (SELECT user FROM moving))", (base,))
+        conn.execute("INSERT OR REPLACE INTO user_versions SELECT * FROM src.user_versions "
+                     "WHERE user IN (SELECT user FROM moving)")
+        ensure_id_base(conn, index)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.commit()
+        n = conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        conn.execute("DETACH DATABASE src")
+        conn.close()
+        print(f"{path}: {sum(1 for i in placement.values() if i == index)} users, {n} conversations", file=out)
+
+    _remap_archive(db_file, router, placement, out)
+
+    src = sqlite3.connect(db_file, timeout=30)
+    conv_shard = {cid: placement[u] for cid, u in src.execute("SELECT id, user FROM conversations")}
+    # queued jobs still name conversations by their old ids
+    if src.execute("SELECT 1 FROM sqlite_master WHERE name='jobs'").fetchone():
+        for job_id, payload in src.execute("SELECT id, payload FROM jobs").fetchall():
+            p = json.loads(payload)
+            if p.get("conv_id") in conv_shard:
+                p["conv_id"] += id_base(conv_shard[p["conv_id"]])
+                src.execute("UPDATE jobs SET payload=?, dedupe_key=NULL WHERE id=?", (json.dumps(p), job_id))
+        src.commit()
+    if drop:
+        for table in ("messages", "conversations", "user_versions"):
+            src.execute(f"DROP TABLE IF EXISTS {table}")
+        src.commit()
+        src.execute("VACUUM")
+    src.close()
+    return placement
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) == 3 and args[0] == "split":
+        split(args[1], int(args[2]), drop="--drop" in sys.argv)
+        print(f"done; start the app with NEXA_SHARDS={args[2]}")
+    else:
+        sys.exit("usage: python nexa_shards.py split DB_FILE SHARDS [--drop]")
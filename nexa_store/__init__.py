@@ -0,0 +1,18 @@
+# nexa_store
+# Shared storage layer for Nexa.py and Nexa_Streamlit.py: one conversation
+# schema, pooled connections, cached statements, __slots__ rows and an LRU of
+# recent conversation tails (cache.py), plus optional group commit of message
+# inserts (writer.py, NEXA_GROUP_COMMIT=1).
+#
+#   store = nexa_store.get("nexa_final.db")
+#   cid = store.create_conversation("alice")
+#   store.save_message(cid, "user", "hello", sender="alice")
+#   [m.content for m in store.load_messages(cid)]
+
+from .cache import TAILS, TailCache
+from .pool import ConnectionPool
+from .schema import ensure_schema
+from .store import Conversation, Message, Store, get, group_commit_stats
+
+__all__ = ["ConnectionPool", "Conversation", "Message", "Store", "TAILS", "TailCache", "ensure_schema", "get",
+           "group_commit_stats"]
@@ -0,0 +1,138 @@
+# nexa_store/cache.py
+# Process-wide LRU of conversation tails: the most recent TAIL_MESSAGES
+# messages of recently used conversations, bounded by entry count and by an
+# estimate of their size in bytes. Store keeps it current by write-through
+# (save_messages appends what it just committed) and drops entries on delete.
+# Every entry carries the conversations.version it reflects; readers compare
+# it with the row's version (one primary-key lookup) so writes from another
+# process are never served stale.
+#
+# Environment:
+#   NEXA_TAIL_MESSAGES      messages kept per conversation (default 32)
+#   NEXA_TAIL_CACHE_ENTRIES conversations kept (default 2000)
+#   NEXA_TAIL_CACHE_MB      approximate memory budget (default 32)
+
+import os
+import threading
+from collections import OrderedDict
+
+TAIL_MESSAGES = int(os.getenv("NEXA_TAIL_MESSAGES", "32"))
+MAX_ENTRIES = int(os.getenv("NEXA_TAIL_CACHE_ENTRIES", "2000"))
+MAX_BYTES = int(float(os.getenv("NEXA_TAIL_CACHE_MB", "32")) * 1024 * 1024)
+ROW_OVERHEAD = 200      # rough bytes per cached Message besides its strings
+
+
+class Tail:
+    __slots__ = ("version", "messages", "floor", "size")
+
+    def __init__(self, version, messages, floor):
+        self.version = version
+        self.messages = messages        # Message rows, oldest first
+        self.floor = floor              # id of the newest message not kept here; 0 = tail is complete
+        self.size = sum(_size(m) for m in messages)
+
+    @property
+    def complete(self):
+        return self.floor == 0
+
+    def covers_after(self, msg_id):
+        """True when every message with id > msg_id is in this tail."""
+        return self.floor <= msg_id
+
+
+def _size(m):
+    return ROW_OVERHEAD + len(m.content or "") + len(m.image or "") + len(m.sender or "")
+
+
+class TailCache:
+    def __init__(self, tail=TAIL_MESSAGES, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.tail = tail
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # (db path, conversation id) -> Tail, least recent first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "appends": 0, "invalidations": 0}
+
+    def get(self, key, version):
+        """(messages, floor) for key if its tail reflects `version`, else None (a miss)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return list(entry.messages), entry.floor
+            if entry is not None:
+                self._drop(key)
+                self.counters["stale"] += 1
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, version, messages, floor=0):
+        """Store the newest messages read from the database at `version` (oldest first);
+        floor is the id of the newest message older than these (0 if there is none)."""
+        if len(messages) > self.tail:
+            floor, messages = messages[-self.tail - 1].id, messages[-self.tail:]
+        entry = Tail(version, list(messages), floor)
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+        return list(messages), floor
+
+    def advance(self, key, version, new_messages=()):
+        """Write-through after a commit that moved the conversation to `version`.
+        Applied only on top of version - 1; anything else means another writer
+        got in between, so the entry is dropped and the next read reloads it."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if entry.version != version - 1:
+                self._drop(key)
+                self.counters["invalidations"] += 1
+                return
+            entry.version = version
+            if new_messages:
+                entry.messages.extend(new_messages)
+                added = sum(_size(m) for m in new_messages)
+                entry.size += added
+                self._bytes += added
+                overflow = len(entry.messages) - self.tail
+                if overflow > 0:
+                    removed = sum(_size(m) for m in entry.messages[:overflow])
+                    entry.floor = entry.messages[overflow - 1].id
+                    del entry.messages[:overflow]
+                    entry.size -= removed
+                    self._bytes -= removed
+                self.counters["appends"] += 1
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def discard(self, key):
+        with self._lock:
+            if self._drop(key):
+                self.counters["invalidations"] += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry is not None
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return dict(self.counters, entries=len(self._entries), bytes=self._bytes,
+                        max_entries=self.max_entries, max_bytes=self.max_bytes, tail=self.tail,
+                        hit_rate=round(self.counters["hits"] / lookups, 4) if lookups else None)
+
+
+TAILS = TailCache()
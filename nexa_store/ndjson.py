@@ -0,0 +1,163 @@
+# nexa_store/ndjson.py
+# Streaming export/import of conversation history as gzipped NDJSON.
+# One {"type": "conversation", ...} line is followed by that conversation's
+# {"type": "message", ...} lines. Export reads in keyset pages, so memory stays
+# flat and no read transaction outlives a page (WAL checkpoints keep running).
+# Import batches messages through executemany and commits every `batch` rows,
+# so live writers only ever wait for one short transaction. Each commit bumps
+# conversations.version for the conversations it added messages to, so a live
+# reader never keeps a cached (ETag, tail cache) copy of a partial import.
+#
+#   python -m nexa_store.ndjson export DB OUT.ndjson.gz [--user=U]
+#   python -m nexa_store.ndjson import DB IN.ndjson.gz [--user=U]
+
+import sys
+import gzip
+import json
+import time
+import zlib
+import sqlite3
+
+import nexa_codec
+
+PAGE = 500              # rows per export query
+BATCH = 5000            # message rows per import transaction
+FLUSH = 64 * 1024       # bytes of NDJSON gathered before each compress() call
+
+_CONVERSATIONS = "SELECT id, user, title, created FROM conversations WHERE id>?{} ORDER BY id LIMIT ?"
+_MESSAGES = ("SELECT id, sender, role, content, codec, image, timestamp FROM messages "
+             "WHERE conversation_id=? AND id>? ORDER BY id LIMIT ?")
+_INSERT_CONVERSATION = "INSERT INTO conversations (user, title, created) VALUES (?, ?, ?)"
+_INSERT_MESSAGE = ("INSERT INTO messages (conversation_id, sender, role, content, codec, image, timestamp) "
+                   "VALUES (?,?,?,?,?,?,?)")
+_BUMP_CONVERSATION = "UPDATE conversations SET version=version+1 WHERE id=?"
+_BUMP_USER = ("INSERT INTO user_versions (user, version) VALUES (?, 1) "
+              "ON CONFLICT(user) DO UPDATE SET version=version+1")
+
+
+# ---------------------------
+# Export
+# ---------------------------
+def iter_records(db_path, user=None, page=PAGE):
+    """Yield conversation and message dicts, oldest conversation first."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+    sql = _CONVERSATIONS.format(" AND user=?" if user is not None else "")
+    try:
+        last = 0
+        while True:
+            params = (last, user, page) if user is not None else (last, page)
+            convs = conn.execute(sql, params).fetchall()
+            if not convs:
+                return
+            for cid, owner, title, created in convs:
+                yield {"type": "conversation", "id": cid, "user": owner, "title": title, "created": created}
+                mid = 0
+                while True:
+                    msgs = conn.execute(_MESSAGES, (cid, mid, page)).fetchall()
+                    for mid, sender, role, content, codec, image, ts in msgs:
+                        yield {"type": "message", "conversation_id": cid, "sender": sender, "role": role,
+                               "content": nexa_codec.decode(content, codec), "image": image, "timestamp": ts}
+                    if len(msgs) < page:
+                        break
+            last = convs[-1][0]
+    finally:
+        conn.close()
+
+
+def gzip_ndjson(records, level=6):
+    """Encode records as NDJSON and yield gzip-compressed chunks."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)      # wbits 31: gzip container
+    buf, size = [], 0
+    for rec in records:
+        line = json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n"
+        buf.append(line); size += len(line)
+        if size >= FLUSH:
+            chunk = z.compress(b"".join(buf))
+            buf, size = [], 0
+            if chunk:
+                yield chunk
+    yield z.compress(b"".join(buf)) + z.flush()
+
+
+def export_file(db_path, out_path, user=None):
+    n = 0
+    with open(out_path, "wb") as f:
+        def counted():
+            nonlocal n
+            for rec in iter_records(db_path, user):
+                n += 1
+                yield rec
+        for chunk in gzip_ndjson(counted()):
+            f.write(chunk)
+    return n
+
+
+# ---------------------------
+# Import
+# ---------------------------
+def read_records(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def import_records(records, db_for_user, user=None, batch=BATCH, pause=0.01):
+    """Insert exported records as new conversations (fresh ids). db_for_user(user) -> path
+    picks the database per owner; `user` re-owns everything. Returns (conversations, messages)."""
+    conns, pending = {}, {}
+    current = None              # (conn, new conversation id) for the latest conversation line
+    n_conv = n_msg = 0
+
+    def flush(conn):
+        rows = pending.pop(conn, None)
+        if rows:
+            conn.executemany(_INSERT_MESSAGE, rows)
+            conn.executemany(_BUMP_CONVERSATION, [(cid,) for cid in dict.fromkeys(r[0] for r in rows)])
+        conn.commit()
+        time.sleep(pause)       # let live writers in between large batches
+
+    try:
+        for rec in records:
+            if rec.get("type") == "conversation":
+                owner = user or rec.get("user") or "guest"
+                path = db_for_user(owner)
+                conn = conns.get(path)
+                if conn is None:
+                    conn = conns[path] = sqlite3.connect(path, timeout=30)
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                cid = conn.execute(_INSERT_CONVERSATION, (owner, rec.get("title"), rec.get("created"))).lastrowid
+                conn.execute(_BUMP_USER, (owner,))
+                current = (conn, cid)
+                n_conv += 1
+            elif rec.get("type") == "message":
+                if current is None:
+                    raise ValueError("message line before any conversation line")
+                conn, cid = current
+                body, codec = nexa_codec.encode(rec.get("content"))
+                rows = pending.setdefault(conn, [])
+                rows.append((cid, rec.get("sender"), rec.get("role"), body, codec, rec.get("image"), rec.get("timestamp")))
+                n_msg += 1
+                if len(rows) >= batch:
+                    flush(conn)
+        for conn in list(conns.values()):
+            flush(conn)
+    finally:
+        for conn in conns.values():
+            conn.close()
+    return n_conv, n_msg
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--user")]
+    user = next((a.split("=", 1)[1] for a in sys.argv[1:] if a.startswith("--user=")), None)
+    if len(args) != 3 or args[0] not in ("export", "import"):
+        sys.exit("usage: python -m nexa_store.ndjson export|import DB FILE.ndjson.gz [--user=U]")
+    cmd, db, path = args
+    started = time.monotonic()
+    if cmd == "export":
+        print(f"exported {export_file(db, path, user)} records", end="")
+    else:
+        convs, msgs = import_records(read_records(path), lambda u: db, user)
+        print(f"imported {convs} conversations, {msgs} messages", end="")
+    print(f" in {time.monotonic() - started:.1f}s")
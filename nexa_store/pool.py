@@ -0,0 +1,59 @@
+# nexa_store/pool.py
+# Small LIFO pool of SQLite connections. Reusing connections keeps sqlite3's
+# per-connection prepared-statement cache warm, so the store's fixed SQL
+# strings are parsed once per connection instead of once per call.
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import nexa_profile
+
+
+class ConnectionPool:
+    def __init__(self, path, size=8, cached_statements=64, timeout=30):
+        self.path = path
+        self.size = size
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _open(self):
+        # handed between threads, but only ever used by one at a time
+        return sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success, rolls back on error."""
+        with self._lock:
+            if self._pid != os.getpid():        # forked: never share the parent's handles
+                self._idle, self._pid = [], os.getpid()
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._open()
+        traced = nexa_profile.trace(conn)
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            if traced:
+                nexa_profile.untrace(conn)
+            with self._lock:
+                if len(self._idle) < self.size and self._pid == os.getpid():
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,63 @@
+# nexa_store/schema.py
+# The conversation tables shared by Nexa.py and Nexa_Streamlit.py, and the
+# in-place upgrade of databases created by either app's older schema.
+
+import nexa_codec
+import nexa_summary
+
+
+def _columns(conn, table):
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def ensure_schema(conn):
+    """Create or upgrade conversations, messages and user_versions. Idempotent."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS conversations (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user TEXT NOT NULL DEFAULT 'guest',
+      title TEXT,
+      created TEXT NOT NULL,
+      version INTEGER NOT NULL DEFAULT 0
+    )""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      conversation_id INTEGER,
+      sender TEXT,
+      role TEXT,
+      content TEXT,
+      image TEXT,
+      timestamp TEXT
+    )""")
+    # version counters behind Nexa.py's ETags (/conversations, /get_messages)
+    # `messages` counts message saves across the user's conversations (Nexa.py's
+    # /events heartbeat uses it to notice writes made by other processes)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_versions (
+      user TEXT PRIMARY KEY,
+      version INTEGER NOT NULL,
+      messages INTEGER NOT NULL DEFAULT 0
+    )""")
+    if "messages" not in _columns(conn, "user_versions"):
+        conn.execute("ALTER TABLE user_versions ADD COLUMN messages INTEGER NOT NULL DEFAULT 0")
+
+    # Nexa_Streamlit.py databases: created_at columns, no user/sender/image
+    cols = _columns(conn, "conversations")
+    if "created_at" in cols and "created" not in cols:
+        conn.execute("ALTER TABLE conversations RENAME COLUMN created_at TO created")
+    if "user" not in cols:
+        conn.execute("ALTER TABLE conversations ADD COLUMN user TEXT NOT NULL DEFAULT 'guest'")
+    if "version" not in cols:
+        conn.execute("ALTER TABLE conversations ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    cols = _columns(conn, "messages")
+    if "created_at" in cols and "timestamp" not in cols:
+        conn.execute("ALTER TABLE messages RENAME COLUMN created_at TO timestamp")
+    for col in ("sender", "image"):
+        if col not in cols:
+            conn.execute(f"ALTER TABLE messages ADD COLUMN {col} TEXT")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations(user, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_title ON conversations(title COLLATE NOCASE, id)")
+    nexa_summary.ensure_schema(conn)
+    nexa_codec.ensure_schema(conn)
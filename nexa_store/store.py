@@ -0,0 +1,259 @@
+# nexa_store/store.py
+# Conversation/message access for both apps. Rows come back as small
+# __slots__ objects (indexable like sqlite3.Row, as_dict() for JSON), SQL
+# strings are module constants so the statement cache hits, and every write
+# bumps the version counters behind Nexa.py's ETags in the same transaction.
+
+import threading
+from datetime import datetime
+
+import nexa_codec
+import nexa_summary
+import nexa_maintenance
+from .pool import ConnectionPool
+from .cache import TAILS
+from .writer import GROUP_COMMIT, GroupCommitWriter
+
+
+class _Row:
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__)})"
+
+
+class Conversation(_Row):
+    __slots__ = ("id", "user", "title", "created")
+
+    def __init__(self, id, user, title, created):
+        self.id, self.user, self.title, self.created = id, user, title, created
+
+
+class Message(_Row):
+    __slots__ = ("id", "sender", "role", "content", "image", "timestamp")
+
+    def __init__(self, id, sender, role, content, image, timestamp):
+        self.id, self.sender, self.role, self.content = id, sender, role, content
+        self.image, self.timestamp = image, timestamp
+
+
+def _message(r):
+    return Message(r[0], r[1], r[2], nexa_codec.decode(r[3], r[4]), r[5], r[6])
+
+
+_INSERT_CONVERSATION = "INSERT INTO conversations (user, title, created) VALUES (?, ?, ?)"
+_SELECT_CONVERSATION = "SELECT id, user, title, created FROM conversations WHERE id=?"
+_LIST = "SELECT id, user, title, created FROM conversations"
+_RENAME = "UPDATE conversations SET title=?, version=version+1 WHERE id=?"
+_INSERT_MESSAGE = ("INSERT INTO messages (conversation_id, sender, role, content, codec, image, timestamp) "
+                   "VALUES (?,?,?,?,?,?,?)")
+_SELECT_MESSAGES = ("SELECT id, sender, role, content, codec, image, timestamp FROM messages "
+                    "WHERE conversation_id=? ORDER BY id")
+_LATEST_MESSAGES = ("SELECT id, sender, role, content, codec, image, timestamp FROM messages "
+                    "WHERE conversation_id=? AND id<? ORDER BY id DESC LIMIT ?")
+_LAST_ROWID = "SELECT last_insert_rowid()"
+_CONTEXT = "SELECT version, summary, summary_upto FROM conversations WHERE id=?"
+_BUMP_CONVERSATION = "UPDATE conversations SET version=version+1 WHERE id=?"
+_BUMP_USER_MESSAGES = ("UPDATE user_versions SET messages=messages+1 "
+                       "WHERE user=(SELECT user FROM conversations WHERE id=?)")
+_BUMP_USER = ("INSERT INTO user_versions (user, version) VALUES (?, 1) "
+              "ON CONFLICT(user) DO UPDATE SET version=version+1")
+_CONVERSATION_VERSION = "SELECT version FROM conversations WHERE id=?"
+_USER_VERSION = "SELECT version FROM user_versions WHERE user=?"
+_USER_COUNTERS = "SELECT version, messages FROM user_versions WHERE user=?"
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+class Store:
+    """One database file's conversations and messages. Use get(path) to share
+    a Store (and its pool) across the process."""
+
+    def __init__(self, path, pool_size=8, group_commit=GROUP_COMMIT):
+        self.path = path
+        self.pool = ConnectionPool(path, size=pool_size)
+        # message inserts from all threads share commits (see writer.py)
+        self.writer = (GroupCommitWriter(path, _INSERT_MESSAGE, (_BUMP_CONVERSATION, _BUMP_USER_MESSAGES),
+                                         _CONVERSATION_VERSION)
+                       if group_commit else None)
+
+    def connection(self):
+        return self.pool.connection()
+
+    # ---------------------------
+    # Conversations
+    # ---------------------------
+    def create_conversation(self, user="guest", title=None):
+        with self.connection() as conn:
+            cid = conn.execute(_INSERT_CONVERSATION, (user, title, _now())).lastrowid
+            conn.execute(_BUMP_USER, (user,))
+        TAILS.put((self.path, cid), 0, [])      # empty at version 0; saves append from here on
+        return cid
+
+    def get_conversation(self, conv_id, user=None):
+        """The conversation, or None if missing (or not owned by `user` when given)."""
+        with self.connection() as conn:
+            row = conn.execute(_SELECT_CONVERSATION, (conv_id,)).fetchone()
+        if row is None or (user is not None and row[1] != user):
+            return None
+        return Conversation(*row)
+
+    def list_conversations(self, user=None, limit=None, before=None, prefix=None):
+        """Newest first; every conversation when user is None. Keyset paging: pass the
+        last id seen as `before`. `prefix` matches titles case-insensitively (ASCII)
+        through idx_conversations_title."""
+        where, params = [], []
+        if user is not None:
+            where.append("user=?"); params.append(user)
+        if before is not None:
+            where.append("id<?"); params.append(before)
+        if prefix:
+            # a range on the NOCASE index instead of LIKE, which could not use it
+            where.append("title>=? COLLATE NOCASE AND title<? COLLATE NOCASE")
+            params += [prefix, prefix + "\U0010ffff"]
+        sql = _LIST + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"; params.append(limit)
+        with self.connection() as conn:
+            return [Conversation(*r) for r in conn.execute(sql, params)]
+
+    def rename_conversation(self, conv_id, title, user=None, only_if_untitled=False):
+        """Returns the owner once renamed, or None when nothing was changed."""
+        with self.connection() as conn:
+            row = conn.execute(_SELECT_CONVERSATION, (conv_id,)).fetchone()
+            if row is None or (user is not None and row[1] != user) or (only_if_untitled and row[2]):
+                return None
+            conn.execute(_RENAME, (title, conv_id))
+            conn.execute(_BUMP_USER, (row[1],))
+            version = conn.execute(_CONVERSATION_VERSION, (conv_id,)).fetchone()[0]
+        TAILS.advance((self.path, conv_id), version)      # messages unchanged; keep the tail valid
+        return row[1]
+
+    def delete_conversation(self, conv_id, child_tables=("messages",)):
+        """Chunked delete (see nexa_maintenance); returns the owner, or None if missing."""
+        with self.connection() as conn:
+            row = conn.execute(_SELECT_CONVERSATION, (conv_id,)).fetchone()
+            nexa_maintenance.delete_conversation(conn, conv_id, child_tables, row[1] if row else None)
+        TAILS.discard((self.path, conv_id))
+        return row[1] if row else None
+
+    # ---------------------------
+    # Messages
+    # ---------------------------
+    def save_message(self, conv_id, role, content, sender=None, image=None):
+        self.save_messages(conv_id, [(sender, role, content, image)])
+
+    def save_messages(self, conv_id, items):
+        """Insert [(sender, role, content, image), ...] in one transaction. With group
+        commit, blocks until the writer thread has committed them."""
+        ts = _now()
+        rows = []
+        for sender, role, content, image in items:
+            body, codec = nexa_codec.encode(content)     # large bodies are compressed when NEXA_COMPRESS is on
+            rows.append((conv_id, sender, role, body, codec, image, ts))
+
+        def committed(last, version):
+            if version is not None:
+                first = last - len(items) + 1       # the batch got consecutive ids
+                TAILS.advance((self.path, conv_id), version,
+                              [Message(first + i, sender, role, content, image, ts)
+                               for i, (sender, role, content, image) in enumerate(items)])
+
+        if self.writer is not None:
+            self.writer.submit(conv_id, rows, committed).result(timeout=self.writer.timeout)
+            return
+        with self.connection() as conn:
+            conn.executemany(_INSERT_MESSAGE, rows)
+            last = conn.execute(_LAST_ROWID).fetchone()[0]
+            conn.execute(_BUMP_CONVERSATION, (conv_id,))
+            conn.execute(_BUMP_USER_MESSAGES, (conv_id,))
+            version = conn.execute(_CONVERSATION_VERSION, (conv_id,)).fetchone()
+        committed(last, version[0] if version else None)
+
+    def _tail(self, conn, conv_id, version):
+        """(newest messages, floor) at `version` from the tail cache, loaded on a miss.
+        conn must be inside the read transaction that returned `version`."""
+        key = (self.path, conv_id)
+        hit = TAILS.get(key, version)
+        if hit is not None:
+            return hit
+        rows = conn.execute(_LATEST_MESSAGES, (conv_id, 1 << 62, TAILS.tail + 1)).fetchall()
+        return TAILS.put(key, version, [_message(r) for r in reversed(rows)])
+
+    def load_messages(self, conv_id, limit=None, before=None):
+        """Oldest first. With limit, only the newest `limit` messages (older than id
+        `before` when given); the latest page comes from the tail cache."""
+        with self.connection() as conn:
+            if before is None:
+                conn.execute("BEGIN")           # version and tail from one snapshot
+                row = conn.execute(_CONVERSATION_VERSION, (conv_id,)).fetchone()
+                if row is not None:
+                    msgs, floor = self._tail(conn, conv_id, row[0])
+                    if limit is not None and limit <= len(msgs):
+                        return msgs[len(msgs) - limit:]
+                    if floor == 0:
+                        return msgs
+            if limit is None:
+                return [_message(r) for r in conn.execute(_SELECT_MESSAGES, (conv_id,))]
+            rows = conn.execute(_LATEST_MESSAGES, (conv_id, before or 1 << 62, limit)).fetchall()
+            return [_message(r) for r in reversed(rows)]
+
+    def prompt_context(self, conv_id):
+        """nexa_summary.prompt_context, with the unsummarized messages usually from the tail cache."""
+        with self.connection() as conn:
+            conn.execute("BEGIN")
+            row = conn.execute(_CONTEXT, (conv_id,)).fetchone()
+            if row is None:
+                return None, []
+            summary, upto = row[1], row[2] or 0
+            msgs, floor = self._tail(conn, conv_id, row[0])
+            if floor <= upto:
+                return summary, [(m.id, m.role, m.content) for m in msgs if m.id > upto]
+            return nexa_summary.prompt_context(conn, conv_id)
+
+    # ---------------------------
+    # Version counters
+    # ---------------------------
+    def conversation_version(self, conv_id):
+        with self.connection() as conn:
+            row = conn.execute(_CONVERSATION_VERSION, (conv_id,)).fetchone()
+        return row[0] if row else None
+
+    def user_version(self, user):
+        with self.connection() as conn:
+            row = conn.execute(_USER_VERSION, (user,)).fetchone()
+        return row[0] if row else 0
+
+    def user_counters(self, user):
+        """(user_version, message saves) for the user; both only ever grow."""
+        with self.connection() as conn:
+            row = conn.execute(_USER_COUNTERS, (user,)).fetchone()
+        return tuple(row) if row else (0, 0)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get(path):
+    """The process-wide Store for a database file."""
+    store = _stores.get(path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(path, Store(path))
+    return store
+
+
+def group_commit_stats():
+    """Writer counters per database file; empty while group commit is off."""
+    with _stores_lock:
+        stores = list(_stores.values())
+    return {s.path: s.writer.stats() for s in stores if s.writer is not None}
@@ -0,0 +1,144 @@
+# nexa_store/writer.py
+# Optional group commit for message inserts. With NEXA_GROUP_COMMIT=1 every
+# Store gets one writer thread that owns a connection; save_messages() queues
+# its rows and blocks on a Future. The thread commits everything queued in one
+# transaction: whatever arrived while the previous commit was running, up to
+# NEXA_GROUP_COMMIT_ROWS rows, optionally waiting NEXA_GROUP_COMMIT_MS after
+# the first request for more. One commit (one WAL sync, one trip through the
+# write lock) then covers many requests, and a lone request is not delayed.
+# Futures resolve only after that commit, so a caller reads its own write as
+# before. Each request runs in its own SAVEPOINT, so a failing insert only
+# fails its own caller; a failed batch fails all of its callers and the next
+# batch starts on a fresh connection, so the thread itself never dies. A
+# request's on_commit hook runs on the writer thread, in commit order, before
+# its Future resolves (Store uses it to advance the tail cache version by
+# version).
+#
+# Environment:
+#   NEXA_GROUP_COMMIT        1 = on (default off)
+#   NEXA_GROUP_COMMIT_ROWS   rows that flush a batch at once (default 256)
+#   NEXA_GROUP_COMMIT_MS     extra wait for more rows after the first (default 0)
+
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+
+log = logging.getLogger("nexa.store")
+
+GROUP_COMMIT = os.getenv("NEXA_GROUP_COMMIT", "0").lower() in ("1", "true", "on", "yes")
+MAX_ROWS = int(os.getenv("NEXA_GROUP_COMMIT_ROWS", "256"))
+MAX_WAIT = float(os.getenv("NEXA_GROUP_COMMIT_MS", "0")) / 1000
+
+
+class GroupCommitWriter:
+    def __init__(self, path, insert_sql, bump_sqls, version_sql, max_rows=MAX_ROWS, max_wait=MAX_WAIT, timeout=30):
+        self.path = path
+        self.insert_sql, self.bump_sqls, self.version_sql = insert_sql, tuple(bump_sqls), version_sql
+        self.max_rows = max(1, max_rows)
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._conn = None               # the writer thread's own connection
+        self.counters = {"requests": 0, "rows": 0, "commits": 0, "failed": 0}
+
+    def submit(self, conv_id, rows, on_commit=None):
+        """Queue rows for conv_id; the Future gives (last inserted id, new conversation
+        version or None). on_commit(last, version) runs once they are committed."""
+        self._ensure_thread()
+        fut = Future()
+        self._queue.put((conv_id, rows, on_commit, fut))
+        return fut
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():        # first use, or first use after a fork
+                self._pid = os.getpid()
+                self._queue, self._conn = queue.Queue(), None
+                threading.Thread(target=self._run, name="nexa-group-commit", daemon=True).start()
+
+    def _run(self):
+        q = self._queue
+        while True:
+            batch = [q.get()]
+            n = len(batch[0][1])
+            deadline = time.monotonic() + self.max_wait
+            while n < self.max_rows:
+                try:
+                    item = q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n += len(item[1])
+            try:
+                self._commit(batch)
+            except BaseException as e:          # never strand a caller on an unresolved Future
+                log.exception("group commit writer failed")
+                for *_, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    def _commit(self, batch):
+        results = []
+        conn = self._conn
+        try:
+            if conn is None:
+                conn = self._conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("BEGIN IMMEDIATE")
+            for conv_id, rows, _, fut in batch:
+                try:
+                    conn.execute("SAVEPOINT item")
+                    conn.executemany(self.insert_sql, rows)
+                    last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                    for sql in self.bump_sqls:
+                        conn.execute(sql, (conv_id,))
+                    version = conn.execute(self.version_sql, (conv_id,)).fetchone()
+                    conn.execute("RELEASE item")
+                    results.append((fut, (last, version[0] if version else None), None))
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO item")
+                    conn.execute("RELEASE item")
+                    results.append((fut, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            log.exception("group commit of %d requests failed", len(batch))
+            self._conn = None                   # possibly broken: the next batch reconnects
+            if conn is not None:
+                try:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            results = [(fut, None, e) for *_, fut in batch]
+        with self._lock:
+            self.counters["commits"] += 1
+            self.counters["requests"] += len(batch)
+            self.counters["rows"] += sum(len(item[1]) for item in batch)
+            self.counters["failed"] += sum(1 for _, _, e in results if e is not None)
+        # resolved only now: every caller's row is committed
+        for (_, _, on_commit, _), (fut, value, error) in zip(batch, results):
+            if error is None and on_commit is not None:
+                try:
+                    on_commit(*value)
+                except Exception:
+                    log.exception("group commit hook failed")
+            if error is None:
+                fut.set_result(value)
+            else:
+                fut.set_exception(error)
+
+    def stats(self):
+        with self._lock:
+            c = dict(self.counters)
+        c["rows_per_commit"] = round(c["rows"] / c["commits"], 2) if c["commits"] else None
+        c["queued"] = self._queue.qsize()
+        return c
+
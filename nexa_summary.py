@@ -0,0 +1,122 @@
+# nexa_summary.py
+# Rolling per-conversation summaries shared by Nexa.py and Nexa_Streamlit.py.
+# Every SUMMARY_EVERY unsummarized messages, the older ones are folded into
+# conversations.summary in the background. Prompts are then built from the
+# summary plus the messages after conversations.summary_upto, so prompt size
+# stays roughly flat however long a conversation runs.
+#
+# Environment:
+#   NEXA_SUMMARY_EVERY  unsummarized messages that trigger a fold (default 12)
+#   NEXA_SUMMARY_KEEP   most recent messages always sent verbatim (default 6)
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import nexa_codec
+
+log = logging.getLogger("nexa.summary")
+
+SUMMARY_EVERY = int(os.getenv("NEXA_SUMMARY_EVERY", "12"))
+KEEP_RECENT = int(os.getenv("NEXA_SUMMARY_KEEP", "6"))
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and the assistant NEXA. "
+    "Merge the new messages into the existing summary. Keep names, facts, decisions, open "
+    "questions and the user's goals. Plain text, at most 200 words."
+)
+
+
+def ensure_schema(conn):
+    """Add the summary columns to an existing conversations table."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(conversations)")}
+    if "summary" not in cols:
+        conn.execute("ALTER TABLE conversations ADD COLUMN summary TEXT")
+    if "summary_upto" not in cols:
+        conn.execute("ALTER TABLE conversations ADD COLUMN summary_upto INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv ON messages(conversation_id, id)")
+
+
+def prompt_context(conn, conv_id):
+    """(summary or None, [(id, role, content), ...] not yet folded into the summary)"""
+    row = conn.execute("SELECT summary, summary_upto FROM conversations WHERE id=?", (conv_id,)).fetchone()
+    summary, upto = (row[0], row[1]) if row else (None, 0)
+    recent = conn.execute(
+        "SELECT id, role, content, codec FROM messages WHERE conversation_id=? AND id>? ORDER BY id",
+        (conv_id, upto or 0)).fetchall()
+    return summary, [(r[0], r[1], nexa_codec.decode(r[2], r[3])) for r in recent]
+
+
+def summary_message(summary):
+    return {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+
+
+class Summarizer:
+    """Folds old messages into the conversation summary off the request path.
+
+    connect(conv_id)  -> new sqlite3 connection to the database holding that conversation
+    complete(msgs)    -> summary text from the LLM (may raise)
+    submit(conv_id)   -> optional hand-off to an external job queue; by default
+                         folds run on a private single-thread pool
+    """
+
+    def __init__(self, connect, complete, every=SUMMARY_EVERY, keep=KEEP_RECENT, submit=None):
+        self.connect = connect
+        self.complete = complete
+        self.submit = submit
+        self.every = max(1, every)
+        self.keep = max(0, keep)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._pool = None if submit else ThreadPoolExecutor(max_workers=1, thread_name_prefix="nexa-summary")
+
+    def maybe_schedule(self, conv_id, unsummarized):
+        """Call after assembling a prompt with the number of unfolded messages."""
+        if unsummarized < self.every + self.keep:
+            return False
+        if self.submit is not None:
+            self.submit(conv_id)
+            return True
+        with self._lock:
+            if conv_id in self._pending:
+                return False
+            self._pending.add(conv_id)
+        self._pool.submit(self._run, conv_id)
+        return True
+
+    def _run(self, conv_id):
+        try:
+            self.fold(conv_id)
+        except Exception:
+            log.exception("summary fold failed for conversation %s", conv_id)
+        finally:
+            with self._lock:
+                self._pending.discard(conv_id)
+
+    def fold(self, conv_id):
+        conn = self.connect(conv_id)
+        try:
+            row = conn.execute("SELECT summary, summary_upto FROM conversations WHERE id=?", (conv_id,)).fetchone()
+            if not row:
+                return False
+            summary, upto = row[0], row[1] or 0
+            _, recent = prompt_context(conn, conv_id)
+            if len(recent) <= self.keep:
+                return False
+            folded = recent[:-self.keep] if self.keep else recent
+            transcript = "\n".join(f"{role}: {content}" for _, role, content in folded)
+            new_summary = self.complete([
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"},
+            ]).strip()
+            if not new_summary:
+                return False
+            # only apply on top of the summary we read; a concurrent fold wins otherwise
+            cur = conn.execute(
+                "UPDATE conversations SET summary=?, summary_upto=? WHERE id=? AND summary_upto=?",
+                (new_summary, folded[-1][0], conv_id, upto))
+            conn.commit()
+            return cur.rowcount > 0
+        finally:
+            conn.close()
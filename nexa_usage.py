@@ -0,0 +1,258 @@
+# nexa_usage.py
+# Token/cost metering for LLM calls, shared by Nexa.py and Nexa_Streamlit.py.
+# HedgedClient.on_usage hands each call's record to Meter.record(), which only
+# appends to a bounded in-memory queue; a writer thread batches the queue into
+# the raw `usage` table and the `usage_hourly`/`usage_daily` rollups, one
+# transaction per batch. Per-user daily quotas are checked against an
+# in-memory counter, seeded from usage_daily and re-synced every REFRESH
+# seconds so several server processes converge on the shared total.
+#
+# Environment:
+#   NEXA_QUOTA_DAILY_TOKENS  prompt+completion tokens per user per UTC day (0 = unlimited)
+#   NEXA_USAGE_KEEP_DAYS     days of raw `usage` rows kept; rollups are kept (default 30)
+
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from html import escape
+
+log = logging.getLogger("nexa.usage")
+
+BATCH = 500             # records per write transaction
+FLUSH_EVERY = 1.0       # seconds a record may wait for a batch
+MAX_QUEUED = 10000      # past this, records are dropped (counted) rather than blocking a reply
+REFRESH = 60.0          # seconds between re-reads of a user's daily total
+PRUNE_EVERY = 3600.0
+
+
+def ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS usage (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      ts REAL NOT NULL,
+      user TEXT NOT NULL,
+      mode TEXT NOT NULL,
+      model TEXT NOT NULL,
+      prompt_tokens INTEGER NOT NULL,
+      completion_tokens INTEGER NOT NULL,
+      cost REAL,
+      latency_ms INTEGER NOT NULL,
+      ok INTEGER NOT NULL
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_ts ON usage(ts)")
+    for table in ("usage_hourly", "usage_daily"):
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+          bucket TEXT NOT NULL,
+          user TEXT NOT NULL,
+          mode TEXT NOT NULL,
+          model TEXT NOT NULL,
+          calls INTEGER NOT NULL DEFAULT 0,
+          errors INTEGER NOT NULL DEFAULT 0,
+          prompt_tokens INTEGER NOT NULL DEFAULT 0,
+          completion_tokens INTEGER NOT NULL DEFAULT 0,
+          cost REAL NOT NULL DEFAULT 0,
+          latency_ms INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY (bucket, user, mode, model)
+        )""")
+
+
+_INSERT = ("INSERT INTO usage (ts, user, mode, model, prompt_tokens, completion_tokens, cost, latency_ms, ok) "
+           "VALUES (?,?,?,?,?,?,?,?,?)")
+_ROLLUP = ("INSERT INTO {table} (bucket, user, mode, model, calls, errors, prompt_tokens, completion_tokens, cost, latency_ms) "
+           "VALUES (?,?,?,?,?,?,?,?,?,?) ON CONFLICT(bucket, user, mode, model) DO UPDATE SET "
+           "calls=calls+excluded.calls, errors=errors+excluded.errors, prompt_tokens=prompt_tokens+excluded.prompt_tokens, "
+           "completion_tokens=completion_tokens+excluded.completion_tokens, cost=cost+excluded.cost, "
+           "latency_ms=latency_ms+excluded.latency_ms")
+_DAY_TOTAL = "SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM usage_daily WHERE bucket=? AND user=?"
+
+
+def _day(ts):
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+def _hour(ts):
+    return time.strftime("%Y-%m-%dT%H", time.gmtime(ts))
+
+
+class Meter:
+    def __init__(self, db_path, daily_tokens=None, keep_days=None):
+        self.db_path = db_path
+        self.daily_tokens = int(daily_tokens if daily_tokens is not None else os.getenv("NEXA_QUOTA_DAILY_TOKENS", "0"))
+        self.keep_days = int(keep_days if keep_days is not None else os.getenv("NEXA_USAGE_KEEP_DAYS", "30"))
+        self._queue = queue.Queue(MAX_QUEUED)
+        self._lock = threading.Lock()
+        self._used = {}             # user -> [day, tokens, synced_at]
+        self._thread = None
+        self._pid = None
+        self._pruned = 0.0
+        self.counters = {"recorded": 0, "written": 0, "dropped": 0, "refused": 0, "write_errors": 0}
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    # ---------------------------
+    # Hot path
+    # ---------------------------
+    def record(self, rec):
+        """HedgedClient.on_usage callback: count toward the quota and queue for writing."""
+        rec = dict(rec, ts=time.time(), user=rec.get("user") or "-", mode=rec.get("mode") or "-")
+        tokens = rec["prompt_tokens"] + rec["completion_tokens"]
+        with self._lock:
+            entry = self._used.get(rec["user"])
+            if entry is not None and entry[0] == _day(rec["ts"]):
+                entry[1] += tokens
+            self.counters["recorded"] += 1
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(rec)
+        except queue.Full:
+            with self._lock:
+                self.counters["dropped"] += 1
+
+    def used_today(self, user):
+        now = time.time()
+        day = _day(now)
+        with self._lock:
+            entry = self._used.get(user)
+        if entry is None or entry[0] != day or now - entry[2] > REFRESH:
+            conn = self._connect()
+            try:
+                stored = conn.execute(_DAY_TOTAL, (day, user)).fetchone()[0]
+            except sqlite3.OperationalError:
+                stored = 0          # schema not created yet
+            finally:
+                conn.close()
+            with self._lock:
+                entry = self._used.get(user)
+                # the local count also holds records still queued for writing
+                local = entry[1] if entry is not None and entry[0] == day else 0
+                entry = self._used[user] = [day, max(local, stored), now]
+        return entry[1]
+
+    def allow(self, user):
+        """False once user has spent today's token quota."""
+        if self.daily_tokens <= 0:
+            return True
+        if self.used_today(user or "-") < self.daily_tokens:
+            return True
+        with self._lock:
+            self.counters["refused"] += 1
+        return False
+
+    # ---------------------------
+    # Writer
+    # ---------------------------
+    def _ensure_writer(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():        # first record, or first in a forked worker
+                self._pid = os.getpid()
+                self._queue = queue.Queue(MAX_QUEUED)   # the parent's queued records are the parent's to write
+                self._thread = threading.Thread(target=self._run, name="nexa-usage", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + FLUSH_EVERY
+            while len(batch) < BATCH:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                log.exception("usage write failed")
+                with self._lock:
+                    self.counters["write_errors"] += 1
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        rows = [(r["ts"], r["user"], r["mode"], r["model"], r["prompt_tokens"], r["completion_tokens"],
+                 r.get("cost"), r["latency_ms"], int(bool(r["ok"]))) for r in batch]
+        rollups = {"usage_hourly": {}, "usage_daily": {}}
+        for r in batch:
+            for table, bucket in (("usage_hourly", _hour(r["ts"])), ("usage_daily", _day(r["ts"]))):
+                acc = rollups[table].setdefault((bucket, r["user"], r["mode"], r["model"]), [0, 0, 0, 0, 0.0, 0])
+                acc[0] += 1
+                acc[1] += 0 if r["ok"] else 1
+                acc[2] += r["prompt_tokens"]
+                acc[3] += r["completion_tokens"]
+                acc[4] += r.get("cost") or 0.0
+                acc[5] += r["latency_ms"]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(_INSERT, rows)
+                for table, groups in rollups.items():
+                    conn.executemany(_ROLLUP.format(table=table), [k + tuple(v) for k, v in groups.items()])
+            if self.keep_days and time.monotonic() - self._pruned > PRUNE_EVERY:
+                self._pruned = time.monotonic()
+                cutoff = time.time() - self.keep_days * 86400
+                while conn.execute("DELETE FROM usage WHERE id IN (SELECT id FROM usage WHERE ts<? LIMIT 500)",
+                                   (cutoff,)).rowcount:
+                    conn.commit()
+                conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self.counters["written"] += len(rows)
+
+    def flush(self):
+        """Block until everything recorded so far is written (CLI/shutdown)."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    # ---------------------------
+    # Reports
+    # ---------------------------
+    def rollup(self, table="usage_daily", since=None, by=("bucket", "user")):
+        """Summed rows of usage_daily/usage_hourly grouped by `by`, newest bucket first."""
+        assert table in ("usage_daily", "usage_hourly") and set(by) <= {"bucket", "user", "mode", "model"}
+        cols = ", ".join(by)
+        sql = (f"SELECT {cols}, SUM(calls), SUM(errors), SUM(prompt_tokens), SUM(completion_tokens), "
+               f"ROUND(SUM(cost), 6), SUM(latency_ms) / MAX(SUM(calls), 1) FROM {table}"
+               + (" WHERE bucket>=?" if since else "") + f" GROUP BY {cols} ORDER BY {cols.replace('bucket', 'bucket DESC')}")
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, (since,) if since else ()).fetchall()
+        except sqlite3.OperationalError:
+            return []
+        finally:
+            conn.close()
+        keys = list(by) + ["calls", "errors", "prompt_tokens", "completion_tokens", "cost", "avg_latency_ms"]
+        return [dict(zip(keys, r)) for r in rows]
+
+    def stats(self):
+        day = _day(time.time())
+        users = self.rollup("usage_daily", day, by=("user",))
+        top = sorted(users, key=lambda r: r["prompt_tokens"] + r["completion_tokens"], reverse=True)[:10]
+        by_mode = self.rollup("usage_daily", day, by=("mode", "model"))
+        with self._lock:
+            counters = dict(self.counters)
+        return dict(counters, queued=self._queue.qsize(), daily_quota=self.daily_tokens,
+                    today_by_mode=by_mode, today_top_users=top)
+
+
+def report_html(daily, hourly):
+    """Admin page: per-user daily rollups and the last hours by mode/model."""
+    def table(rows, first):
+        head = "".join(f"<th>{h}</th>" for h in first + ["calls", "errors", "prompt", "completion", "cost", "avg ms"])
+        body = "".join("<tr>" + "".join(f"<td>{escape(str(r[k]))}</td>" for k in first) +
+                       f"<td>{r['calls']}</td><td>{r['errors']}</td><td>{r['prompt_tokens']}</td>"
+                       f"<td>{r['completion_tokens']}</td><td>{r['cost'] or ''}</td><td>{r['avg_latency_ms']}</td></tr>"
+                       for r in rows)
+        return f"<table><tr>{head}</tr>{body}</table>"
+
+    return ("<html><head><title>Usage</title><style>body{background:#000;color:#fff;font-family:Inter;padding:20px}"
+            "td,th{padding:4px 10px;text-align:left}</style></head><body>"
+            "<h2>Last 24 hours by mode and model</h2>" + table(hourly, ["bucket", "mode", "model"]) +
+            "<h2>Daily by user</h2>" + table(daily, ["bucket", "user"]) + "</body></html>")
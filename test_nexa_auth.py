@@ -0,0 +1,55 @@
+import os
+import time
+import signal
+
+import pytest
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import nexa_auth
+
+METHOD = "pbkdf2:sha256:1000"       # cheap, so the tests time the pool and not the hash
+
+
+@pytest.fixture
+def hasher():
+    h = nexa_auth.PasswordHasher(METHOD, workers=1, max_pending=1)
+    yield h
+    h.shutdown()
+
+
+def test_saturated_pool_refuses_at_once(hasher):
+    assert hasher._slots.acquire(blocking=False)        # the one slot is taken by a sign-in in flight
+    try:
+        started = time.monotonic()
+        with pytest.raises(nexa_auth.Busy):
+            hasher.hash("pw")
+        assert time.monotonic() - started < 0.2
+        assert hasher.rehash_later("pw", lambda h: None) is False
+    finally:
+        hasher._slots.release()
+    assert hasher.stats()["busy"] == 1
+    assert check_password_hash(hasher.hash("pw"), "pw")
+
+
+def test_recovers_from_a_dead_hashing_process(hasher):
+    pwhash = hasher.hash("pw")
+    for pid in list(hasher._pool._processes):
+        os.kill(pid, signal.SIGKILL)                    # e.g. the OOM killer
+    time.sleep(0.2)
+    assert hasher.verify(pwhash, "pw")
+    assert hasher.stats()["pool_restarts"] == 1
+
+
+@pytest.mark.parametrize("method", ["scrypt", "scrypt:16384:8:1", "pbkdf2", "pbkdf2:sha512", METHOD])
+def test_needs_rehash_matches_werkzeug(method):
+    h = nexa_auth.PasswordHasher(method)
+    assert not h.needs_rehash(generate_password_hash("pw", method))
+    assert h.needs_rehash(generate_password_hash("pw", "pbkdf2:sha256:999"))
+
+
+def test_rate_limiter_window():
+    limit = nexa_auth.RateLimiter(2, 60)
+    assert limit.hit("ip") == 0 and limit.hit("ip") == 0
+    assert limit.hit("ip") > 0 and limit.retry_after("ip") > 0
+    limit.reset("ip")
+    assert limit.retry_after("ip") == 0
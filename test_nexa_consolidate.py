@@ -0,0 +1,85 @@
+import io
+import hashlib
+import sqlite3
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+import Nexa
+import nexa_consolidate
+
+USER = "godserajnil@gmail.com"
+PASSWORD = "correct horse"
+
+
+def _source(path, pwhash):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT)")
+    conn.execute("CREATE TABLE conversations (id INTEGER PRIMARY KEY, user TEXT, title TEXT, created TEXT)")
+    conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, conversation_id INTEGER, sender TEXT, role TEXT, "
+                 "content TEXT, timestamp TEXT)")
+    conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (USER, pwhash))
+    conn.execute("INSERT INTO conversations (id, user, title, created) VALUES (1, ?, 'old chat', '2024-01-01 10:00:00')",
+                 (USER,))
+    conn.execute("INSERT INTO messages (conversation_id, sender, role, content, timestamp) "
+                 "VALUES (1, ?, 'user', 'hi', '2024-01-01 10:00:00')", (USER,))
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+@pytest.fixture
+def target(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    saved = Nexa.CONFIG
+    cfg = Nexa.configure(Nexa.load_config({"DB_FILE": str(tmp_path / "target.db"), "SHARDS": 0}))
+    Nexa.init_db()
+    yield cfg["DB_FILE"]
+    Nexa.configure(saved)
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    # nexa_chat.db stored a bare sha256 hex digest
+    return _source(tmp_path / "nexa_chat.db", hashlib.sha256(PASSWORD.encode()).hexdigest())
+
+
+@pytest.fixture
+def current(tmp_path):
+    return _source(tmp_path / "nexa_singlefile.db", generate_password_hash(PASSWORD, "pbkdf2:sha256:1000"))
+
+
+def _password(db):
+    conn = sqlite3.connect(db)
+    try:
+        return conn.execute("SELECT password FROM users WHERE username=?", (USER,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("order", ["legacy_first", "current_first"])
+def test_user_can_log_in_whatever_the_merge_order(target, legacy, current, order):
+    sources = [legacy, current] if order == "legacy_first" else [current, legacy]
+    for src in sources:
+        assert nexa_consolidate.consolidate(target, src, pause=0, out=io.StringIO())
+    assert _password(target).startswith("pbkdf2:sha256:1000$")
+    assert Nexa.verify_user(USER, PASSWORD)
+    assert not Nexa.verify_user(USER, "wrong")
+
+
+def test_valid_hash_replaces_a_legacy_one_already_in_the_target(target, current):
+    conn = sqlite3.connect(target)
+    conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (USER, "67d59bd680ec8e85" * 4))
+    conn.commit()
+    conn.close()
+    nexa_consolidate.consolidate(target, current, pause=0, out=io.StringIO())
+    assert Nexa.verify_user(USER, PASSWORD)
+
+
+def test_legacy_only_user_is_not_copied(target, legacy):
+    out = io.StringIO()
+    assert nexa_consolidate.consolidate(target, legacy, pause=0, out=out)
+    conn = sqlite3.connect(target)
+    assert conn.execute("SELECT COUNT(*) FROM users WHERE username=?", (USER,)).fetchone()[0] == 0
+    conn.close()
+    assert "1 legacy password hashes not copied" in out.getvalue()
@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+import nexa_llm
+
+URL = "https://llm.invalid/chat/completions"
+
+
+def fake_stream(script):
+    """_stream stand-in. script[model] = (first-token delay or None for never, outcome), outcome
+    'ok' (streams "reply from <model>" with usage), 'http' (HTTP error) or 'drop' (fails mid-stream)."""
+    def _stream(attempt, api_key, payload, timeout, events):
+        delay, outcome = script[attempt.model]
+        try:
+            if outcome == "http":
+                raise nexa_llm.LLMError(f"{attempt.model}: HTTP 503")
+            attempt.accepted = True
+            attempt.chars = 40                  # streamed so far, whatever happens next
+            end = time.monotonic() + (delay if delay is not None else 5)
+            while time.monotonic() < end:
+                if attempt.cancelled:
+                    return
+                time.sleep(0.005)
+            if delay is None:
+                return
+            if outcome == "drop":
+                raise nexa_llm.LLMError(f"{attempt.model}: connection reset")
+            attempt.ttft = time.monotonic() - attempt.started
+            events.put(("first", attempt))
+            attempt.usage = {"prompt_tokens": 12, "completion_tokens": 5, "cost": 0.001}
+            attempt.text = f"reply from {attempt.model}"
+        except Exception as e:
+            attempt.error = e
+        finally:
+            events.put(("done", attempt))
+    return _stream
+
+
+@pytest.fixture
+def client():
+    c = nexa_llm.HedgedClient([("primary", URL), ("backup", URL)], "key")
+    c.default_delay = c.min_delay = 0.05
+    c.records = []
+    c.on_usage = c.records.append
+    return c
+
+
+def _by_model(records):
+    return {r["model"]: r for r in records}
+
+
+def test_hedge_winner_and_cancelled_loser_are_both_metered(client, monkeypatch):
+    monkeypatch.setattr(nexa_llm, "_stream", fake_stream({"primary": (None, "ok"), "backup": (0.02, "ok")}))
+    assert client.complete([{"role": "user", "content": "hi"}], tags={"user": "alice", "mode": "chat"}) \
+        == "reply from backup"
+    time.sleep(0.05)
+    records = _by_model(client.records)
+    assert len(client.records) == 2
+    assert records["backup"]["mode"] == "chat" and records["backup"]["completion_tokens"] == 5
+    loser = records["primary"]
+    assert loser["mode"] == "chat:hedge" and loser["user"] == "alice"
+    assert loser["prompt_tokens"] == 12 and loser["completion_tokens"] == 10     # 40 chars, ~4 per token
+    stats = client.stats()
+    assert stats["hedged"] == 1 and stats["backup_wins"] == 1
+
+
+def test_cancelled_slow_primary_adds_a_lower_bound_sample(client, monkeypatch):
+    monkeypatch.setattr(nexa_llm, "_stream", fake_stream({"primary": (None, "ok"), "backup": (0.02, "ok")}))
+    client.complete([{"role": "user", "content": "hi"}])
+    samples = sorted(client._ttfts)
+    assert len(samples) == 2
+    assert samples[1] >= 0.05 > samples[0]      # the primary waited past the hedge deadline
+
+
+def test_backup_that_lost_to_the_primary_is_not_sampled(client, monkeypatch):
+    monkeypatch.setattr(nexa_llm, "_stream", fake_stream({"primary": (0.1, "ok"), "backup": (None, "ok")}))
+    assert client.complete([{"role": "user", "content": "hi"}]) == "reply from primary"
+    assert len(client._ttfts) == 1
+    time.sleep(0.05)
+    assert [r.get("mode") for r in client.records] == [None, "-:hedge"]
+
+
+def test_fallback_meters_only_attempts_the_upstream_accepted(client, monkeypatch):
+    client.max_backups = 0
+    monkeypatch.setattr(nexa_llm, "_stream", fake_stream({"primary": (0.01, "http"), "backup": (0.01, "ok")}))
+    assert client.complete([{"role": "user", "content": "hi"}]) == "reply from backup"
+    assert [r["model"] for r in client.records] == ["backup"]
+    assert client.stats()["fallback_wins"] == 1
+
+
+def test_dropped_stream_is_metered_as_failed_hedge(client, monkeypatch):
+    client.max_backups = 0
+    monkeypatch.setattr(nexa_llm, "_stream", fake_stream({"primary": (0.01, "drop"), "backup": (0.01, "ok")}))
+    assert client.complete([{"role": "user", "content": "hi"}]) == "reply from backup"
+    loser = _by_model(client.records)["primary"]
+    assert loser["ok"] is False and loser["mode"] == "-:hedge"
+
+
+def test_every_model_failing_raises_and_meters_the_failure(client, monkeypatch):
+    monkeypatch.setattr(nexa_llm, "_stream", fake_stream({"primary": (0.01, "http"), "backup": (0.01, "http")}))
+    with pytest.raises(nexa_llm.LLMError):
+        client.complete([{"role": "user", "content": "hi"}])
+    assert [(r["model"], r["ok"]) for r in client.records] == [("backup", False)]
+    assert client.stats()["failures"] == 1
@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+import nexa_maintenance
+import nexa_store
+from nexa_store import TAILS
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / "store.db")
+    conn = sqlite3.connect(path)
+    nexa_store.ensure_schema(conn)
+    conn.commit()
+    conn.close()
+    s = nexa_store.Store(path, group_commit=False)
+    yield s
+    s.pool.close()
+
+
+def test_tail_cache_serves_writes_from_another_connection(store):
+    cid = store.create_conversation("alice")
+    store.save_message(cid, "user", "one", sender="alice")
+    assert [m.content for m in store.load_messages(cid)] == ["one"]
+    # another process inserts a message; the version bump must invalidate the cached tail
+    conn = sqlite3.connect(store.path)
+    conn.execute("INSERT INTO messages (conversation_id, sender, role, content) VALUES (?, 'alice', 'user', 'two')",
+                 (cid,))
+    conn.execute("UPDATE conversations SET version=version+1 WHERE id=?", (cid,))
+    conn.commit()
+    conn.close()
+    assert [m.content for m in store.load_messages(cid)] == ["one", "two"]
+
+
+def test_rename_keeps_tail_and_bumps_user_version(store):
+    cid = store.create_conversation("alice")
+    store.save_message(cid, "user", "hello", sender="alice")
+    store.load_messages(cid)
+    before = store.user_version("alice")
+    assert store.rename_conversation(cid, "Greetings", user="alice") == "alice"
+    assert store.user_version("alice") == before + 1
+    assert TAILS.get((store.path, cid), store.conversation_version(cid)) is not None
+    assert [m.content for m in store.load_messages(cid)] == ["hello"]
+    assert store.rename_conversation(cid, "Other", user="bob") is None
+
+
+def test_delete_drops_tail_and_bumps_user_version_with_the_row(store, monkeypatch):
+    cid = store.create_conversation("alice")
+    store.save_messages(cid, [("alice", "user", f"m{i}", None) for i in range(5)])
+    store.load_messages(cid)
+    before = store.user_version("alice")
+    seen = []
+    real = nexa_maintenance.delete_in_chunks
+
+    def spy(conn, table, where, params=(), **kw):
+        # children are deleted after the row's commit; by then a reader must see the new version
+        other = sqlite3.connect(store.path)
+        seen.append(other.execute("SELECT version FROM user_versions WHERE user='alice'").fetchone()[0])
+        other.close()
+        return real(conn, table, where, params, **kw)
+
+    monkeypatch.setattr(nexa_maintenance, "delete_in_chunks", spy)
+    assert store.delete_conversation(cid) == "alice"
+    assert seen == [before + 1]
+    assert store.user_version("alice") == before + 1
+    assert TAILS.get((store.path, cid), 0) is None
+    assert store.get_conversation(cid) is None
+    assert store.load_messages(cid) == []
@@ -0,0 +1,80 @@
+# tools/bench_startup.py
+# Cold-start benchmark for Nexa.py. Every run is a fresh interpreter in an
+# empty temporary directory: it imports Nexa, builds the app with
+# create_app(), serves one GET /login through the WSGI test client, then times
+# init_db() on its own (a deploy step, not part of startup). The parent prints
+# the median of each phase and exits 1 when time to first request, measured
+# from process launch, is over the budget. It also reports any file that the
+# import alone created; that list should stay empty.
+#
+#   python tools/bench_startup.py                       (5 runs, 1500 ms budget)
+#   python tools/bench_startup.py --runs 10 --budget-ms 800 --json
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import os, sys, json, time
+t0 = time.perf_counter()
+sys.path.insert(0, ROOT)
+import Nexa
+t1 = time.perf_counter()
+after_import = sorted(os.listdir("."))
+app = Nexa.create_app()
+t2 = time.perf_counter()
+status = app.test_client().get("/login").status_code
+t3 = time.perf_counter()
+Nexa.init_db()
+t4 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "create_app_ms": (t2 - t1) * 1000,
+                  "first_request_ms": (t3 - t2) * 1000, "init_db_ms": (t4 - t3) * 1000,
+                  "in_process_ms": (t3 - t0) * 1000, "status": status, "import_created": after_import}))
+"""
+
+
+def run_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, NEXA_DB_FILE=os.path.join(tmp, "bench.db"), PYTHONDONTWRITEBYTECODE="1")
+        started = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", f"ROOT = {ROOT!r}\n" + CHILD], cwd=tmp, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        wall = (time.perf_counter() - started) * 1000
+    result = json.loads(out.strip().splitlines()[-1])
+    # launch -> first response; the interpreter's own startup is the part not timed inside
+    result["to_first_request_ms"] = wall - result["init_db_ms"]
+    result["interpreter_ms"] = result["to_first_request_ms"] - result["in_process_ms"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for Nexa.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("NEXA_STARTUP_BUDGET_MS", "1500")))
+    parser.add_argument("--json", action="store_true", help="print the medians as JSON")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    phases = ["interpreter_ms", "import_ms", "create_app_ms", "first_request_ms", "to_first_request_ms", "init_db_ms"]
+    medians = {p: round(statistics.median(r[p] for r in runs), 1) for p in phases}
+    created = sorted({name for r in runs for name in r["import_created"]})
+    ok = medians["to_first_request_ms"] <= args.budget_ms and all(r["status"] == 200 for r in runs)
+    if args.json:
+        print(json.dumps(dict(medians, runs=args.runs, budget_ms=args.budget_ms, import_created=created, ok=ok)))
+    else:
+        for p in phases:
+            print(f"{p[:-3]:<20} {medians[p]:8.1f} ms")
+        print(f"{'import created':<20} {', '.join(created) or 'nothing'}")
+        print(f"{'budget':<20} {args.budget_ms:8.1f} ms  {'OK' if ok else 'OVER'}  (median of {args.runs} runs)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
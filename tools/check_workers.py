@@ -0,0 +1,88 @@
+# tools/check_workers.py
+# Multi-worker session check for Nexa.py. Starts gunicorn with
+# gunicorn.conf.py (gthread workers, shared instance/secret_key) in an empty
+# temporary directory, registers one user, then sends GET /whoami with that
+# session cookie on a fresh connection each time, so the requests spread over
+# the workers. The worker pid behind each response comes from gunicorn's access
+# log. Exits 1 unless every response reports the user and more than one
+# worker answered.
+#
+#   python tools/check_workers.py                      (4 workers, 40 requests)
+#   python tools/check_workers.py --workers 8 --requests 200
+
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(base, proc, timeout=30):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {proc.returncode}")
+        try:
+            return requests.get(base + "/login", timeout=2)
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-worker session check for Nexa.py")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        base = f"http://127.0.0.1:{port}"
+        access_log = os.path.join(tmp, "access.log")
+        env = dict(os.environ, NEXA_DB_FILE=os.path.join(tmp, "check.db"), NEXA_BIND=f"127.0.0.1:{port}",
+                   NEXA_WORKERS=str(args.workers), PYTHONPATH=ROOT)
+        env.pop("NEXA_SECRET_KEY", None)        # exercise the instance/secret_key file the workers share
+        proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+                                 "--access-logfile", access_log, "--access-logformat", "%(p)s %(U)s %(s)s",
+                                 "--graceful-timeout", "5"],      # the check needs no long drain
+                                cwd=tmp, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(base, proc)
+            user = "check_workers"
+            r = requests.post(base + "/register", data={"username": user, "password": "check-workers-pw"},
+                              allow_redirects=False, timeout=30)
+            cookie = r.cookies.get("session")
+            if not cookie:
+                print(f"register failed: HTTP {r.status_code}")
+                return 1
+            seen = [requests.get(base + "/whoami", cookies={"session": cookie}, timeout=10).json().get("user")
+                    for _ in range(args.requests)]
+            time.sleep(0.5)                     # access log lines are written after the response
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+        with open(access_log) as f:
+            pids = {line.split()[0] for line in f if " /whoami " in line}
+
+    valid = sum(1 for u in seen if u == user)
+    ok = valid == args.requests and len(pids) > 1
+    print(f"{'session valid':<16} {valid}/{args.requests} requests")
+    print(f"{'workers used':<16} {len(pids)} of {args.workers}")
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
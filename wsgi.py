@@ -0,0 +1,8 @@
+# wsgi.py
+# Production entry point for Nexa.py, e.g.:
+#   gunicorn -c gunicorn.conf.py            (uses wsgi:app)
+#   waitress-serve --port=5000 wsgi:app
+from Nexa import JOBS, create_app
+
+app = create_app()
+JOBS.start()        # drain jobs persisted before a restart without waiting for new work